@@ -476,6 +476,19 @@ class BuildBundle(Bundle):
         
         return ilr(self.log, N=N, message=message, print_rate = print_rate)
 
+    def scheduler(self, n_workers=None, retries=0):
+        '''Return a TaskScheduler for running bundle methods, usually one per 
+        partition, on multiple processes. If n_workers is not specified, uses 
+        the value of the -m/--multi argument, and runs tasks serially if that
+        is not set either. '''
+        from scheduler import TaskScheduler
+        
+        if n_workers is None:
+            run_args = getattr(self, 'run_args', None)
+            n_workers = run_args.multi if run_args else None
+        
+        return TaskScheduler(self, n_workers = n_workers, retries = retries)
+
 
 
     ### Prepare is run before building, part of the devel process.  
@@ -709,11 +722,25 @@ class BuildBundle(Bundle):
     
         return True
     
-    def post_build_write_stats(self):
+    def post_build_write_stats(self, n_workers=None):
+        '''Write the stats for all of the partitions. Partitions that have 
+        statistics collected by their inserters in this process, and 
+        non-database partitions, are written here. The others have to be 
+        scanned, which is done by write_partition_stats() tasks on the 
+        scheduler, in parallel if n_workers or the -m option is set. The 
+        partition records from the tasks are merged in one transaction. '''
         from sqlalchemy.exc import OperationalError
+        from partition.sqlite import SqlitePartition
+        
+        scan = []
         
         # Create stat entries for all of the partitions. 
         for p in self.partitions:
+            
+            if isinstance(p, SqlitePartition) and not p.collected_stats:
+                scan.append(p)
+                continue
+            
             try:
                 self.log("Writting stats for: {}".format(p.identity.name))
                 p.write_stats()
@@ -725,6 +752,47 @@ class BuildBundle(Bundle):
                 self.error("Failed to write stats for partition {}: {}".format(p.identity.name, e.message))
                 raise
                     
+        if not scan:
+            return
+        
+        s = self.scheduler(n_workers = n_workers)
+        
+        for p in scan:
+            self.log("Writting stats for: {}".format(p.identity.name))
+            s.add(p.identity.vid, 'write_partition_stats', p.identity.vid)
+            
+        s.run()
+        
+        with self.session as session:
+            for p in scan:
+                task = s.tasks[p.identity.vid]
+                
+                if task.state != task.DONE or not task.result:
+                    continue
+                
+                p.record.count = task.result['count']
+                p.record.min_key = task.result['min_key']
+                p.record.max_key = task.result['max_key']
+                
+                session.merge(p.record)
+    
+        if s.failed:
+            raise ProcessError("Failed to write stats for partitions: {}"
+                               .format(', '.join(t.name for t in s.failed)))
+    
+    def write_partition_stats(self, vid):
+        '''Write the column statistics for one partition, without merging the 
+        partition record. Returns the count and key range for the record, or
+        None if the partition's table has no primary key. A task method 
+        for post_build_write_stats() '''
+        
+        p = self.partitions.partition(vid)
+        
+        try:
+            return p.write_stats(merge = False)
+        except ConfigurationError as e:
+            self.error(e.message)
+            return None
     
     @property
     def is_built(self):
@@ -792,6 +860,8 @@ class BuildBundle(Bundle):
             
             skips = self.config.group('build').get('skipinstall',[])
             
+            partitions = []
+            
             for partition in self.partitions:
                 
                 if not os.path.exists(partition.database.path):
@@ -801,12 +871,15 @@ class BuildBundle(Bundle):
                 if partition.name in skips:
                     self.log('{} Skipping'.format(partition.name))
                 else:
-                    self.log("{} Install".format(partition.name))  
-                    dest = library.put(partition, force=force)
-                    self.log("{} Installed".format(dest[1]))
-                    if delete:
-                        os.remove(partition.database.path)
-                        self.log("{} Deleted".format(partition.database.path))
+                    partitions.append(partition)
+            
+            # Hash and copy the partitions in parallel, with one transaction
+            # per batch of partitions in the library database. 
+            for partition, dst, _, _ in library.put_partitions(self, partitions, force=force):
+                self.log("{} Installed".format(dst))
+                if delete:
+                    os.remove(partition.database.path)
+                    self.log("{} Deleted".format(partition.database.path))
                     
 
         return True
@@ -111,6 +111,9 @@ class Cache(CacheInterface):
     readonly = False
     usreadonly = False   
     
+    # True if put() and get() may be called from several threads at once
+    thread_safe = False
+    
     def __init__(self,  upstream=None,**kwargs):   
         self.upstream = upstream
    
@@ -51,6 +51,12 @@ class FsCache(Cache):
         return self._cache_dir
 
         
+    @property
+    def thread_safe(self):
+        # Plain files are safe to copy from several threads, but the upstream
+        # may not be
+        return not self.upstream or self.upstream.thread_safe
+
     @property
     def repo_id(self):
         '''Return the ID for this repository'''
@@ -203,7 +209,11 @@ class FsCache(Cache):
         repo_path = os.path.join(self.cache_dir, rel_path)
       
         if not os.path.isdir(os.path.dirname(repo_path)):
-            os.makedirs(os.path.dirname(repo_path))
+            try:
+                os.makedirs(os.path.dirname(repo_path))
+            except OSError: # Multiple processes may try to make it
+                if not os.path.isdir(os.path.dirname(repo_path)):
+                    raise
         
         if os.path.exists(repo_path):
             os.remove(repo_path)
@@ -281,12 +291,19 @@ class FsLimitedCache(FsCache):
     When files are written , they are written through to the upstream. If a file
     is requested that does not exist, it is fetched from the upstream. 
     
-    When a file is added that causes the disk usage to exceed `maxsize`, the oldest
-    files are deleted to free up space. 
+    When a file is added that causes the disk usage to exceed `maxsize`, the least
+    recently used files are deleted to free up space. 
+    
+    The total size of the files is kept in a single row of the `file_total` table,
+    and the access times are written to the database in batches of `access_batch`, 
+    so a put() or get() does not scan the `files` table. 
     
      '''
 
-    def __init__(self, dir=dir, size=10000, upstream=None,**kwargs):
+    # The database connection is shared
+    thread_safe = False
+
+    def __init__(self, dir=dir, size=10000, upstream=None, access_batch=500, **kwargs):
         '''Init a new FileSystem Cache
         
         Args:
@@ -306,6 +323,9 @@ class FsLimitedCache(FsCache):
         self._database = None
         
         self.use_db = True
+        
+        self.access_batch = int(access_batch)
+        self._accesses = {} # Access times not yet written to the database
    
         if not os.path.isdir(self.cache_dir):
             os.makedirs(self.cache_dir)
@@ -341,20 +361,60 @@ class FsLimitedCache(FsCache):
             # Long timeout to deal with contention during multiprocessing use
             self._database = sqlite3.connect(db_path,60)
             
+            self._update_schema(self._database)
+            
         return self._database
+    
+    def _update_schema(self, db):
+        '''Add the time index and the size total to databases that were 
+        created without them. '''
+        
+        db.execute("CREATE INDEX IF NOT EXISTS files_time ON files (time)")
+        db.execute("""CREATE TABLE IF NOT EXISTS file_total(
+                      id INTEGER PRIMARY KEY CHECK (id = 0), 
+                      size INTEGER)""")
+        
+        if not db.execute("SELECT size FROM file_total WHERE id = 0").fetchone():
+            db.execute("INSERT OR IGNORE INTO file_total (id, size) SELECT 0, coalesce(sum(size),0) FROM files")
+        
+        db.commit()
             
     @property
     def size(self):
         '''Return the size of all of the files referenced in the database'''
-        c = self.database.cursor()
-        r = c.execute("SELECT sum(size) FROM files")
+        r = self.database.execute("SELECT size FROM file_total WHERE id = 0").fetchone()
      
         try:
-            size = int(r.fetchone()[0])
+            size = int(r[0])
         except TypeError:
             size = 0
     
         return size
+    
+    def _record_access(self, rel_path):
+        '''Note that a file was used, for the LRU ordering. The times are 
+        written to the database later, in a batch'''
+        import time
+        
+        self._accesses[rel_path] = time.time()
+        
+        if len(self._accesses) >= self.access_batch:
+            self.flush_accesses()
+    
+    def _write_accesses(self, c):
+        '''Write the pending access times, without committing'''
+        
+        if self._accesses:
+            c.executemany("UPDATE files SET time = ? WHERE path = ?", 
+                          [ (t, rel_path) for rel_path, t in self._accesses.items() ])
+            self._accesses = {}
+            
+    def flush_accesses(self):
+        '''Write the pending access times to the database'''
+        
+        if self._accesses:
+            self._write_accesses(self.database.cursor())
+            self.database.commit()
 
     def _free_up_space(self, size, this_rel_path=None):
         '''If there are not size bytes of space left, delete files
@@ -371,27 +431,45 @@ class FsLimitedCache(FsCache):
         if space <= 0:
             return
 
+        # The eviction order depends on the access times
+        self.flush_accesses()
+
         removes = []
 
+        # Uses the files_time index, so only the rows that are removed are read. 
         for row in self.database.execute("SELECT path, size, time FROM files ORDER BY time ASC"):
 
             if space > 0:
-                removes.append(row[0])
-                space -= row[1]
+                if row[0] != this_rel_path:
+                    removes.append(row[0])
+                    space -= row[1]
             else:
                 break
   
+        c = self.database.cursor()
+        
         for rel_path in removes:
-            if rel_path != this_rel_path:
-                logger.debug("Deleting {}".format(rel_path)) 
-                self.remove(rel_path)
+            logger.debug("Deleting {}".format(rel_path)) 
+            self._remove_record(c, rel_path)
+            
+        self.database.commit()
             
     def add_record(self, rel_path, size):
         import time
         c = self.database.cursor()
         try:
+            self._accesses.pop(rel_path, None)
+            self._write_accesses(c)
+            
+            # The insert replaces an existing record for the path, so the total
+            # is changed by the difference in sizes. 
+            row = c.execute("SELECT size FROM files WHERE path = ?", (rel_path,)).fetchone()
+            old_size = row[0] if row and row[0] else 0
+            
             c.execute("insert into files(path, size, time) values (?, ?, ?)", 
                         (rel_path, size, time.time()))
+            c.execute("UPDATE file_total SET size = size + ? WHERE id = 0", (size - old_size,))
+            
             self.database.commit()
         except Exception as e:
             from  ..dbexceptions import FilesystemError
@@ -471,6 +549,7 @@ class FsLimitedCache(FsCache):
                 raise ValueError("Path does not point to a file")
             
             logger.debug("LC {} get {} found ".format(self.repo_id, path))
+            self._record_access(rel_path)
             return path
             
         if not self.upstream:
@@ -569,8 +648,9 @@ class FsLimitedCache(FsCache):
                 
                 size = os.path.getsize(self.repo_path)
                 
-                self.this.add_record(rel_path, size)
+                # Free space before adding the record, so the new file isn't counted twice
                 self.this._free_up_space(size, this_rel_path=rel_path)
+                self.this.add_record(rel_path, size)
                 
                 if self.upstream:
                     self.upstream.close()
@@ -581,7 +661,11 @@ class FsLimitedCache(FsCache):
         repo_path = os.path.join(self.cache_dir, rel_path)
       
         if not os.path.isdir(os.path.dirname(repo_path)):
-            os.makedirs(os.path.dirname(repo_path))
+            try:
+                os.makedirs(os.path.dirname(repo_path))
+            except OSError: # Multiple processes may try to make it
+                if not os.path.isdir(os.path.dirname(repo_path)):
+                    raise
      
              
         self.put_metadata(rel_path, metadata=metadata) 
@@ -600,19 +684,30 @@ class FsLimitedCache(FsCache):
     
     def remove(self,rel_path, propagate = False):
         '''Delete the file from the cache, and from the upstream'''
-        repo_path = os.path.join(self.cache_dir, rel_path)
-        
         c = self.database.cursor()
-        c.execute("DELETE FROM  files WHERE path = ?", (rel_path,) )
         
-        if os.path.exists(repo_path):
-            os.remove(repo_path)
+        self._remove_record(c, rel_path)
 
         self.database.commit()
             
         if self.upstream and propagate :
             self.upstream.remove(rel_path, propagate)    
 
+    def _remove_record(self, c, rel_path):
+        '''Delete the file and its record, without committing'''
+        
+        repo_path = os.path.join(self.cache_dir, rel_path)
+        
+        self._accesses.pop(rel_path, None)
+        
+        row = c.execute("SELECT size FROM files WHERE path = ?", (rel_path,)).fetchone()
+        
+        if row:
+            c.execute("DELETE FROM  files WHERE path = ?", (rel_path,) )
+            c.execute("UPDATE file_total SET size = size - ? WHERE id = 0", (row[0] or 0,))
+        
+        if os.path.exists(repo_path):
+            os.remove(repo_path)
 
     def list(self, path=None,with_metadata=False):
         '''get a list of all of the files in the repository'''
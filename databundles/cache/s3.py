@@ -17,7 +17,6 @@ class S3Cache(Cache, RemoteMarker):
         '''Init a new S3Cache Cache
 
         '''
-        from boto.s3.connection import S3Connection
 
         super(S3Cache, self).__init__(upstream=upstream)
 
@@ -26,14 +25,30 @@ class S3Cache(Cache, RemoteMarker):
         self.secret = account['secret']
         self.bucket_name = bucket
         self.prefix = prefix
+        
+        # For S3-compatible services, or a local test server
+        self.host = account.get('host', None)
+        self.port = account.get('port', None)
 
-        self.conn = S3Connection(self.access_key, self.secret, is_secure = False )
+        self.conn = self._new_connection()
         self.bucket = self.conn.get_bucket(self.bucket_name)
   
         self.cdn = None
         if cdn:
             self._init_cdn(cdn)
             
+    def _new_connection(self):
+        '''Create a new S3 connection. Boto connections should not be shared
+        between threads, so each download thread gets its own. '''
+        from boto.s3.connection import S3Connection, OrdinaryCallingFormat
+        
+        if self.host:
+            return S3Connection(self.access_key, self.secret, is_secure = False, 
+                                host = self.host, port = int(self.port) if self.port else None,
+                                calling_format = OrdinaryCallingFormat())
+        else:
+            return S3Connection(self.access_key, self.secret, is_secure = False )
+            
     def _init_cdn(self, config):
         import boto
         import time
@@ -120,24 +135,20 @@ class S3Cache(Cache, RemoteMarker):
 
         return m.hexdigest()
  
-    def get_stream(self, rel_path, cb=None, return_meta=False):
-        """Return the object as a stream"""
-        from boto.s3.key import Key
+    def get_stream(self, rel_path, cb=None, return_meta=False, start=0, end=None):
+        """Return the object as a stream. The stream reads from the S3 
+        response as the caller reads, so the object is never held in memory. 
+        
+        If start or end are given, the stream covers only the byte range 
+        [start, end) of the object. """
         from boto.exception import S3ResponseError 
-     
-        import StringIO
         from ..util.flo import MetadataFlo
 
-        b = StringIO.StringIO()
         try:
             k = self._get_boto_key(rel_path)
             if not k:
                 return None
         
-            k.get_contents_to_file(b, cb=cb, num_cb=100)
-           
-            b.seek(0)
-            
             if return_meta:
                 d = k.metadata
                 d['size'] = k.size
@@ -145,14 +156,133 @@ class S3Cache(Cache, RemoteMarker):
             else:
                 d = {}
                 
-            return MetadataFlo(b,d)
+            return MetadataFlo(S3KeyStream(k, start = start, end = end, cb = cb),d)
             
         except S3ResponseError as e:
             if e.status == 404:
                 return None
             else:
                 raise e
+            
+    def get_range(self, rel_path, start, end=None):
+        """Return the bytes [start, end) of the object as a string, or None 
+        if the object does not exist"""
+        
+        s = self.get_stream(rel_path, start = start, end = end)
+        
+        if s is None:
+            return None
+        
+        try:
+            return s.read()
+        finally:
+            s.close()
+        
+    def get_to_file(self, rel_path, path, n_threads=4, chunk_size=16*1024*1024, cb=None, retries=2):
+        """Download the object to a local file, with n_threads threads each 
+        fetching chunk_size byte ranges of the object in parallel and 
+        writing them directly into the file. 
+        
+        Returns the path, or None if the object does not exist. """
+        import Queue
+        import threading
+
+        k = self._get_boto_key(rel_path)
+        if not k:
+            return None
+
+        size = k.size
+        
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        part_path = path+'.part'
+
+        with open(part_path, 'wb') as f:
+            f.truncate(size)
+
+        queue = Queue.Queue()
+        for range_start in range(0, size, chunk_size):
+            queue.put((range_start, min(range_start + chunk_size, size)))
+
+        errors = []
+        lock = threading.Lock()
+        progress = [0]
+        
+        this = self
+
+        class ThreadDownloader(threading.Thread):
+            """Thread class for downloading byte ranges of the object"""
+            def __init__(self, n):
+                threading.Thread.__init__(self)
+                self.n = n
+
+            def _get_range(self, conn, f, range_start, range_end):
+                
+                stream = S3KeyStream(k, connection = conn, start = range_start, end = range_end)
+                f.seek(range_start)
+                
+                try:
+                    while True:
+                        d = stream.read(1024*1024)
+                        if not d:
+                            break
+                        f.write(d)
+                finally:
+                    stream.close()
+                
+                if stream.tell() != range_end - range_start:
+                    raise IOError("Short read for range {}-{} of {}: got {} bytes"
+                                  .format(range_start, range_end, k.name, stream.tell()))
+                
+            def run(self):
+                conn = this._new_connection()
+                
+                with open(part_path, 'r+b') as f:
+                    while not errors:
+                        try:
+                            range_start, range_end = queue.get_nowait()
+                        except Queue.Empty:
+                            return
+
+                        for attempt in range(retries + 1):
+                            try:
+                                self._get_range(conn, f, range_start, range_end)
+                                break
+                            except Exception as e:
+                                logger.debug("get_to_file: Thread {}, range {}-{}, attempt {} failed: {}"
+                                             .format(self.n, range_start, range_end, attempt, e))
+                                if attempt == retries:
+                                    errors.append(e)
+                                    return
+                                conn = this._new_connection()
+
+                        if cb:
+                            with lock:
+                                progress[0] += range_end - range_start
+                                cb(progress[0], size)
+
+        threads = [ ThreadDownloader(i) for i in range(min(n_threads, max(queue.qsize(), 1))) ]
         
+        for t in threads:
+            t.setDaemon(True)
+            t.start()
+
+        for t in threads:
+            t.join()
+
+        if errors:
+            os.remove(part_path)
+            raise errors[0]
+
+        if os.path.exists(path):
+            os.remove(path)
+
+        os.rename(part_path, path)
+        
+        return path
+
     def get(self, rel_path, cb=None):
         '''For S3, get requires an upstream, where the downloaded file can be stored
         '''
@@ -392,3 +522,199 @@ class S3Cache(Cache, RemoteMarker):
     def __repr__(self):
         return "S3Cache: bucket={} prefix={} access={} ".format(self.bucket, self.prefix, self.access_key, self.upstream)
        
+
+class S3KeyStream(object):
+    '''A read-only file-like object that streams the contents of an S3 key
+    from a ranged GET request, so the object is never held in memory. 
+    
+    Seeking to a position in the last WINDOW bytes that were read is served
+    from memory; a seek anywhere else re-opens the request at the new 
+    position. This is sufficient for gzip.GzipFile, which seeks to the end of 
+    the stream and back, and backs up a few bytes at the end of each member.
+    
+    Positions are relative to the start of the byte range. '''
+
+    WINDOW = 256*1024
+
+    def __init__(self, key, connection=None, start=0, end=None, cb=None):
+        '''
+        Args:
+            key. A boto Key, as returned by bucket.get_key(), so the size is known.
+            
+            connection. An S3Connection to use for the requests. Defaults to the 
+            connection of the key's bucket.
+            
+            start, end. The byte range [start, end) of the key to read.
+            
+            cb. A callback, called with the number of bytes read and the size of
+            the range, after each read. 
+        '''
+        self.key = key
+        self.connection = connection if connection else key.bucket.connection
+        self.size = int(key.size)
+        self.start = min(int(start), self.size)
+        self.end = self.size if end is None else max(min(int(end), self.size), self.start)
+        self.cb = cb
+        self.closed = False
+
+        self._pos = self.start # Absolute position of the caller
+        self._resp = None
+        self._resp_pos = None # Absolute position of the next byte from the response
+        self._window = '' # The bytes that were read just before _resp_pos
+
+    def _open(self, pos):
+        from boto.exception import S3ResponseError 
+        
+        self._close_response()
+
+        resp = self.connection.make_request('GET', self.key.bucket.name, self.key.name,
+                       headers = {'Range': 'bytes={}-{}'.format(pos, self.end - 1)})
+
+        if resp.status not in (200, 206):
+            raise S3ResponseError(resp.status, resp.reason, resp.read())
+
+        self._resp = resp
+        self._window = ''
+
+        if resp.status == 200:
+            # The server ignored the range and returned the whole object
+            self._resp_pos = 0
+            self._read_response(pos)
+            self._window = ''
+        else:
+            self._resp_pos = pos
+
+    def _read_response(self, n):
+        '''Read up to n bytes from the response, keeping the window'''
+        
+        parts = []
+        remaining = n
+        
+        while remaining > 0:
+            d = self._resp.read(remaining)
+            if not d:
+                break
+            parts.append(d)
+            remaining -= len(d)
+
+        d = ''.join(parts)
+
+        self._resp_pos += len(d)
+        
+        if len(d) >= self.WINDOW:
+            self._window = d[-self.WINDOW:]
+        else:
+            self._window = self._window[-(self.WINDOW - len(d)):] + d if self._window else d
+
+        return d
+
+    def _close_response(self):
+        if self._resp is not None:
+            self._resp.close()
+            self._resp = None
+
+    def read(self, size=-1):
+
+        if self.closed:
+            raise ValueError("I/O operation on closed stream")
+
+        remaining = self.end - self._pos
+
+        if size is not None and size >= 0:
+            remaining = min(size, remaining)
+
+        if remaining <= 0:
+            return ''
+
+        parts = []
+
+        # Serve from the window, if the caller seeked backwards into it. 
+        if self._resp_pos is not None and self._resp_pos - len(self._window) <= self._pos < self._resp_pos:
+            offset = len(self._window) - (self._resp_pos - self._pos)
+            d = self._window[offset:offset + remaining]
+            parts.append(d)
+            self._pos += len(d)
+            remaining -= len(d)
+
+        if remaining > 0:
+            if self._resp is None or self._pos != self._resp_pos:
+                self._open(self._pos)
+
+            d = self._read_response(remaining)
+            parts.append(d)
+            self._pos += len(d)
+
+        if self.cb:
+            self.cb(self._pos - self.start, self.end - self.start)
+
+        return ''.join(parts)
+
+    def readline(self, size=-1):
+        
+        parts = []
+        n = 0
+        
+        if size is None or size <= 0:
+            size = self.end - self._pos
+
+        while n < size:
+            chunk = min(8192, size - n)
+            d = self.read(chunk)
+            
+            if not d:
+                break
+            
+            i = d.find('\n')
+            
+            if i >= 0:
+                # Back up to the byte after the newline. This is always in the window. 
+                self.seek(i + 1 - len(d), 1)
+                parts.append(d[:i+1])
+                break
+            
+            parts.append(d)
+            n += len(d)
+
+        return ''.join(parts)
+
+    def readlines(self, sizehint=0):
+        return list(self)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def seek(self, offset, whence=0):
+
+        if whence == 0:
+            pos = self.start + offset
+        elif whence == 1:
+            pos = self._pos + offset
+        elif whence == 2:
+            pos = self.end + offset
+        else:
+            raise ValueError("Invalid whence: {}".format(whence))
+
+        if pos < self.start:
+            raise IOError("Invalid seek position: {}".format(pos - self.start))
+
+        self._pos = pos
+
+    def tell(self):
+        return self._pos - self.start
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._close_response()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
@@ -14,8 +14,188 @@ import os
 
 from .inserter import InserterInterface
 
+STATS_EXTENSION = '.stats'
+
+def stats_path(path):
+    '''Return the path of the sidecar stats file for a CSV file'''
+    return path + STATS_EXTENSION
+
+def write_stats_file(path, count, min_key, max_key, header=False):
+    '''Write the sidecar stats file for a CSV file, recording the size and 
+    modification time of the CSV file, so read_stats_file() can tell when the 
+    file has been changed, and whether the file has a header line. '''
+    import json
+    
+    st = os.stat(path)
+    
+    d = {'count': count, 'min_key': min_key, 'max_key': max_key, 'header': header,
+         'size': st.st_size, 'mtime': st.st_mtime }
+    
+    with open(stats_path(path), 'w') as f:
+        json.dump(d, f)
+        
+    return d
+
+def read_stats_file(path, stale=False):
+    '''Return the dict from the sidecar stats file for a CSV file, or None if
+    there is no stats file, or, unless stale is True, the CSV file has changed 
+    since it was written. '''
+    import json
+    
+    try:
+        with open(stats_path(path)) as f:
+            d = json.load(f)
+        
+        st = os.stat(path)
+    except (IOError, OSError, ValueError):
+        return None
+    
+    if not stale and (d.get('size') != st.st_size or d.get('mtime') != st.st_mtime):
+        return None
+    
+    return d
+
+def _has_header(path, delimiter):
+    '''Guess whether a CSV file has a header line, from whether the first
+    value of the first line is an integer, as the keys of partition rows are'''
+    
+    with open(path, 'rb') as f:
+        k = f.readline().split(delimiter, 1)[0].strip().strip('"')
+        
+    if not k:
+        return False
+        
+    try:
+        int(k)
+        return False
+    except ValueError:
+        return True
+
+def _scan_chunk(args):
+    '''Count the lines in a byte range of a CSV file, and find the minimum and 
+    maximum of the integer first column. The range must start and end on line
+    boundaries. Returns (count, min, max), with the min and max None if the
+    first column isn't an integer. '''
+    
+    path, start, end, delimiter, skip_first, block_size = args
+    
+    count = 0
+    min_ = max_ = None
+    keyed = True
+    
+    def keys(lines):
+        for line in lines:
+            k = line.split(delimiter, 1)[0]
+            if k.startswith('"'):
+                k = k.strip('"')
+            yield int(k)
+    
+    with open(path, 'rb') as f:
+        f.seek(start)
+        
+        remaining = end - start
+        leftover = ''
+        
+        while True:
+            
+            block = f.read(min(block_size, remaining)) if remaining > 0 else ''
+            remaining -= len(block)
+            
+            if block:
+                # The last element is a partial line, or '' 
+                lines = (leftover + block).split('\n')
+                leftover = lines.pop()
+            else:
+                lines = [leftover]
+            
+            if skip_first and lines:
+                lines.pop(0)
+                skip_first = False
+            
+            lines = [ l for l in lines if l and l != '\r' ]
+            
+            count += len(lines)
+            
+            if keyed and lines:
+                try:
+                    k = list(keys(lines))
+                    min_ = min(k) if min_ is None else min(min_, min(k))
+                    max_ = max(k) if max_ is None else max(max_, max(k))
+                except ValueError:
+                    keyed = False
+                    min_ = max_ = None
+
+            if not block:
+                break
+
+    return count, min_, max_
+
+def scan_stats(path, delimiter='|', header=False, n_workers=None, 
+               block_size=4*1024*1024, min_parallel_size=32*1024*1024):
+    '''Compute the row count and the range of the integer first column of a
+    CSV file, for files that weren't written by ValueInserter, so have no 
+    stats file. If header is True, the first line is skipped. 
+    
+    Large files are split into byte ranges on line boundaries, which are 
+    scanned in parallel by a pool of processes. This assumes that, like
+    the CSV files for partitions, the values don't have quoted newlines.
+    
+    Returns a dict with count, min_key and max_key
+    '''
+    import multiprocessing
+    
+    size = os.path.getsize(path)
+    
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    
+    if size < min_parallel_size:
+        n_workers = 1
+    
+    # Split points, moved forward to the start of the next line
+    bounds = [0]
+    
+    with open(path, 'rb') as f:
+        for i in range(1, n_workers):
+            f.seek(size * i / n_workers)
+            f.readline()
+            
+            pos = f.tell()
+            
+            if bounds[-1] < pos < size:
+                bounds.append(pos)
+                
+    bounds.append(size)
+
+    chunks = [ (path, start, end, delimiter, header and i == 0, block_size) 
+               for i, (start, end) in enumerate(zip(bounds, bounds[1:])) ]
+    
+    if len(chunks) > 1:
+        pool = multiprocessing.Pool(len(chunks))
+        try:
+            results = pool.map(_scan_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = map(_scan_chunk, chunks)
+            
+    count = sum( r[0] for r in results )
+    
+    if all( r[1] is not None or r[0] == 0 for r in results ) and count:
+        min_key = min( r[1] for r in results if r[0] )
+        max_key = max( r[2] for r in results if r[0] )
+    else:
+        min_key = max_key = None
+        
+    return {'count': count, 'min_key': min_key, 'max_key': max_key}
+
 class ValueInserter(InserterInterface):
-    '''Inserts arrays of values into  database table'''
+    '''Inserts arrays of values into  database table
+    
+    The inserter counts the rows and tracks the range of the integer first 
+    column as it writes, and on close writes them to a sidecar stats file, 
+    so CsvPartition.write_stats() doesn't have to re-read the file. '''
     def __init__(self, path, bundle,  table=None, header=None, delimiter = '|', encoding='utf-8', 
                  write_header = False,  buffer_size=2*1024*1024): 
      
@@ -38,6 +218,12 @@ class ValueInserter(InserterInterface):
         self._writer = None
         self._inserter = None
         self._f = None
+        
+        self.count = 0
+        self.min_key = None
+        self.max_key = None
+        self._key = None
+        self._keyed = True
 
 
     def insert(self, values):
@@ -47,6 +233,11 @@ class ValueInserter(InserterInterface):
       
         try:
             self._inserter(values)
+            
+            self.count += 1
+            
+            if self._keyed:
+                self._track_key(values)
                 
         except (KeyboardInterrupt, SystemExit):
             self.close()
@@ -82,6 +273,9 @@ class ValueInserter(InserterInterface):
 
         delimiter = self.delimiter
         
+        # The key is the first column
+        self._key = 0 if row_is_list else (self.header[0] if has_header else row.keys()[0])
+        
         if row_is_dict and has_header:
             self._writer = unicodecsv.DictWriter(f, self.header, delimiter=delimiter, encoding=self.encoding)
             if self.write_header:
@@ -110,6 +304,34 @@ class ValueInserter(InserterInterface):
 
     
      
+    def _track_key(self, row):
+        
+        try:
+            v = row[self._key]
+        except (KeyError, IndexError):
+            v = None
+        
+        if v is None:
+            return
+        
+        try:
+            v = int(v)
+        except (ValueError, TypeError):
+            # Not an integer key, so no range
+            self._keyed = False
+            self.min_key = self.max_key = None
+            return
+        
+        if self.min_key is None or v < self.min_key:
+            self.min_key = v
+            
+        if self.max_key is None or v > self.max_key:
+            self.max_key = v
+     
+    @property
+    def stats(self):
+        return {'count': self.count, 'min_key': self.min_key, 'max_key': self.max_key}
+     
     def _write_list(self, row):
         self._writer.writerow(row)
      
@@ -120,11 +342,18 @@ class ValueInserter(InserterInterface):
         if self._f and not self._f.closed:
             self._f.flush()
             self._f.close()
+            
+            # The header is only written when there is one, and write_header is set
+            write_stats_file(self.path, self.count, self.min_key, self.max_key, 
+                             header = bool(self.write_header and self.header is not None))
 
     def delete(self):
         import os
         if os.path.exists(self.path):
             os.remove(self.path)
+            
+        if os.path.exists(stats_path(self.path)):
+            os.remove(stats_path(self.path))
      
     @property
     def linewriter(self):
@@ -193,6 +422,32 @@ class CsvDb(DatabaseInterface):
         import os
         if os.path.exists(self.path):
             os.remove(self.path)
+            
+        if os.path.exists(stats_path(self.path)):
+            os.remove(stats_path(self.path))
+        
+    def stats(self, n_workers=None):
+        '''Return the row count and key range of the file, from the stats file
+        written by the inserter, or by scanning the file if the stats file
+        is missing or out of date. The results of a scan are saved to the 
+        stats file. The scan skips the header line if an out of date stats 
+        file says there is one, or, without a stats file, if the first value
+        in the file isn't an integer. '''
+        
+        d = read_stats_file(self.path)
+        
+        if d is None:
+            stale = read_stats_file(self.path, stale=True)
+            
+            if stale and 'header' in stale:
+                header = stale['header']
+            else:
+                header = _has_header(self.path, self.delimiter)
+            
+            d = scan_stats(self.path, delimiter = self.delimiter, header = header, n_workers = n_workers)
+            d = write_stats_file(self.path, d['count'], d['min_key'], d['max_key'], header = header)
+            
+        return d
         
     def inserter(self, header=None, skip_header = False, **kwargs):
         
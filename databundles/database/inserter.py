@@ -8,6 +8,7 @@ Copyright (c) 2013 Clarinova. This file is licensed under the terms of the
 Revised BSD License, included in this distribution as LICENSE.txt
 """
 from databundles.util import get_logger
+from itertools import izip_longest
 import logging
 
 logger = get_logger(__name__)
@@ -95,8 +96,7 @@ class ValueWriter(InserterInterface):
 
         self.cache_size = cache_size
         self.statement = None
-     
-        
+        self.text_factory = text_factory
         
         if text_factory:
             self.db.engine.raw_connection().connection.text_factory = text_factory
@@ -116,11 +116,15 @@ class ValueWriter(InserterInterface):
         logger.debug("commit continue {}".format(repr(self.session)))
         self.session.commit()
  
+    def execute_cache(self):
+        '''Write the cached rows to the database'''
+        self.session.execute(self.statement, self.cache)
+ 
     def close(self):
 
         if len(self.cache) > 0 :       
             try:
-                self.session.execute(self.statement, self.cache)
+                self.execute_cache()
                 self.commit_end()
                 self.cache = []
             except (KeyboardInterrupt, SystemExit):
@@ -148,11 +152,20 @@ class ValueWriter(InserterInterface):
         
  
 class ValueInserter(ValueWriter):
-    '''Inserts arrays of values into  database table'''
+    '''Inserts arrays of values into  database table
+    
+    With bulk=True, and a database whose DB-API driver uses positional 
+    parameters, such as sqlite, the INSERT is compiled once and rows are 
+    cached as tuples and written with the DB-API cursor's executemany(), 
+    bypassing the parameter binding in the Sqlalchemy session. 
+    
+    With a databundles.stats.Stats object for stats, the inserted rows are 
+    also added to the column statistics. 
+    '''
     def __init__(self, db,  bundle, table, 
                  orm_table = None,
                  cache_size=50000, text_factory = None, 
-                 replace=False,  skip_none=True, update_size = True): 
+                 replace=False,  skip_none=True, update_size = True, bulk=False, stats=None): 
 
         super(ValueInserter, self).__init__(db, bundle,  cache_size=cache_size, text_factory = text_factory)  
    
@@ -175,10 +188,14 @@ class ValueInserter(ValueWriter):
 
 
         self.header = [c.name for c in self.orm_table.columns]
+        
+        self.null_list = [ self.null_row[name] for name in self.header ]
 
         # Int is included b/c long integer values get a type of integer64
         self.sizable_fields = [c.name for c in self.orm_table.columns if c.type_is_text() or c.datatype == c.DATATYPE_INTEGER ]
 
+        self.sizable_indexes = [ self.header.index(name) for name in self.sizable_fields ]
+
         self._max_lengths = [ 0 for x in self.sizable_fields ]
    
         self.statement = self.table.insert()
@@ -193,6 +210,100 @@ class ValueInserter(ValueWriter):
         if replace:
             self.statement = self.statement.prefix_with('OR REPLACE')
 
+        self.bulk = bulk and self._compile_bulk()
+
+        self.stats = stats
+
+    def rollback(self):
+        # The rolled-back rows are already in the statistics
+        if self.stats is not None:
+            self.stats.valid = False
+
+        super(ValueInserter, self).rollback()
+
+    def _compile_bulk(self):
+        '''Compile the insert statement to a positional statement for 
+        executemany(). Returns False if the database's dialect doesn't use 
+        positional parameters. '''
+        
+        dialect = self.db.engine.dialect
+        
+        if not dialect.positional:
+            return False
+        
+        compiled = self.statement.compile(dialect=dialect)
+
+        self.bulk_sql = str(compiled)
+        self.bulk_columns = list(compiled.positiontup)
+        
+        # Bind processors do the conversions, like dates to strings, that the
+        # session would do for the dict path. 
+        processors = [ (i, self.table.c[name].type.dialect_impl(dialect).bind_processor(dialect))
+                       for i, name in enumerate(self.bulk_columns) ]
+        
+        self.bulk_processors = [ (i,p) for i,p in processors if p is not None ]
+
+        # Map from statement positions to header positions, or None if they are the same
+        if self.bulk_columns == self.header:
+            self.bulk_index = None
+        else:
+            self.bulk_index = [ self.header.index(name) if name in self.header else None 
+                                for name in self.bulk_columns ]
+
+        return True
+
+    def _bulk_row(self, d):
+        '''Convert a row dict to a tuple in the order of the compiled statement'''
+        
+        row = [ d.get(k, None) for k in self.bulk_columns ]
+        
+        for i, p in self.bulk_processors:
+            row[i] = p(row[i])
+            
+        return tuple(row)
+
+    def _bulk_tuple(self, d):
+        '''Convert a positional row, in the order of the header, to a tuple
+        in the order of the compiled statement'''
+        
+        if self.bulk_index is None:
+            row = list(d[:len(self.bulk_columns)])
+            row.extend([None] * (len(self.bulk_columns) - len(row)))
+        else:
+            row = [ d[i] if i is not None and i < len(d) else None for i in self.bulk_index ]
+
+        for i, p in self.bulk_processors:
+            row[i] = p(row[i])
+            
+        return tuple(row)
+    
+    def _update_lengths(self, values):
+        
+        for i, v in enumerate(values):
+            try:
+                self._max_lengths[i] = max(len(str(v)) if v else 0, self._max_lengths[i])
+            except UnicodeEncodeError:
+                # Unicode is a PITA
+                pass
+
+    def execute_cache(self):
+        
+        if not self.bulk:
+            return super(ValueInserter, self).execute_cache()
+        
+        # The raw connection under the session's connection, so the 
+        # inserts are part of the session's transaction
+        conn = self.session.connection().connection
+        
+        if self.text_factory:
+            conn.connection.text_factory = self.text_factory
+        
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(self.bulk_sql, self.cache)
+        finally:
+            cursor.close()
+
     def insert(self, values):
         from sqlalchemy.engine.result import RowProxy
         
@@ -213,7 +324,20 @@ class ValueInserter(ValueWriter):
 
                     d = { k: d[k] if k in d and d[k] is not None else v for k,v in self.null_row.items() }
 
+                if self.update_size:
+                    self._update_lengths(d[col_name] for col_name in self.sizable_fields)
+
+                if self.stats is not None:
+                    self.stats.add(d)
+                    
+                if self.bulk:
+                    self.cache.append(self._bulk_row(d))
+                else:
+                    self.cache.append(d)
+
             else:
+                # Positional rows are cast and cached as tuples, and are only 
+                # converted to dicts for the session path. 
                 
                 if self.caster:
                     try:
@@ -223,23 +347,22 @@ class ValueInserter(ValueWriter):
                 else:
                     d = values
 
-                d  = dict(zip(self.header, d))
-                
                 if self.skip_none:
-                    d = { k: d[k] if k in d and d[k] is not None else v for k,v in self.null_row.items() }
+                    d = [ v if v is not None else n for v, n in  izip_longest(d, self.null_list) ]
                 
-            if self.update_size:
-                for i,col_name in enumerate(self.sizable_fields):
-                    try:
-                        self._max_lengths[i] = max(len(str(d[col_name])) if d[col_name] else 0, self._max_lengths[i])
-                    except UnicodeEncodeError:
-                        # Unicode is a PITA
-                        pass
+                if self.update_size:
+                    self._update_lengths(d[i] for i in self.sizable_indexes)
+
+                if self.stats is not None:
+                    self.stats.add(d)
                 
-            self.cache.append(d)
+                if self.bulk:
+                    self.cache.append(self._bulk_tuple(d))
+                else:
+                    self.cache.append(dict(zip(self.header, d)))
          
             if len(self.cache) >= self.cache_size: 
-                self.session.execute(self.statement, self.cache)
+                self.execute_cache()
                 self.cache = []
 
                 self.commit_continue()
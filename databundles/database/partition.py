@@ -61,7 +61,16 @@ class PartitionDb(SqliteDatabase, RelationalPartitionDatabaseMixin, SqliteAttach
         else:
             table = self.table(table_or_name.name)
 
-        
+        # Collect the column statistics while inserting, unless the inserter
+        # may replace rows, which would make the counts wrong. 
+        if 'stats' not in kwargs and hasattr(self.partition, 'inserter_stats'):
+            if kwargs.get('replace', False):
+                # Replaced rows keep the count the same, but change the
+                # minimums and maximums
+                self.partition.collected_stats = False
+            else:
+                kwargs['stats'] = self.partition.inserter_stats(table)
+
         return ValueInserter(self, self.bundle, table ,  **kwargs)
         
     def updater(self, table_or_name=None,**kwargs):
@@ -11,6 +11,10 @@ import logging
 from databundles.util import get_logger
 from ..database.inserter import SegmentedInserter, SegmentInserterFactory
 from contextlib import contextmanager
+import re
+
+# Statements that change the schema, and invalidate the reflected metadata
+_DDL_RE = re.compile(r'\s*(CREATE|DROP|ALTER)\b', re.IGNORECASE)
              
 
 class RelationalDatabase(DatabaseInterface):
@@ -56,7 +60,12 @@ class RelationalDatabase(DatabaseInterface):
         self._connection = None
 
 
-        self._table_meta_cache = {}
+        # Reflected metadata, with the schema_version it was reflected at, and 
+        # whether all of the tables have been reflected, or just those
+        # requested from table()
+        self._metadata = None
+        self._metadata_version = None
+        self._metadata_complete = False
 
         self.dsn_template = self.DBCI[self.driver]
         self.dsn = self.dsn_template.format(user=self.username, password=self.password, 
@@ -186,8 +195,29 @@ class RelationalDatabase(DatabaseInterface):
 
             self._engine = create_engine(self.dsn, echo=False) 
 
+            self._listen_ddl(self._engine)
+
         return self._engine
 
+    def _listen_ddl(self, engine):
+        '''Invalidate the reflected metadata when DDL is executed through the engine'''
+        from sqlalchemy import event
+        from sqlalchemy.schema import DDLElement
+        import weakref
+        
+        # The engine outlives the database in some caches, so don't keep the 
+        # database alive with the listener
+        ref = weakref.ref(self)
+
+        def after_execute(conn, clauseelement, multiparams, params, result):
+            if (isinstance(clauseelement, DDLElement) or 
+                (isinstance(clauseelement, basestring) and _DDL_RE.match(clauseelement))):
+                db = ref()
+                if db is not None:
+                    db.invalidate_metadata()
+
+        event.listen(engine, 'after_execute', after_execute)
+
     @property
     def unmanaged_session(self):
         
@@ -213,13 +243,52 @@ class RelationalDatabase(DatabaseInterface):
 
 
 
+    @property
+    def schema_version(self):
+        '''Return a value that changes when the schema of the database changes: 
+        the schema_version pragma for Sqlite, or a checksum of the pg_class 
+        catalog for Postgres. Other databases return None, and their metadata is
+        only invalidated by DDL executed through this object. '''
+        
+        if self.driver in ('sqlite', 'spatialite'):
+            return self.connection.execute('PRAGMA schema_version').fetchone()[0]
+        elif self.driver in ('postgres', 'postgis'):
+            return tuple(self.connection.execute(
+                    "SELECT count(*), sum(xmin::text::bigint) FROM pg_catalog.pg_class").fetchone())
+        else:
+            return None
+
+    def invalidate_metadata(self):
+        '''Discard the reflected metadata'''
+        self._metadata = None
+        self._metadata_complete = False
+
+    def _cached_metadata(self):
+        '''Return the cached MetaData, or a new, empty one if the schema has 
+        changed since it was reflected'''
+        from sqlalchemy import MetaData   
+        
+        version = self.schema_version
+        
+        if self._metadata is None or version != self._metadata_version:
+            self._metadata = MetaData(bind=self.engine)
+            self._metadata_version = version
+            self._metadata_complete = False
+            
+        return self._metadata
+
     @property
     def metadata(self):
-        '''Return an SqlAlchemy MetaData object, bound to the engine'''
+        '''Return an SqlAlchemy MetaData object, bound to the engine, with all
+        of the tables in the database. The metadata is cached until the 
+        schema changes. '''
         
-        from sqlalchemy import MetaData   
-        meta = MetaData(bind=self.engine)
-        meta.reflect(bind=self.engine)
+        meta = self._cached_metadata()
+        
+        if not self._metadata_complete:
+            # Only reflects the tables that aren't already in the metadata
+            meta.reflect(bind=self.engine)
+            self._metadata_complete = True
     
         return meta
     
@@ -276,20 +345,16 @@ class RelationalDatabase(DatabaseInterface):
         return self.metadata.sorted_tables
                    
     def table(self, table_name): 
-        '''Get table metadata from the database''' 
+        '''Get table metadata from the database. Only the requested table, and
+        the tables it references, are reflected''' 
         from sqlalchemy import Table
         
-        table = self._table_meta_cache.get(table_name, False)
-        
-        if table is not False:
-            r =  table
-        else:
-            metadata = self.metadata
-            table = Table(table_name, metadata, autoload=True)
-            self._table_meta_cache[table_name] = table
-            r =  table
+        meta = self._cached_metadata()
+
+        if table_name in meta.tables:
+            return meta.tables[table_name]
 
-        return r
+        return Table(table_name, meta, autoload=True, autoload_with=self.engine)
 
     def X_inserter(self,table_name, **kwargs):
         '''Creates an inserter for a database, but which may not have an associated bundle, 
@@ -184,6 +184,15 @@ class SqliteDatabase(RelationalDatabase):
                 os.makedirs(os.path.dirname(self.base_path))
             
     
+    @property
+    def schema_version(self):
+        '''The schema_version pragma, or None if the database file doesn't exist yet'''
+        
+        if not self.memory and not os.path.exists(self.path):
+            return None
+        
+        return self.connection.execute('PRAGMA schema_version').fetchone()[0]
+
     @property
     def version(self):
         v =  self.connection.execute('PRAGMA user_version').fetchone()[0]
@@ -212,6 +221,8 @@ class SqliteDatabase(RelationalDatabase):
             from sqlalchemy import event
             
             event.listen(self._engine, 'connect',connect_listener)
+            
+            self._listen_ddl(self._engine)
             #event.listen(self._engine, 'connect', _on_connect_update_schema)
 
             _on_connect_update_sqlite_schema(self.connection)
@@ -333,7 +344,38 @@ class SqliteDatabase(RelationalDatabase):
         ''' Load the database from a CSV file '''
         
         #return self.load_insert(a,table, encoding=encoding, caster=caster, logger=logger)
-        return self.load_shell(a,table, encoding=encoding, caster=caster, logger=logger)
+        #return self.load_shell(a,table, encoding=encoding, caster=caster, logger=logger)
+        return self.load_bulk(a,table, encoding=encoding, caster=caster, logger=logger)
+
+    def load_bulk(self, a, table, encoding='utf-8', caster=None, logger=None, **kwargs):
+        '''Load the database from one or more CSV files, in-process, with a 
+        SqliteCsvLoader. 
+        
+        Args:
+            a. A CSV partition, a CsvDb, a path, or a list of them. All of the files
+            are loaded in one pass, so indexes are only rebuilt once. 
+            
+            table. The name of the table, or an orm.Table
+            
+            caster. A caster for the rows. If None, uses the caster from the 
+            orm table. 
+            
+            logger. A function that is called with progress messages. 
+            
+            Other keyword arguments are passed to the SqliteCsvLoader
+        
+        Returns a tuple of the number of rows loaded and the elapsed time
+        '''
+        
+        if not isinstance(a, (list, tuple)):
+            a = [a]
+        
+        loader = SqliteCsvLoader(self, table, caster = caster, encoding = encoding, 
+                                 logger = logger, **kwargs)
+        
+        loader.load(a)
+        
+        return loader.count, loader.time
 
     def load_insert(self,a, table=None, encoding='utf-8', caster=None, logger=None):
         from ..partition import PartitionInterface
@@ -409,6 +451,246 @@ select 'Loading CSV file','{path}';
         return count, diff
 
 
+class SqliteCsvLoader(object):
+    '''Load CSV files into a Sqlite table in-process. 
+    
+    Rows are read from the files in chunks of chunk_size rows, cast with the 
+    table's caster and written with executemany(), with one transaction per 
+    chunk. While loading, the pragmas in LOAD_PRAGMAS are set on the connection,
+    and the table's indexes are dropped, then re-created after the last file. 
+    
+    Rows that fail to cast are reported and skipped, as the sqlite3 shell's 
+    .import does. If max_errors is not None, the load fails after max_errors 
+    rows have been skipped. The journal is kept in memory, so a chunk that fails
+    in the database is rolled back; pass pragmas={'journal_mode':'OFF'} for 
+    a faster load that can leave a failed chunk partially written. 
+    '''
+    
+    LOAD_PRAGMAS = (('synchronous','OFF'), ('journal_mode','MEMORY'))
+    
+    def __init__(self, db, table, caster=None, chunk_size=100000, pragmas = None, 
+                 defer_indexes = True, max_errors = None, encoding='utf-8', delimiter = '|', 
+                 logger = None):
+        
+        self.db = db
+        
+        if isinstance(table, basestring):
+            self.table_name = table
+            self.orm_table = self._orm_table(table)
+        else:
+            self.table_name = table.name
+            self.orm_table = table
+
+        self.chunk_size = chunk_size
+        self.defer_indexes = defer_indexes
+        self.max_errors = max_errors
+        self.encoding = encoding
+        self.delimiter = delimiter
+        self.logger = logger
+        
+        self.pragmas = list(self.LOAD_PRAGMAS)
+        
+        if pragmas:
+            self.pragmas = [ (k,v) for k,v in self.pragmas if k not in pragmas ] + pragmas.items()
+            
+        if caster:
+            self.caster = caster
+        elif self.orm_table:
+            self.caster = self.orm_table.caster
+        else:
+            self.caster = None
+
+        self.count = 0
+        self.errors = 0
+        self.time = 0
+
+    def _orm_table(self, table_name):
+        
+        bundle = getattr(self.db, 'bundle', None)
+        
+        if not bundle:
+            return None
+        
+        return bundle.schema.table(table_name)
+
+    def log(self, message):
+        if self.logger:
+            self.logger(message)
+        else:
+            logger.info(message)
+
+    def error(self, message):
+        bundle = getattr(self.db, 'bundle', None)
+        
+        if bundle:
+            bundle.error(message)
+        else:
+            logger.error(message)
+
+    def _statement(self):
+        '''Return the positional INSERT statement and a list of bind processors 
+        for the table's columns, in the order of the orm table or the database
+        table. '''
+        
+        sa_table = self.db.table(self.table_name)
+        dialect = self.db.engine.dialect
+        
+        if self.orm_table:
+            names = [ c.name for c in self.orm_table.columns ]
+        else:
+            names = [ c.name for c in sa_table.columns ]
+            
+        sql = ('INSERT INTO "{}" ({}) VALUES ({})'
+               .format(self.table_name, ','.join('"{}"'.format(n) for n in names), ','.join('?' for n in names)))
+
+        processors = [ (i, sa_table.c[name].type.dialect_impl(dialect).bind_processor(dialect)) 
+                       for i, name in enumerate(names) ]
+        
+        return sql, len(names), [ (i,p) for i,p in processors if p is not None ]
+
+    def _source_path(self, source):
+        from ..partition import PartitionInterface
+        from ..database.csv import CsvDb
+        
+        if isinstance(source, basestring):
+            return source
+        elif isinstance(source, PartitionInterface):
+            return source.database.path
+        elif isinstance(source, CsvDb):
+            return source.path
+        else:
+            from ..dbexceptions import ConfigurationError
+            raise ConfigurationError("Can't use this type: {}".format(type(source)))
+
+    def _chunks(self, path):
+        '''Yield lists of (line_number, row) for the rows of the CSV file '''
+        import unicodecsv
+        from itertools import islice
+        
+        with open(path, 'rb', buffering=8*1024*1024) as f:
+            
+            reader = enumerate(unicodecsv.reader(f, delimiter=self.delimiter, encoding=self.encoding), 1)
+            
+            while True:
+                chunk = list(islice(reader, self.chunk_size))
+                
+                if not chunk:
+                    break
+                
+                yield chunk
+
+    def _cast_chunk(self, path, chunk, n_cols, processors):
+        
+        rows = []
+        
+        for line, row in chunk:
+            
+            try:
+                if self.caster:
+                    row = self.caster(row)
+                
+                row = list(row[:n_cols])
+                row.extend([None] * (n_cols - len(row)))
+                    
+                for i, p in processors:
+                    row[i] = p(row[i])
+                    
+            except Exception as e:
+                self.errors += 1
+                self.error("Failed to load {}, line {}: {}".format(path, line, e))
+                
+                if self.max_errors is not None and self.errors > self.max_errors:
+                    raise ValueError("Too many errors loading {}: {} rows failed. Last at line {}: {}"
+                                     .format(path, self.errors, line, e))
+                continue
+            
+            rows.append(row)
+            
+        return rows
+
+    def _drop_indexes(self, conn):
+        
+        indexes = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' "
+                               "AND tbl_name = ? AND sql IS NOT NULL", (self.table_name,)).fetchall()
+        
+        for name, sql in indexes:
+            conn.execute('DROP INDEX "{}"'.format(name))
+            
+        return [ sql for name, sql in indexes ]
+
+    def _set_pragmas(self, conn, pragmas):
+        '''Set pragmas, returning the prior values'''
+        
+        prior = []
+        
+        for k, v in pragmas:
+            prior.append((k, conn.execute('PRAGMA {}'.format(k)).fetchone()[0]))
+            conn.execute('PRAGMA {} = {}'.format(k, v))
+            
+        return prior
+
+    def load(self, sources):
+        import time
+        
+        sql, n_cols, processors = self._statement()
+        
+        start = time.time()
+        
+        # A DB-API connection from the engine, so it gets the connect listener 
+        # pragmas, and is the same connection for memory databases. 
+        raw = self.db.engine.raw_connection()
+        conn = raw.connection
+        
+        prior_pragmas = self._set_pragmas(conn, self.pragmas)
+        
+        index_sql = self._drop_indexes(conn) if self.defer_indexes else []
+            
+        try:
+            for source in sources:
+                path = self._source_path(source)
+                file_start = time.time()
+                file_count = 0
+                
+                self.log("Loading CSV file {} into {}".format(path, self.table_name))
+                
+                for chunk in self._chunks(path):
+                    rows = self._cast_chunk(path, chunk, n_cols, processors)
+    
+                    try:
+                        conn.executemany(sql, rows)
+                        conn.commit()
+                    except:
+                        conn.rollback()
+                        self.error("Failed to load chunk of {} rows from {}, starting at line {}"
+                                   .format(len(chunk), path, chunk[0][0]))
+                        raise
+                    
+                    file_count += len(rows)
+                    self.count += len(rows)
+                    
+                    self.log("Loaded {} rows from {}: {} rows/s"
+                             .format(file_count, path, int(file_count / max(time.time() - file_start, .001))))
+                    
+        finally:
+            if index_sql:
+                self.log("Creating {} indexes on {}".format(len(index_sql), self.table_name))
+                
+            for isql in index_sql:
+                conn.execute(isql)
+            
+            conn.commit()
+            
+            self._set_pragmas(conn, prior_pragmas)
+            
+            raw.close()
+            
+            self.time = time.time() - start
+
+        self.log("Loaded {} rows into {} in {:.2f}s: {} rows/s, {} errors"
+                 .format(self.count, self.table_name, self.time, int(self.count / max(self.time, .001)), self.errors))
+        
+        return self.count
+
 class BundleLockContext(object):
     
     def __init__( self, bundle):
@@ -65,6 +65,7 @@ def library_parser(cmd):
     sp = asp.add_parser('rebuild', help='Rebuild the library database from the files in the library')
     sp.set_defaults(subcommand='rebuild')
     sp.add_argument('-r','--remote',  default=False, action="store_true",   help='Rebuild from the remote')
+    sp.add_argument('-i','--incremental',  default=False, action="store_true",   help='Only re-install files that changed since the last rebuild')
     
     sp = asp.add_parser('backup', help='Backup the library database to the remote')
     sp.set_defaults(subcommand='backup')
@@ -256,7 +257,7 @@ def library_rebuild(args, l, config):
         l.remote_rebuild()
     else:
         prt("Rebuild library from local storage")
-        l.rebuild()
+        l.rebuild(incremental=args.incremental)
         
 def library_list(args, l, config):    
 
@@ -0,0 +1,309 @@
+"""De-duplicate rows by their row hash with an external sort, and map the
+hashes of the unique rows to ids with a sorted, binary-searchable file.
+
+Rows are added to a RunWriter, which holds a bounded number of them, and
+writes each batch, sorted by hash and without duplicates, to a run file.
+Runs from any number of writers, such as one per state, possibly in
+different processes, are merged with merge_runs(), which reads all of the
+runs at once, one record at a time, and yields each hash once::
+
+    with RunWriter(dir_, prefix=state) as w:
+        for row in rows:
+            w.add(hasher(row), row)
+
+    with HashIndex(path).writer as idx:
+        for id_, (hash_, row) in enumerate(merge_runs(paths), 1):
+            idx.add(hash_, id_)
+
+    HashIndex(path)[hash_]            # One id
+    HashIndex(path).lookup(hashes)    # A numpy array of ids
+
+translate_rows() translates the hash columns of a batch of rows to ids with
+one lookup per column, for all of the rows at once. An index can also be
+built in memory, with HashIndex.from_items(), from an existing translation,
+such as a DBM file.
+
+Copyright (c) 2013 Clarinova. This file is licensed under the terms of the
+Revised BSD License, included in this distribution as LICENSE.txt
+"""
+
+import os
+import heapq
+import marshal
+import numpy as np
+
+class RunWriter(object):
+    '''Collect (hash, row) pairs and write them to sorted run files, of at most
+    run_size records each. Rows must be lists or tuples of values that marshal
+    can write: strings, numbers and None. '''
+
+    def __init__(self, dir_, prefix='run', run_size=500000):
+
+        self.dir = dir_
+        self.prefix = prefix
+        self.run_size = run_size
+
+        self.paths = []
+        self.count = 0
+        self._buffer = {}
+
+        if not os.path.exists(self.dir):
+            try:
+                os.makedirs(self.dir) # Other processes may be creating it too
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        if type_ is None:
+            self.close()
+        return False
+
+    def add(self, hash_, row):
+        '''Add a row. Rows with a hash that is already in the current run are
+        ignored.'''
+
+        self.count += 1
+
+        if hash_ not in self._buffer:
+            self._buffer[hash_] = tuple(row)
+
+            if len(self._buffer) >= self.run_size:
+                self.flush()
+
+    def flush(self):
+        '''Write the buffered rows to a new run file'''
+
+        if not self._buffer:
+            return
+
+        path = os.path.join(self.dir, '{}-{:04d}.run'.format(self.prefix, len(self.paths)))
+
+        with open(path, 'wb') as f:
+            for hash_ in sorted(self._buffer):
+                marshal.dump((hash_, self._buffer[hash_]), f)
+
+        self.paths.append(path)
+        self._buffer = {}
+
+    def close(self):
+        '''Write the last run, and return the paths of all of the runs'''
+        self.flush()
+        return self.paths
+
+def read_run(path):
+    '''Generate the (hash, row) records of a run file'''
+
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield marshal.load(f)
+            except EOFError:
+                break
+
+def merge_runs(paths):
+    '''Merge sorted run files, generating (hash, row) pairs in hash order, with
+    one row for each hash'''
+
+    last = None
+
+    for hash_, row in heapq.merge(*[ read_run(p) for p in paths ]):
+        if hash_ != last:
+            last = hash_
+            yield hash_, row
+
+def find_runs(dir_, prefix=''):
+    '''Return the paths of the run files in a directory'''
+
+    if not os.path.exists(dir_):
+        return []
+
+    return sorted( os.path.join(dir_, f) for f in os.listdir(dir_)
+                   if f.startswith(prefix) and f.endswith('.run') )
+
+class HashIndexWriter(object):
+    '''Write (hash, id) pairs, in increasing hash order, to a HashIndex file'''
+
+    BUFFER_SIZE = 65536
+
+    def __init__(self, index):
+        self.index = index
+        self._f = open(index.path + '-tmp', 'wb')
+        self._buffer = np.zeros(self.BUFFER_SIZE, dtype=HashIndex.RECORD)
+        self._n = 0
+        self._last = None
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        if type_ is None:
+            self.close()
+        else:
+            self._f.close()
+            os.remove(self._f.name)
+        return False
+
+    def add(self, hash_, id_):
+
+        if self._last is not None and hash_ <= self._last:
+            raise ValueError("Hashes must be added in increasing order: {} after {}".format(hash_, self._last))
+
+        self._last = hash_
+
+        self._buffer[self._n] = (hash_, id_)
+        self._n += 1
+        self.count += 1
+
+        if self._n == self.BUFFER_SIZE:
+            self._write()
+
+    def _write(self):
+        self._f.write(self._buffer[:self._n].tostring())
+        self._n = 0
+
+    def close(self):
+        '''Write the remaining pairs, and replace the index file'''
+        self._write()
+        self._f.close()
+        os.rename(self._f.name, self.index.path)
+        self.index.close()
+
+class HashIndex(object):
+    '''A file of (hash, id) pairs, sorted by hash, that translates row hashes
+    to the ids of the rows. Lookups are binary searches on a memory map of
+    the file, so the index doesn't have to be loaded. '''
+
+    RECORD = np.dtype([('hash', '<u8'), ('id', '<i8')])
+
+    def __init__(self, path):
+        self.path = path
+        self._records = None
+
+    @classmethod
+    def from_items(cls, items):
+        '''Create an index in memory from (hash, id) pairs, in any order'''
+
+        a = np.array([ (int(h), int(i)) for h, i in items ], dtype=np.int64).reshape(-1, 2)
+
+        order = np.argsort(a[:, 0].view(np.uint64), kind='mergesort')
+
+        records = np.zeros(len(a), dtype=cls.RECORD)
+        records['hash'] = a[order, 0].view(np.uint64)
+        records['id'] = a[order, 1]
+
+        if len(records) > 1 and (records['hash'][1:] == records['hash'][:-1]).any():
+            raise ValueError("Duplicate hashes")
+
+        index = cls(None)
+        index._records = records
+
+        return index
+
+    @property
+    def writer(self):
+        '''Return a writer for a new index file'''
+        self.close()
+        return HashIndexWriter(self)
+
+    @property
+    def records(self):
+        '''The (hash, id) records, as a numpy array'''
+
+        if self._records is None:
+            if os.path.getsize(self.path) == 0:
+                self._records = np.zeros(0, dtype=self.RECORD)
+            else:
+                self._records = np.memmap(self.path, dtype=self.RECORD, mode='r')
+
+        return self._records
+
+    @property
+    def exists(self):
+        return self.path is None or os.path.exists(self.path)
+
+    def close(self):
+        if self.path is not None:
+            self._records = None
+
+    def delete(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __len__(self):
+        return len(self.records)
+
+    def lookup(self, hashes, default=-1):
+        '''Translate an array of hashes to ids, with default for hashes that
+        aren't in the index'''
+
+        r = self.records
+        hashes = np.asarray(hashes, dtype=np.uint64)
+
+        if len(r) == 0:
+            ids = np.empty(len(hashes), dtype=np.int64)
+            ids.fill(default)
+            return ids
+
+        pos = np.searchsorted(r['hash'], hashes)
+        pos[pos == len(r)] = 0
+
+        found = r['hash'][pos] == hashes
+
+        return np.where(found, r['id'][pos], default)
+
+    def get(self, hash_, default=None):
+
+        r = self.records
+        hash_ = np.uint64(int(hash_))
+
+        pos = np.searchsorted(r['hash'], hash_)
+
+        if pos < len(r) and r['hash'][pos] == hash_:
+            return int(r['id'][pos])
+        else:
+            return default
+
+    def __getitem__(self, hash_):
+
+        id_ = self.get(hash_)
+
+        if id_ is None:
+            raise KeyError(hash_)
+
+        return id_
+
+    def __contains__(self, hash_):
+        return self.get(hash_) is not None
+
+def translate_rows(rows, start, indexes):
+    '''Translate the hashes in a batch of rows to ids. The columns from position
+    start on are translated, one column for each index, and the columns before
+    start are copied. Returns a list of lists. Raises KeyError for a hash
+    that isn't in its index, and ValueError if the rows don't have one hash
+    column for each index. '''
+
+    if not len(rows):
+        return []
+
+    end = start + len(indexes)
+
+    if len(rows[0]) != end:
+        raise ValueError("Rows have {} columns, expected {}, for {} indexes from column {}"
+                         .format(len(rows[0]), end, len(indexes), start))
+
+    hashes = np.array([ row[start:end] for row in rows ], dtype=np.uint64).reshape(len(rows), len(indexes))
+    ids = np.empty(hashes.shape, dtype=np.int64)
+
+    for j, index in enumerate(indexes):
+        ids[:, j] = index.lookup(hashes[:, j])
+
+        missing = np.flatnonzero(ids[:, j] < 0)
+        if len(missing):
+            raise KeyError(int(hashes[missing[0], j]))
+
+    return [ list(row[:start]) + id_row for row, id_row in zip(rows, ids.tolist()) ]
@@ -0,0 +1,296 @@
+"""Read fixed-width files in large blocks, instead of a line at a time, and
+unpack the records of a block in batches.
+
+The records are described by a struct format of string fields, like the one
+from Table.get_fixed_unpack(). Each record may be followed by a line ending,
+which is found from the first record, and must be the same for every record,
+so the records of a block are at fixed offsets. The 'struct' engine unpacks
+each record of a block with one compiled struct, and the 'numpy' engine
+views a block as a structured array, and converts it a column at a time::
+
+    reader = FixedReader(f, unpack_str)
+
+    for row in reader:          # Tuples of strings, one per field
+        ...
+
+    for a in reader.arrays():   # A numpy structured array per block
+        ...
+
+With the numpy engine and the python types of the fields, the integer
+fields are parsed for a whole batch at once, so the caster gets ints, and
+only has to check them. A column that has a value that isn't digits, with
+optional leading spaces, is left as strings, for the caster.
+
+Table.get_fixed_reader() creates a reader with an empty field for each
+column that has no width, so the rows line up with the table's columns and
+can go straight to the positional path of Table.caster and ValueInserter.
+
+Copyright (c) 2013 Clarinova. This file is licensed under the terms of the
+Revised BSD License, included in this distribution as LICENSE.txt
+"""
+
+import re
+import struct
+
+FIELD_RE = re.compile(r'(\d*)([sx])')
+
+def parse_format(fmt):
+    '''Return the (width, skip) pairs of the fields of a struct format of
+    strings and pad bytes, such as '2s3x10s'. skip is True for pad bytes,
+    which aren't unpacked. '''
+
+    fields = []
+    pos = 0
+
+    for m in FIELD_RE.finditer(fmt):
+        if m.start() != pos:
+            break
+        fields.append((int(m.group(1)) if m.group(1) else 1, m.group(2) == 'x'))
+        pos = m.end()
+
+    if pos != len(fmt.strip()):
+        raise ValueError("Fixed-width formats can only have 's' and 'x' fields: '{}'".format(fmt))
+
+    return fields
+
+def parse_digits(a):
+    '''Parse a 2D uint8 array of right-justified decimal digits, one value
+    per row, to an int64 array. Returns None if a value isn't all digits
+    after its leading spaces, or is blank. '''
+    import numpy as np
+
+    if a.shape[1] > 18:
+        return None # Could overflow
+
+    d = a.astype(np.int64) - 48
+
+    spaces = a == 32
+    digits = (d >= 0) & (d <= 9)
+
+    if not (digits | spaces).all() or spaces[:, -1].any():
+        return None
+
+    # The spaces have to be leading
+    if a.shape[1] > 1 and (spaces[:, 1:] > spaces[:, :-1]).any():
+        return None
+
+    d[spaces] = 0
+
+    return d.dot(10 ** np.arange(a.shape[1] - 1, -1, -1, dtype=np.int64))
+
+class FixedReader(object):
+    '''Iterate the records of a fixed-width file, as tuples, reading
+    block_size bytes at a time. '''
+
+    def __init__(self, f, fmt, names=None, types=None, eol=None, engine='struct',
+                 block_size=4*1024*1024, batch_size=2000):
+        '''
+        :param f: A file opened in binary mode, without universal newlines,
+        or the path of a file.
+        :param fmt: The struct format of a record, with 's' and 'x' fields
+        :param names: Names for the fields, for arrays()
+        :param types: Python types for the fields. With the numpy engine,
+        int and long fields are parsed to ints.
+        :param eol: The line ending after each record. If None, it is found
+        from the first record, and is '\\r\\n', '\\n' or nothing.
+        :param engine: 'struct' or 'numpy'
+        :param batch_size: The number of records in each list from rows()
+        '''
+
+        if engine not in ('struct', 'numpy'):
+            raise ValueError("Unknown fixed-width engine '{}'; expected 'struct' or 'numpy'".format(engine))
+
+        if isinstance(f, basestring):
+            f = open(f, 'rb')
+
+        self.f = f
+        self.fmt = fmt
+        self.fields = parse_format(fmt)
+        self.length = struct.calcsize(fmt)
+        self.eol = eol
+        self.engine = engine
+        self.block_size = block_size
+        self.batch_size = batch_size
+
+        n_values = sum(1 for _, skip in self.fields if not skip)
+
+        self.names = names if names is not None else [ 'f{}'.format(i) for i in range(n_values) ]
+        self.types = types if types is not None else [ str ] * n_values
+
+        if len(self.names) != n_values or len(self.types) != n_values:
+            raise ValueError("Got {} names and {} types for {} fields"
+                             .format(len(self.names), len(self.types), n_values))
+
+        # (name, offset, width, type) for each unpacked field
+        self.values = []
+        pos = 0
+        for width, skip in self.fields:
+            if not skip:
+                i = len(self.values)
+                self.values.append((self.names[i], pos, width, self.types[i]))
+            pos += width
+
+        self.count = 0 # Records read
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        self.f.close()
+
+    @property
+    def record_length(self):
+        '''The length of a record, with its line ending'''
+        return self.length + len(self.eol or '')
+
+    def _find_eol(self, data):
+
+        tail = data[self.length:self.length+2]
+
+        if tail.startswith('\r\n'):
+            return '\r\n'
+        elif tail.startswith('\n'):
+            return '\n'
+        else:
+            return ''
+
+    def _check(self, block, n, first):
+        '''Check that the line endings are where they should be in a block of
+        n records, which would not be true if a record is too long or too
+        short'''
+
+        if not self.eol:
+            return
+
+        rl = self.record_length
+
+        for i, c in enumerate(self.eol):
+            if block[self.length+i::rl] != c * n:
+                bad = next( j for j in range(n) if block[j*rl+self.length+i] != c )
+                raise ValueError("Record {} is not {} bytes long, with a line ending of {}: {}"
+                                 .format(first + bad + 1, self.length, repr(self.eol),
+                                         repr(block[bad*rl:(bad+1)*rl])))
+
+    def blocks(self):
+        '''Generate (block, n) pairs, for blocks of data from the file with n
+        whole records each, with their line endings. '''
+
+        data = self.f.read(max(self.block_size, self.length + 2))
+
+        if self.eol is None:
+            self.eol = self._find_eol(data)
+
+        rl = self.record_length
+        block_size = max(self.block_size - self.block_size % rl, rl)
+
+        while data:
+
+            n = len(data) // rl
+            rest = data[n*rl:]
+
+            if n:
+                block = data[:n*rl] if rest else data
+                self._check(block, n, self.count)
+                self.count += n
+                yield block, n
+
+            more = self.f.read(block_size)
+
+            if not more:
+                # A last record without a line ending, or a trailing end of file
+                if len(rest) == self.length and self.eol:
+                    self.count += 1
+                    yield rest + self.eol, 1
+                elif rest.strip():
+                    raise ValueError("Record {} is {} bytes long, but records are {} bytes"
+                                     .format(self.count + 1, len(rest), rl))
+                break
+
+            data = rest + more if rest else more
+
+    def dtype(self):
+        '''A numpy structured dtype for a record, with its line ending. Fields
+        with no width are not in the dtype'''
+        import numpy as np
+
+        values = [ v for v in self.values if v[2] ]
+
+        return np.dtype({'names': [ name for name, _, _, _ in values ],
+                         'formats': [ 'S{}'.format(width) for _, _, width, _ in values ],
+                         'offsets': [ offset for _, offset, _, _ in values ],
+                         'itemsize': self.record_length})
+
+    def arrays(self):
+        '''Generate a numpy structured array for each block of records'''
+        import numpy as np
+
+        dtype = None
+
+        for block, n in self.blocks():
+            if dtype is None:
+                dtype = self.dtype()
+
+            yield np.frombuffer(block, dtype=dtype, count=n)
+
+    def _array_rows(self, a, raw):
+        '''Convert a structured array, and the uint8 array of the same records,
+        to a list of tuples, a column at a time'''
+
+        columns = []
+
+        for name, offset, width, type_ in self.values:
+
+            if not width:
+                columns.append([''] * len(a))
+                continue
+
+            if type_ in (int, long):
+                v = parse_digits(raw[:, offset:offset+width])
+
+                if v is not None:
+                    columns.append(v.tolist())
+                    continue
+
+            columns.append(a[name].tolist())
+
+        return zip(*columns)
+
+    def rows(self):
+        '''Generate lists of up to batch_size record tuples'''
+
+        bs = self.batch_size
+
+        if self.engine == 'numpy':
+            import numpy as np
+
+            dtype = None
+
+            for block, n in self.blocks():
+                if dtype is None:
+                    dtype = self.dtype() # After the line ending is found
+
+                a = np.frombuffer(block, dtype=dtype, count=n)
+                raw = np.frombuffer(block, dtype=np.uint8).reshape(n, self.record_length)
+
+                for i in xrange(0, n, bs):
+                    yield self._array_rows(a[i:i+bs], raw[i:i+bs])
+        else:
+            unpack_from = None
+
+            for block, n in self.blocks():
+                if unpack_from is None:
+                    rl = self.record_length
+                    unpack_from = struct.Struct(self.fmt + ('{}x'.format(len(self.eol)) if self.eol else '')).unpack_from
+
+                for i in xrange(0, n, bs):
+                    yield [ unpack_from(block, o) for o in xrange(i*rl, min(i + bs, n)*rl, rl) ]
+
+    def __iter__(self):
+
+        for rows in self.rows():
+            for row in rows:
+                yield row
@@ -69,9 +69,16 @@ def add(s,v,m):
 def apply_copy(kernel, a, func=add, nodata=None, mult=True):
     """For all cells in a, or all nonzero cells, apply the kernel
     to a new output array
+    
+    With the default func, add, this is a convolution, which is done for
+    all of the cells at once with kernel.convolve(). Other functions are
+    applied one cell at a time. 
     """
     from itertools import izip
     
+    if func is add:
+        return kernel.convolve(a, nodata=nodata).astype(result_type(a, kernel.matrix))
+    
     o = zeros_like(a)
     
     #
@@ -88,7 +95,7 @@ def apply_copy(kernel, a, func=add, nodata=None, mult=True):
         z = ndindex(a.shape)
         
     for row, col in z:
-        kernel.apply(o,Point(col,row), func, a[row,col])
+        kernel.apply(o,Point(col,row), f=func, v=a[row,col])
         
     return o
 
@@ -232,6 +232,152 @@ class Kernel(object):
             point = Point(point, y)
         return self.apply(a,point, f=lambda x,y: np.add(x,y))
     
+    def apply_add_points(self, a, points, weights=None):
+        """Add the kernel into the array a, centered at each of many points. 
+        This has the same result as calling apply_add() for each point, but 
+        the points are first counted into integer cells, and the kernel is 
+        added to all of the cells at once, with convolve(). 
+        
+        :param a: The array to add to
+        :type a: numpy.array
+        :param points: A sequence of Points or (x,y) tuples, or a 2xN array of x and y values.
+        Floating point coordinates are truncated to integer cells.
+        :param weights: Optional sequence of values, one per point, to multiply the kernel by. 
+        
+        """
+        
+        if isinstance(points, np.ndarray) and points.ndim == 2 and points.shape[0] == 2:
+            xs, ys = points[0], points[1]
+        else:
+            xs = np.fromiter((p[0] for p in points), dtype=float)
+            ys = np.fromiter((p[1] for p in points), dtype=float)
+            
+        xs = np.asarray(xs).astype(int)
+        ys = np.asarray(ys).astype(int)
+        
+        y_max, x_max = a.shape
+        
+        # Like bounds(), points one cell past the far edges still contribute
+        # to the edge of the array. 
+        if len(xs) and (xs.min() < 0 or ys.min() < 0 or xs.max() > x_max or ys.max() > y_max):
+            raise OutOfBounds("Points are out of bounds for this array ( {} )".format(str(a.shape)))
+
+        # Count the points in each cell. bincount() on the flat cell index is
+        # the same as np.add.at(), but much faster
+        counts = np.bincount(ys * (x_max+1) + xs, 
+                             weights = None if weights is None else np.asarray(weights, dtype=float),
+                             minlength = (y_max+1) * (x_max+1)).reshape((y_max+1, x_max+1))
+        
+        a[...] = a + self.convolve(counts)[:y_max, :x_max]
+        
+        return a
+    
+    def convolve(self, a, nodata=None, method='auto'):
+        """Return a new array that is the sum of the kernel centered on every 
+        cell of a, multiplied by the cell's value. Cells with a value of nodata
+        are skipped. The kernel is clipped at the edges of the array, as in apply().
+        
+        :param a: The array of values 
+        :type a: numpy.array
+        :param nodata: A value to ignore
+        :param method: 'scatter', to add the kernel at each non-zero cell, 
+        'shift' to add shifted slices of the whole array for each kernel cell,
+        'fft' for FFT convolution, or 'auto' to pick the fastest from the 
+        number of non-zero cells. 
+        """
+        
+        a = np.ma.filled(a, 0) if np.ma.isMaskedArray(a) else np.asarray(a)
+        
+        if nodata is not None and nodata != 0:
+            a = np.where(a == nodata, 0, a)
+
+        m = np.asarray(self.matrix, dtype=float)
+        
+        if method == 'auto':
+            costs = self._convolve_costs(a)
+            method = min(costs, key = costs.get)
+       
+        if method == 'scatter':
+            o = self._convolve_scatter(a, m)
+        elif method == 'shift':
+            o = self._convolve_shift(a, m)
+        elif method == 'fft':
+            o = self._convolve_fft(a, m)
+        else:
+            raise ValueError("Unknown convolution method: {}".format(method))
+        
+        return o
+    
+    def _convolve_costs(self, a):
+        '''Rough relative costs of the convolution methods. Indexed adds are
+        much slower per cell than adds of contiguous slices. '''
+        
+        k = np.count_nonzero(self.matrix)
+        n = (a.shape[0] + self.matrix.shape[0]) * (a.shape[1] + self.matrix.shape[1])
+        
+        return {
+            'scatter': 8 * k * np.count_nonzero(a),
+            'shift': k * n,
+            'fft': 1.5 * n * np.log2(n)
+        }
+    
+    def _convolve_scatter(self, a, m):
+        """Add the kernel at each non-zero cell, one kernel cell at a time, 
+        for all of the non-zero cells at once. """
+        
+        k_y, k_x = m.shape
+        off_y, off_x = (k_y - 1) // 2, (k_x - 1) // 2
+        
+        # Padded so the kernel never needs clipping. 
+        o = np.zeros((a.shape[0] + k_y - 1, a.shape[1] + k_x - 1))
+        
+        ys, xs = np.nonzero(a)
+        values = a[ys, xs].astype(float)
+        
+        for (i, j), k in np.ndenumerate(m):
+            if k:
+                # The cells are unique, so there are no repeated indices 
+                o[ys + i, xs + j] += values * k
+
+        return o[off_y:off_y + a.shape[0], off_x:off_x + a.shape[1]]
+    
+    def _convolve_shift(self, a, m):
+        """Add the whole array, multiplied by each kernel cell, to a slice
+        of the output shifted by the kernel cell's offset"""
+        
+        k_y, k_x = m.shape
+        off_y, off_x = (k_y - 1) // 2, (k_x - 1) // 2
+        
+        o = np.zeros((a.shape[0] + k_y - 1, a.shape[1] + k_x - 1))
+        
+        a = a.astype(float)
+        y_max, x_max = a.shape
+        
+        for (i, j), k in np.ndenumerate(m):
+            if k:
+                o[i:i + y_max, j:j + x_max] += a * k
+
+        return o[off_y:off_y + y_max, off_x:off_x + x_max]
+        
+    def _convolve_fft(self, a, m):
+        """Convolve with real FFTs, padded so the convolution isn't circular"""
+        
+        k_y, k_x = m.shape
+        off_y, off_x = (k_y - 1) // 2, (k_x - 1) // 2
+        
+        shape = (_fft_size(a.shape[0] + k_y - 1), _fft_size(a.shape[1] + k_x - 1))
+        
+        fa = np.fft.rfft2(a.astype(float), shape)
+        fm = np.fft.rfft2(m, shape)
+        
+        o = np.fft.irfft2(fa * fm, shape)[off_y:off_y + a.shape[0], off_x:off_x + a.shape[1]]
+        
+        # Remove the round-off noise, so cells the kernel never reaches stay zero. 
+        mx = np.abs(o).max() if o.size else 0
+        o[np.abs(o) <= mx * 1e-12] = 0
+        
+        return o
+    
     def apply_min(self,a,point):
 
         f = lambda a,b: np.where(a<b, a, b)
@@ -241,6 +387,19 @@ class Kernel(object):
   
         return self.apply(a,point, f=np.max)        
         
+def _fft_size(n):
+    """Return the smallest number >= n that has no prime factors larger than 5,
+    which are fast sizes for the FFT"""
+    
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+        
 class ConstantKernel(Kernel):
     """A Kernel for a constant value"""
     
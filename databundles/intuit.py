@@ -0,0 +1,256 @@
+"""Guess the types and lengths of the columns of a table from its rows, for
+Schema.intuit_rows(), by testing all of the values of a column at once, with
+regular expressions on the values joined into one string.
+
+The rows may be sampled: the head and tail of the rows, and a reservoir
+sample of the rows between them. Each column gets a confidence: 1.0 when all
+of its values were tested, or when it is a string column, which can't get
+any wider, otherwise the 95% confidence bound from the rule of three, that
+no more than 3/n of the untested values have a wider type. Columns with
+conflicting types in the sample, like integers and strings, are checked with
+a scan of all of the rows, if the rows can be iterated again::
+
+    memo = intuit_rows(rows, sample=True)
+
+    memo['fields'][i]['type']        # int, float or str
+    memo['fields'][i]['confidence']
+
+The memo has the same structure as the one from Schema.intuit(), so it can be
+passed to Schema._update_from_memo().
+
+Copyright (c) 2013 Clarinova. This file is licensed under the terms of the
+Revised BSD License, included in this distribution as LICENSE.txt
+"""
+
+import re
+import random
+from collections import deque
+
+# Each pattern matches one line, a value, with the whitespace around it.
+# NULL_RE matches the values that Schema.intuit() skips: empty, and '-'
+NULL_RE = re.compile(r'^[ \t]*-?[ \t]*$', re.M)
+INT_RE = re.compile(r'^[ \t]*[-+]?\d+[ \t]*$', re.M)
+FLOAT_RE = re.compile(r'^[ \t]*[-+]?(?:\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?|'
+                      r'[nN][aA][nN]|[iI][nN][fF](?:[iI][nN][iI][tT][yY])?)[ \t]*$', re.M)
+VALUE_RE = re.compile(r'^[ \t]*(.*?)[ \t]*$', re.M)
+
+def sample_rows(rows, head=1000, tail=1000, size=10000, seed=None):
+    '''Return a sample of the rows: the first head rows, the last tail rows,
+    and a reservoir sample of size rows from the rows between them, and
+    the number of rows. '''
+
+    rng = random.Random(seed)
+
+    first = []
+    last = deque()
+    reservoir = []
+    n = 0     # All rows
+    m = 0     # Rows that have passed through the tail, to the reservoir
+
+    for row in rows:
+        n += 1
+
+        if n <= head:
+            first.append(row)
+            continue
+
+        last.append(row)
+
+        if len(last) <= tail:
+            continue
+
+        row = last.popleft()
+        m += 1
+
+        if len(reservoir) < size:
+            reservoir.append(row)
+        else:
+            j = rng.randint(0, m - 1)
+            if j < size:
+                reservoir[j] = row
+
+    return first + reservoir + list(last), n
+
+def _text(values):
+    '''Join the values that aren't None into lines'''
+
+    strs = [ v if isinstance(v, basestring) else repr(v) if isinstance(v, float) else str(v)
+             for v in values if v is not None ]
+
+    try:
+        return '\n'.join(strs), len(strs)
+    except UnicodeDecodeError:
+        # Byte strings that aren't ascii, mixed with unicode
+        return '\n'.join(v.encode('utf-8') if isinstance(v, unicode) else v for v in strs), len(strs)
+
+def classify(values):
+    '''Count the null, integer, float and string values in a list of a
+    column's values, and find the length of the longest value. '''
+
+    text, n = _text(values)
+
+    counts = {'nulls': len(values) - n, 'ints': 0, 'floats': 0, 'strs': 0, 'length': 0}
+
+    if not n:
+        return counts
+
+    # Lines in a value would be counted as more than one value
+    if text.count('\n') != n - 1:
+        return classify([ v.replace('\n', ' ') if isinstance(v, basestring) else v for v in values ])
+
+    nulls = len(NULL_RE.findall(text))
+    ints = len(INT_RE.findall(text))
+    floats = len(FLOAT_RE.findall(text))
+
+    counts['nulls'] += nulls
+    counts['ints'] = ints
+    counts['floats'] = floats - ints
+    counts['strs'] = n - nulls - floats
+    counts['length'] = max(map(len, VALUE_RE.findall(text)))
+
+    return counts
+
+def merge(a, b):
+    '''Combine the counts from two calls to classify()'''
+
+    return { k: max(a[k], b[k]) if k == 'length' else a[k] + b[k] for k in a }
+
+def column_type(counts):
+    '''The widest type of the values in a column, the type of a column with
+    only nulls is int, as in Schema.intuit() '''
+
+    if counts['strs']:
+        return str
+    elif counts['floats']:
+        return float
+    else:
+        return int
+
+def conflict(counts):
+    '''True if the values of a column have more than one type'''
+    return sum(1 for k in ('ints', 'floats', 'strs') if counts[k]) > 1
+
+def confidence(counts, scanned):
+    '''The confidence that the column type is right, given the values that
+    were tested, and whether they were all of the values'''
+
+    if scanned or counts['strs']:
+        return 1.0
+
+    n = counts['ints'] + counts['floats']
+
+    if n == 0:
+        return 0.0
+
+    return max(0.0, 1.0 - 3.0 / n)
+
+def _columns(rows, names):
+    '''Transpose rows, which are dicts or sequences, into lists of values'''
+
+    if names is not None:
+        return [ [ row.get(name) for row in rows ] for name in names ]
+
+    width = max(len(row) for row in rows)
+
+    return [ [ row[i] if i < len(row) else None for row in rows ] for i in range(width) ]
+
+def _classify_rows(rows, names, indexes=None):
+
+    columns = _columns(rows, names)
+
+    if indexes is None:
+        indexes = range(len(columns))
+
+    return dict( (i, classify(columns[i])) for i in indexes if i < len(columns) )
+
+def intuit_rows(rows, sample=False, head=1000, tail=1000, size=10000, chunk_size=10000, seed=None):
+    '''Guess the type and length of each column of rows, and return a memo in
+    the format of Schema.intuit(), with a confidence, a conflict flag, and a
+    scanned flag for each field.
+
+    :param rows: An iterable of dicts or sequences. To check the columns
+    with conflicts in a sample, it must be possible to iterate it more than
+    once, like a list, or an object that opens a file in __iter__().
+    :param sample: If true, classify a sample of the rows, with the head and
+    tail rows, and a reservoir of size rows. Otherwise, classify all of the
+    rows, in chunks of chunk_size rows.
+
+    '''
+
+    def first_names(row):
+        return list(row.keys()) if isinstance(row, dict) else None
+
+    names = None
+    counts = {}
+
+    def add(chunk, indexes=None):
+        for i, c in _classify_rows(chunk, names, indexes).items():
+            counts[i] = merge(counts[i], c) if i in counts else c
+
+    if sample:
+        sampled, n = sample_rows(rows, head, tail, size, seed)
+
+        if sampled:
+            names = first_names(sampled[0])
+            add(sampled)
+
+        # The whole file was in the sample
+        scanned = n <= head + tail + size
+
+        conflicts = [ i for i, c in counts.items() if conflict(c) ]
+
+        rescanned = set()
+        if conflicts and not scanned and iter(rows) is not rows:
+            for i in conflicts:
+                counts[i] = classify([])
+
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) == chunk_size:
+                    add(chunk, conflicts)
+                    chunk = []
+
+            if chunk:
+                add(chunk, conflicts)
+
+            rescanned = set(conflicts)
+
+    else:
+        n = 0
+        chunk = []
+        for row in rows:
+            if names is None and n == 0:
+                names = first_names(row)
+            n += 1
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                add(chunk)
+                chunk = []
+
+        if chunk:
+            add(chunk)
+
+        scanned = True
+        rescanned = set()
+
+    memo = {'fields': [], 'name_index': {}, 'rows': n}
+
+    for i in sorted(counts):
+        c = counts[i]
+        s = scanned or i in rescanned
+
+        memo['fields'].append({
+            'name': names[i] if names else None,
+            'type': column_type(c),
+            'length': c['length'],
+            'confidence': confidence(c, s),
+            'conflict': conflict(c),
+            'scanned': s,
+            'counts': c
+        })
+
+        if names:
+            memo['name_index'][names[i]] = i
+
+    return memo
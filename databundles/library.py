@@ -11,7 +11,7 @@ import databundles
 import databundles.util
 from databundles.run import  get_runconfig #@UnresolvedImport
 from databundles.util import temp_file_name
-from databundles.dbexceptions import ConfigurationError, NotFoundError
+from databundles.dbexceptions import ConfigurationError, NotFoundError, QueryError
 from databundles.identity import new_identity
 from databundles.bundle import DbBundle
 
@@ -188,6 +188,7 @@ class LibraryDb(object):
         self._session = None
         self._engine = None
         self._connection  = None
+        self._has_search_index = None
         
         if self.driver in ['postgres','postgis']:
             self._schema = 'library'
@@ -233,6 +234,7 @@ class LibraryDb(object):
             
             if self.driver == 'sqlite':
                 event.listen(self._engine, 'connect', _pragma_on_connect)
+                event.listen(self._engine, 'connect', _search_on_connect)
                 #event.listen(self._engine, 'connect', _on_connect_update_schema)
                 _on_connect_update_sqlite_schema(self.connection)
 
@@ -452,6 +454,9 @@ class LibraryDb(object):
             self._add_config_root()
 
         self.commit()
+
+        if self.has_search_index:
+            self.rebuild_search_index()
  
         
     def _creation_sql(self):
@@ -521,6 +526,12 @@ class LibraryDb(object):
         
         if not self.enable_delete:
             raise Exception("Deleting not enabled")
+
+        # Dropping the search index also drops its shadow tables
+        if self.has_search_index:
+            self.connection.execute("DROP TABLE {}".format(self.SEARCH_TABLE))
+            self.connection.execute("DROP TABLE IF EXISTS {}".format(self.SEARCH_DOCS_TABLE))
+            self._has_search_index = False
         
         for table in reversed(self.metadata.sorted_tables): # sorted by foreign key dependency
             table.drop(self.engine, checkfirst=True)
@@ -564,6 +575,8 @@ class LibraryDb(object):
             
             if self._schema:
                 it.schema = orig_schema      
+
+        self.create_search_index()
                      
             
         
@@ -610,8 +623,9 @@ class LibraryDb(object):
             
         s.query(Partition).filter(Partition.d_vid == dataset.vid).delete()
             
-        for table in dataset.tables:
-            s.query(Column).filter(Column.t_vid == table.vid).delete()
+        # One DELETE for the columns of all of the dataset's tables
+        t_vids = s.query(Table.vid).filter(Table.d_vid == dataset.vid).subquery()
+        s.query(Column).filter(Column.t_vid.in_(t_vids)).delete(synchronize_session=False)
 
         s.query(Table).filter(Table.d_vid == dataset.vid).delete()
        
@@ -624,9 +638,13 @@ class LibraryDb(object):
            
         return dataset
                 
-    def install_bundle(self, bundle):
+    def install_bundle(self, bundle, bulk=True):
         '''Copy the schema and partitions lists into the library database
         
+        With bulk=True, the tables, columns and partitions records are read
+        from the bundle database with one query each, and written with 
+        executemany() inserts. Otherwise, each record is merged with the 
+        session, which issues a SELECT for each record. 
         '''
         from databundles.orm import Dataset, Config, Column, Table, Partition
         from databundles.bundle import Bundle
@@ -644,16 +662,19 @@ class LibraryDb(object):
 
         s = self.session
  
-        for table in dataset.tables:
-
-            s.merge(table)
-         
-            for column in table.columns:
-                s.merge(column)
-
-
-        for partition in dataset.partitions:
-            s.merge(partition)
+        if bulk:
+            self._bulk_install(s, bundle, dataset)
+        else:
+            for table in dataset.tables:
+    
+                s.merge(table)
+             
+                for column in table.columns:
+                    s.merge(column)
+    
+    
+            for partition in dataset.partitions:
+                s.merge(partition)
      
         try:
             self.commit()
@@ -662,6 +683,43 @@ class LibraryDb(object):
             self.rollback()
             raise e
 
+        self._index_dataset(dataset.vid)
+
+    def _bulk_install(self, s, bundle, dataset):
+        '''Copy the tables, columns and partitions records for a dataset 
+        from the bundle database, with one SELECT and one executemany() 
+        INSERT per table. install_dataset() has already deleted the old 
+        records, but on sqlite the inserts are INSERT OR REPLACE, in case 
+        of records left over from other versions of the bundle. '''
+        from databundles.orm import Column, Table, Partition
+        from sqlalchemy.sql import select
+        
+        tables = Table.__table__
+        columns = Column.__table__
+        partitions = Partition.__table__
+        
+        queries = [
+            (tables, select([tables]).where(tables.c.t_d_vid == dataset.vid)),
+            (columns, select([columns]).where(columns.c.c_t_vid.in_(
+                                select([tables.c.t_vid]).where(tables.c.t_d_vid == dataset.vid)))),
+            (partitions, select([partitions]).where(partitions.c.p_d_vid == dataset.vid))
+        ]
+        
+        conn = bundle.database.connection
+        
+        for table, q in queries:
+        
+            rows = [ dict(row) for row in conn.execute(q) ]
+            
+            if not rows:
+                continue
+            
+            stmt = table.insert()
+            
+            if self.driver == 'sqlite':
+                stmt = stmt.prefix_with('OR REPLACE')
+            
+            s.execute(stmt, rows)
 
     def install_partition(self, bundle,  p_id):
         """Install a single partition and its tables"""   
@@ -693,6 +751,72 @@ class LibraryDb(object):
             self.rollback()
             raise e
 
+        self._index_partitions([partition.identity.vid])
+
+    def install_partitions(self, bundle, files, group, state='new'):
+        """Install a batch of partitions in one transaction: the tables and
+        partition records, as install_partition() does, and the file
+        records, as add_file() does.
+
+        Args:
+            bundle. The bundle the partitions are from
+
+            files. A list of (partition, path, md5) tuples, with the path of
+            the partition's file in the library cache
+
+            group. The repo_id of the cache
+        """
+        from databundles.orm import Table, File
+        from sqlalchemy.orm.exc import NoResultFound
+
+        s = self.session
+
+        tables = set()
+
+        try:
+            for partition, path, md5 in files:
+
+                for table_name in partition.tables:
+                    table = bundle.schema.table(table_name)
+
+                    if table.vid in tables:
+                        continue
+
+                    tables.add(table.vid)
+
+                    try:
+                        s.query(Table).filter(Table.vid == table.vid).one()
+                        # the library already has the table
+                    except NoResultFound as e:
+                        s.merge(table)
+
+                        for column in table.columns:
+                            s.merge(column)
+
+                s.merge(partition.record)
+
+                s.query(File).filter(File.path == path).delete()
+
+                stat = os.stat(path)
+
+                s.add(File(path=path, group=group, ref=partition.identity.vid,
+                           modified=int(stat.st_mtime), size=stat.st_size,
+                           state = state, type_='partition', content_hash=md5))
+
+            self.commit()
+
+        except IntegrityError as e:
+            self.logger.error("Failed to merge")
+            self.rollback()
+            raise e
+        except:
+            self.rollback()
+            raise
+
+        self._index_partitions(partition.identity.vid for partition, _, _ in files)
+
+        self._mark_update()
+
 
     def install_table(self, table_or_vid, name=None):
         """Mark a table record as installed"""   
@@ -744,6 +868,8 @@ class LibraryDb(object):
         self.session.delete(dataset)
   
         self.commit()
+
+        self._unindex('d_vid', dataset.vid)
         
       
     def remove_partition(self, partition):
@@ -755,7 +881,11 @@ class LibraryDb(object):
         except AttributeError:
             # It is actually an identity, we hope
             dataset = partition.as_dataset
-            
+
+        if not dataset:
+            # The partition was never installed
+            return False
+
         b = LibraryDbBundle(self, dataset.vid)
       
         s = self.session
@@ -763,6 +893,8 @@ class LibraryDb(object):
         s.query(Partition).filter(Partition.t_vid  == partition.vid).delete()
        
         self.commit()
+
+        self._unindex('vid', partition.vid)
                 
       
     def get_id(self, id_):
@@ -831,6 +963,15 @@ class LibraryDb(object):
                 return c == v
             
         
+        terms = ' '.join(v for _, v in query_command.text.items()) if len(query_command.text) > 0 else None
+
+        # Only text terms use the full text search index. With other terms, or 
+        # without the index, the text terms are LIKE filters on the names. 
+        if terms and not any(len(c) > 0 for c in (query_command.identity, query_command.partition,
+                                                  query_command.table, query_command.column)):
+            if self.has_search_index or self.create_search_index():
+                return self.search(terms)
+
         s = self.session
 
         has_partition = False
@@ -908,6 +1049,28 @@ class LibraryDb(object):
             for k,v in query_command.column.items():
                 query = query.filter(  like_or_eq(getattr(Column, k),v) )
 
+        if terms:
+            from sqlalchemy.sql import or_
+            
+            fields = [Dataset.name, Dataset.vname]
+            
+            if Partition in tables:
+                fields += [Partition.name, Partition.vname]
+                
+            if Table in tables:
+                fields += [Table.name, Table.altname, Table.description, Table.keywords]
+                
+            if Column in tables:
+                fields += [Column.name, Column.altname, Column.description, Column.keywords]
+            
+            # Every word must match, as in the full text search
+            for word in terms.split():
+                if word in ('AND', 'OR', 'NOT'):
+                    continue
+                
+                v = '%{}%'.format(word.strip('*"'))
+                query = query.filter(or_(*[ f.like(v) for f in fields ]))
+
         query = query.distinct().order_by(Dataset.revision.desc())
 
         out = []
@@ -994,40 +1157,55 @@ class LibraryDb(object):
         self.add_file(identity.cache_key, 'remote', identity.vid, state='remote')
 
         
-    def add_file(self,path, group, ref, state='new', type_='bundle', data=None, source_url=None):
+    def add_file(self,path, group, ref, state='new', type_='bundle', data=None, source_url=None, content_hash=None):
+      
+        self.add_files([dict(path=path, group=group, ref=ref, state=state, type_=type_, data=data, 
+                             source_url=source_url, content_hash=content_hash)])
+        
+    def add_files(self, files):
+        '''Add file records, as add_file() does, in one transaction. 
+        
+        Args:
+            files. A list of dicts of the arguments to add_file()
+        '''
         from databundles.orm import  File
 
-        if os.path.exists(path):
-            stat = os.stat(path)
-            modified = int(stat.st_mtime)
-            size = stat.st_size
-        else:
-            modified = None
-            size = None
-      
         s = self.session
 
-        try: s.query(File).filter(File.path == path).delete()
-        except ProgrammingError: 
-            pass
-        except OperationalError: 
-            pass
-      
-        file_ = File(path=path, 
-                     group=group, 
-                     ref=ref,
-                     modified=modified, 
-                     state = state,
-                     size=size,
-                     type_=type_,
-                     data=data,
-                     source_url=source_url
-                     )
-    
+        for f in files:
+            path = f['path']
+
+            if os.path.exists(path):
+                stat = os.stat(path)
+                modified = int(stat.st_mtime)
+                size = stat.st_size
+            else:
+                modified = None
+                size = None
+
+            try: s.query(File).filter(File.path == path).delete()
+            except ProgrammingError: 
+                pass
+            except OperationalError: 
+                pass
+          
+            file_ = File(path=path, 
+                         group=f['group'], 
+                         ref=f['ref'],
+                         modified=modified, 
+                         state = f.get('state', 'new'),
+                         size=size,
+                         type_=f.get('type_', 'bundle'),
+                         data=f.get('data'),
+                         source_url=f.get('source_url'),
+                         content_hash=f.get('content_hash')
+                         )
+        
+            s.add(file_)
+
         # Sqlalchemy doesn't automatically rollback on exceptsions, and you
         # can't re-try the commit until you roll back. 
         try:
-            s.add(file_)
             self.commit()
         except:
             self.rollback()
@@ -1123,11 +1301,280 @@ class LibraryDb(object):
             return None
 
     def remove_file(self,path):
-        pass
+        '''Remove the record for a file. If the file is a bundle, also remove
+        the dataset and its tables and partitions'''
+        from databundles.orm import  File, Dataset
+
+        s = self.session
+
+        refs = [ f.ref for f in s.query(File).filter(File.path == path, File.type_ == 'bundle').all() ]
+
+        s.query(File).filter(File.path == path).delete()
+
+        for ref in refs:
+            dataset = s.query(Dataset).filter(Dataset.vid == ref).first()
+            if dataset:
+                # delete() on the object, so the relationship cascades happen
+                s.delete(dataset)
+
+        self.commit()
+
+        for ref in refs:
+            self._unindex('d_vid', ref)
+
+        self._mark_update()
+
+    def manifest(self, group=None):
+        '''Return a dict, keyed by path, of (size, modified, content_hash, type_, ref)
+        for the file records, optionally only those in a group'''
+        from databundles.orm import  File
+        from sqlalchemy.sql import select
+
+        t = File.__table__
+
+        q = select([t.c.f_path, t.c.f_size, t.c.f_modified, t.c.f_hash, t.c.f_type, t.c.f_ref])
+
+        if group:
+            q = q.where(t.c.f_group == group)
+
+        return dict( (row[0], tuple(row[1:])) for row in self.connection.execute(q) )
     
     def get_file(self,path):
         pass
 
+    #
+    # Full text search. On Sqlite, the names, descriptions and keywords of the
+    # datasets, tables, columns and partitions are indexed in an FTS4 table,
+    # which is updated when bundles and partitions are installed or removed.
+    #
+
+    SEARCH_TABLE = 'search_index'
+
+    # A table of the docids of the search index rows, by vid and dataset vid. 
+    # The vid columns of the FTS4 table aren't indexed, so rows are found 
+    # through this table and deleted by docid. 
+    SEARCH_DOCS_TABLE = 'search_index_docs'
+
+    # The SELECTs that produce the rows of the search index for each type of 
+    # record, and the column that holds the dataset vid, for selecting the
+    # rows of one dataset. 
+    _SEARCH_SOURCES = [
+        ('dataset', 'd_vid', """SELECT 'dataset' AS type, d_vid AS vid, d_vid AS d_vid, NULL AS t_vid, 
+            d_name AS name, d_vname AS altname, NULL AS description, 
+            d_source||' '||d_dataset||' '||ifnull(d_subset,'')||' '||ifnull(d_variation,'')||' '||d_creator AS keywords
+            FROM datasets WHERE d_id != '{}'""".format(ROOT_CONFIG_NAME)),
+        ('table', 't_d_vid', """SELECT 'table' AS type, t_vid AS vid, t_d_vid AS d_vid, t_vid AS t_vid, 
+            t_name AS name, t_altname AS altname, t_description AS description, t_keywords AS keywords
+            FROM tables WHERE 1"""),
+        ('column', 't_d_vid', """SELECT 'column' AS type, c_vid AS vid, t_d_vid AS d_vid, c_t_vid AS t_vid, 
+            c_name AS name, c_altname AS altname, c_description AS description, c_keywords AS keywords
+            FROM columns JOIN tables ON c_t_vid = t_vid WHERE 1"""),
+        ('partition', 'p_d_vid', """SELECT 'partition' AS type, p_vid AS vid, p_d_vid AS d_vid, p_t_vid AS t_vid, 
+            p_name AS name, p_vname AS altname, NULL AS description, 
+            ifnull(p_space,'')||' '||ifnull(p_time,'')||' '||ifnull(p_grain,'')||' '||ifnull(p_format,'') AS keywords
+            FROM partitions WHERE 1""")
+    ]
+
+    @property
+    def has_search_index(self):
+        '''True if the database has a full text search index, which only
+        Sqlite databases can have'''
+
+        if self.driver != 'sqlite':
+            return False
+
+        if self._has_search_index is None:
+            names = self.inspector.get_table_names()
+            self._has_search_index = self.SEARCH_TABLE in names and self.SEARCH_DOCS_TABLE in names
+
+        return self._has_search_index
+
+    def create_search_index(self):
+        '''Create the full text search index, if it does not exist, and 
+        index all of the records in the database'''
+
+        if self.driver != 'sqlite' or self.has_search_index:
+            return False
+
+        self.connection.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts4(type, vid, d_vid, t_vid, 
+            name, altname, description, keywords, 
+            notindexed=type, notindexed=vid, notindexed=d_vid, notindexed=t_vid, 
+            tokenize=porter)""".format(self.SEARCH_TABLE))
+
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS {} (docid INTEGER PRIMARY KEY, 
+            vid TEXT UNIQUE, d_vid TEXT)""".format(self.SEARCH_DOCS_TABLE))
+
+        self.connection.execute("CREATE INDEX IF NOT EXISTS {0}_d_vid ON {0} (d_vid)".format(self.SEARCH_DOCS_TABLE))
+
+        self._has_search_index = True
+
+        self.rebuild_search_index()
+
+        return True
+
+    def rebuild_search_index(self):
+        '''Re-index all of the records in the database'''
+
+        if not self.has_search_index:
+            return self.create_search_index()
+
+        with self.connection.begin():
+            self.connection.execute("DELETE FROM {}".format(self.SEARCH_TABLE))
+            self.connection.execute("DELETE FROM {}".format(self.SEARCH_DOCS_TABLE))
+
+            for type_, d_vid_col, sql in self._SEARCH_SOURCES:
+                self._insert_search_rows(sql)
+
+        return True
+
+    def _insert_search_rows(self, sql, *params):
+        '''Index the rows of a search source SELECT, first recording their 
+        docids in the docs table'''
+        
+        self.connection.execute("INSERT INTO {} (vid, d_vid) SELECT vid, d_vid FROM ({})"
+                                .format(self.SEARCH_DOCS_TABLE, sql), *params)
+
+        self.connection.execute("""INSERT INTO {0} (docid, type, vid, d_vid, t_vid, name, altname, description, keywords)
+            SELECT docs.docid, s.type, s.vid, s.d_vid, s.t_vid, s.name, s.altname, s.description, s.keywords
+            FROM ({1}) AS s JOIN {2} AS docs ON docs.vid = s.vid"""
+            .format(self.SEARCH_TABLE, sql, self.SEARCH_DOCS_TABLE), *params)
+
+    def _delete_search_rows(self, where, *params):
+        '''Remove the search index rows for the docs table rows that match
+        the where clause, by docid'''
+        
+        docids = "SELECT docid FROM {} WHERE {}".format(self.SEARCH_DOCS_TABLE, where)
+        
+        self.connection.execute("DELETE FROM {} WHERE docid IN ({})".format(self.SEARCH_TABLE, docids), *params)
+        self.connection.execute("DELETE FROM {} WHERE {}".format(self.SEARCH_DOCS_TABLE, where), *params)
+
+    def _index_dataset(self, d_vid):
+        '''Replace the search index records for a dataset'''
+        
+        if not self.has_search_index:
+            return self.create_search_index()
+
+        with self.connection.begin():
+            self._delete_search_rows("d_vid = ?", d_vid)
+
+            for type_, d_vid_col, sql in self._SEARCH_SOURCES:
+                self._insert_search_rows("{} AND {} = ?".format(sql, d_vid_col), d_vid)
+
+    def _index_partitions(self, vids):
+        '''Replace the search index records for some partitions, and 
+        add the records for their tables and columns if they are missing'''
+
+        if not self.has_search_index:
+            return self.create_search_index()
+
+        vids = list(vids)
+
+        if not vids:
+            return
+
+        params = ','.join('?' * len(vids))
+
+        sources = dict((type_, sql) for type_, _, sql in self._SEARCH_SOURCES)
+
+        with self.connection.begin():
+            self._delete_search_rows("vid IN ({})".format(params), *vids)
+
+            self._insert_search_rows("{} AND p_vid IN ({})".format(sources['partition'], params), *vids)
+
+            t_vids = "(SELECT p_t_vid FROM partitions WHERE p_vid IN ({}))".format(params)
+            indexed = "(SELECT vid FROM {})".format(self.SEARCH_DOCS_TABLE)
+
+            self._insert_search_rows("{} AND t_vid IN {} AND t_vid NOT IN {}"
+                                     .format(sources['table'], t_vids, indexed), *vids)
+
+            self._insert_search_rows("{} AND c_t_vid IN {} AND c_vid NOT IN {}"
+                                     .format(sources['column'], t_vids, indexed), *vids)
+
+    def _unindex(self, column, value):
+        '''Remove search index records by vid or dataset vid'''
+
+        if not self.has_search_index:
+            return
+
+        with self.connection.begin():
+            self._delete_search_rows("{} = ?".format(column), value)
+
+    def search(self, terms, types=None, limit=100):
+        '''Search the names, descriptions and keywords of datasets, tables, columns
+        and partitions with the full text search index. 
+        
+        Args:
+            terms. An FTS4 query: words, which must all match, 'word*' for a prefix,
+            OR, and quoted phrases. 
+            
+            types. If not None, a list of the types of records to return: 'dataset', 
+            'table', 'column' or 'partition'
+            
+            limit. The maximum number of results
+            
+        returns:
+            A list of dicts, ordered by decreasing rank, with the 'type' and 'rank'
+            of the match and, like find(), the 'identity' of the dataset and the 
+            'partition', 'table' or 'column' that matched. 
+        '''
+        from databundles.orm import Dataset, Partition, Table, Column
+
+        if not self.has_search_index:
+            self.create_search_index()
+
+        if not self.has_search_index:
+            raise QueryError("Full text search requires a Sqlite library database")
+        
+        sql = """SELECT type, vid, d_vid, t_vid, search_rank(matchinfo({table}, 'pcnx')) AS rank
+                 FROM {table} WHERE {table} MATCH ? {types} ORDER BY rank DESC LIMIT ?"""
+
+        params = [terms]
+
+        if types:
+            type_sql = "AND type IN ({})".format(','.join('?' * len(types)))
+            params += list(types)
+        else:
+            type_sql = ''
+
+        params.append(limit)
+
+        hits = self.connection.execute(sql.format(table=self.SEARCH_TABLE, types=type_sql), *params).fetchall()
+
+        # Load the records for all of the hits with one query per type
+        s = self.session
+
+        def load(orm, vids):
+            vids = list(set(vids))
+            return dict((o.vid, o) for o in s.query(orm).filter(orm.vid.in_(vids)).all()) if vids else {}
+
+        datasets = load(Dataset, [ h.d_vid for h in hits ])
+        tables = load(Table, [ h.t_vid for h in hits if h.t_vid ])
+        partitions = load(Partition, [ h.vid for h in hits if h.type == 'partition' ])
+        columns = load(Column, [ h.vid for h in hits if h.type == 'column' ])
+
+        out = []
+
+        for h in hits:
+            if h.d_vid not in datasets:
+                continue
+
+            o = {'type': h.type, 'rank': h.rank, 'identity': datasets[h.d_vid].identity.to_dict()}
+
+            if h.type == 'partition' and h.vid in partitions:
+                o['partition'] = partitions[h.vid].identity.to_dict()
+
+            if h.t_vid in tables:
+                o['table'] = tables[h.t_vid].to_dict()
+
+            if h.type == 'column' and h.vid in columns:
+                o['column'] = columns[h.vid].to_dict()
+
+            out.append(o)
+
+        self.close_session()
+
+        return out
+
     #
     # Database backup and restore. Synchronizes the database with 
     # a remote. This is used when a library is created attached to a remote, and 
@@ -1135,25 +1582,105 @@ class LibraryDb(object):
     #
         
         
-    def _copy_db(self, src, dst):
-        from databundles.orm import Dataset
-        from sqlalchemy.orm.exc import NoResultFound 
+    def _copy_tables(self, src, dst):
+        '''Return (table, column_names) for the tables in dst that are also in src, 
+        sorted by foreign key dependency, with the columns that are in both'''
+
+        inspector = src.inspector
+
+        src_tables = set(inspector.get_table_names(schema=src._schema))
+
+        tables = []
+        for table in dst.metadata.sorted_tables:
+            # The search index is rebuilt after the copy, rather than copied
+            if table.name not in src_tables or table.name.startswith(self.SEARCH_TABLE):
+                continue
+
+            src_columns = set(c['name'] for c in inspector.get_columns(table.name, schema=src._schema))
+
+            tables.append((table, [ c.name for c in table.columns if c.name in src_columns ]))
+
+        return tables
+
+    def _copy_db(self, src, dst, chunk_size=10000):
+        '''Replace the contents of the dst database with the contents of src. 
         
-        try: 
-            dst.session.query(Dataset).filter(Dataset.vid=='a0').delete()
-        except:
-            pass
-            
-        for table in self.metadata.sorted_tables: # sorted by foreign key dependency
+        Sqlite to Sqlite copies attach the source to the destination and 
+        copy each table with an INSERT ... SELECT, so the rows never leave 
+        Sqlite. Other combinations stream rows from the source and write 
+        them in chunks of chunk_size with executemany(). In both cases the
+        destination is replaced in a single transaction. The destination's 
+        search index is rebuilt after the copy. '''
 
-            rows = src.session.execute(table.select()).fetchall()
-            dst.session.execute(table.delete())
-            for row in rows:
-                dst.session.execute(table.insert(), row)
+        # Release any transactions the sessions have open on either database
+        src.close_session()
+        dst.close_session()
+
+        tables = self._copy_tables(src, dst)
+
+        if src.driver == 'sqlite' and dst.driver == 'sqlite':
+            self._attach_copy(src, dst, tables)
+        else:
+            self._stream_copy(src, dst, tables, chunk_size)
+
+        if dst.has_search_index:
+            dst.rebuild_search_index()
+
+    def _attach_copy(self, src, dst, tables):
+        '''Copy tables from one sqlite database to another, inside sqlite'''
+
+        conn = dst.engine.connect()
+
+        try:
+            conn.execute("ATTACH DATABASE ? AS copy_src", os.path.abspath(src.dbname))
+
+            try:
+                with conn.begin():
+                    for table, _ in reversed(tables):
+                        conn.execute(table.delete())
+
+                    for table, columns in tables:
+                        names = ', '.join('"{}"'.format(c) for c in columns)
+                        conn.execute('INSERT INTO main."{table}" ({names}) SELECT {names} FROM copy_src."{table}"'
+                                     .format(table=table.name, names=names))
+            finally:
+                conn.execute("DETACH DATABASE copy_src")
+        finally:
+            conn.close()
+
+    def _stream_copy(self, src, dst, tables, chunk_size):
+        '''Copy tables between databases of any dialect, holding at most 
+        chunk_size rows in memory'''
+        from sqlalchemy.sql import select
+
+        src_conn = src.engine.connect().execution_options(stream_results=True)
+        dst_conn = dst.engine.connect()
+
+        try:
+            for db, conn in ((src, src_conn), (dst, dst_conn)):
+                if db.driver in ('postgres','postgis') and db._schema:
+                    conn.execute("SET search_path TO {}".format(db._schema))
+
+            with dst_conn.begin():
+                for table, _ in reversed(tables):
+                    dst_conn.execute(table.delete())
+
+                for table, columns in tables:
+                    result = src_conn.execute(select([ table.c[c] for c in columns ]))
+
+                    while True:
+                        rows = result.fetchmany(chunk_size)
+
+                        if not rows:
+                            break
+
+                        dst_conn.execute(table.insert(), [ dict(zip(columns, row)) for row in rows ])
+
+                    result.close()
+        finally:
+            src_conn.close()
+            dst_conn.close()
 
-        dst.session.commit()
-            
-                        
     def dump(self, path):
         '''Copy the database to a new Sqlite file, as a backup. '''
         import datetime
@@ -1253,6 +1780,15 @@ class QueryCommand(object):
         word*   Matches a text field that begins with 'word'
         *word   Matches a text fiels that
     
+    Text
+        any
+        
+    A Text search, such as text.any='income poverty', uses the library's 
+    full text search index, if there are no other components, and the results
+    are ranked, with the best matches first. With other components, or on a 
+    database without the index, each word of the text must be in one of the 
+    names or descriptions of the records that the other components select. 
+    
     '''
 
     def __init__(self, dict_ = None):
@@ -1394,6 +1930,11 @@ class QueryCommand(object):
     def partition(self):
         '''Return an array of terms for partition searches'''
         return self.getsubdict('partition')  
+
+    @property
+    def text(self):
+        '''Return an array of terms for full text searches'''
+        return self.getsubdict('text')
          
 
     def __str__(self):
@@ -1811,6 +2352,11 @@ class Library(object):
     def find(self, query_command):
 
         return self.database.find(query_command)
+
+    def search(self, terms, types=None, limit=100):
+        '''Full text search of the library database. See LibraryDb.search()'''
+
+        return self.database.search(terms, types=types, limit=limit)
         
         
     def remote_find(self, query_command):
@@ -1922,6 +2468,7 @@ class Library(object):
     def put_file(self, identity, file_path, state='new', force=False):
         '''Store a dataset or partition file, without having to open the file
         to determine what it is, by using  seperate identity''' 
+        from databundles.util import md5_for_file
         
         if isinstance(identity , dict):
             identity = new_identity(identity)
@@ -1939,11 +2486,13 @@ class Library(object):
 
         
 
+        md5 = md5_for_file(dst)
+
         if identity.is_bundle:
             self.database.install_bundle_file(identity, file_path)
-            self.database.add_file(dst, self.cache.repo_id, identity.vid,  state, type_ ='bundle')
+            self.database.add_file(dst, self.cache.repo_id, identity.vid,  state, type_ ='bundle', content_hash=md5)
         else:
-            self.database.add_file(dst, self.cache.repo_id, identity.vid,  state, type_ = 'partition')
+            self.database.add_file(dst, self.cache.repo_id, identity.vid,  state, type_ = 'partition', content_hash=md5)
 
         return dst, identity.cache_key, self.cache.last_upstream().path(identity.cache_key)
      
@@ -1967,6 +2516,90 @@ class Library(object):
 
         return dst, cache_key, url
 
+    def put_partitions(self, bundle, partitions, force=False, n_workers=4, batch_size=100):
+        '''Install partition files into the library. A pool of threads copies
+        the files to the cache and hashes the copies, as put_file() does, while
+        this thread, as the only writer to the library database, installs the
+        records, in one transaction per batch_size partitions.
+
+        Caches that aren't thread safe, like FsLimitedCache, which keeps a
+        sqlite connection, are written by this thread, but the hashing is 
+        still done in parallel. 
+
+        Yields (partition, dst, cache_key, url) for each partition as its
+        batch is committed, in the order the copies finish.
+        '''
+        from multiprocessing.pool import ThreadPool
+        from databundles.util import md5_for_file
+
+        thread_safe = self.cache.thread_safe
+
+        # Partition objects aren't thread safe, so get everything the workers
+        # need here.
+        jobs = [ (p, p.identity, p.database.path) for p in partitions ]
+
+        def put(identity, path):
+            if not self.cache.has(identity.cache_key) or force:
+                dst = self.cache.put(path, identity.cache_key)
+            else:
+                dst = self.cache.path(identity.cache_key)
+
+            if not os.path.exists(dst):
+                raise Exception("cache {}.put() didn't return an existent path. got: {}".format(type(self.cache), dst))
+
+            if self.remote and self.sync:
+                self.remote.put(identity, path)
+
+            return dst
+
+        def copy(job):
+            p, identity, path = job
+
+            if not thread_safe:
+                return p, identity, path, None, None
+
+            dst = put(identity, path)
+
+            return p, identity, path, dst, md5_for_file(dst)
+
+        def install(batch):
+
+            if not thread_safe:
+                dsts = [ put(identity, path) for _, identity, path, _, _ in batch ]
+                batch = [ (p, identity, path, dst, md5) for (p, identity, path, _, _), dst, md5 
+                          in zip(batch, dsts, pool.map(md5_for_file, dsts)) ]
+
+            files = [ (p, dst, md5) for p, _, _, dst, md5 in batch ]
+
+            self.database.install_partitions(bundle, files, self.cache.repo_id)
+
+            return [ (p, dst, p.identity.cache_key, self.cache.last_upstream().path(p.identity.cache_key)) 
+                     for p, dst, _ in files ]
+
+        pool = ThreadPool(max(1, min(n_workers, len(jobs))))
+
+        try:
+            batch = []
+
+            for r in pool.imap_unordered(copy, jobs):
+                batch.append(r)
+
+                if len(batch) >= batch_size:
+                    for r in install(batch):
+                        yield r
+                    batch = []
+
+            if batch:
+                for r in install(batch):
+                    yield r
+
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
     def remove(self, bundle):
         '''Remove a bundle from the library, and delete the configuration for
         it from the library database'''
@@ -2145,21 +2778,39 @@ class Library(object):
                 else:
                     self.logger.info('            {} Ignored; not in remote'.format(p.identity.name))
 
-    def rebuild(self):
+    def rebuild(self, incremental=False, n_workers=None):
         '''Rebuild the database from the bundles that are already installed
-        in the repository cache'''
-  
+        in the repository cache
+        
+        With incremental=True, the database is not cleaned, and the file 
+        records are used as a manifest: only files whose size or modification
+        time differs from the manifest are hashed, and of those, only the ones
+        whose md5 also differs are opened and re-installed. Records for files 
+        that are no longer in the cache are removed. A full rebuild opens all
+        of the files without hashing them. 
+        
+        The files are hashed and opened in a pool of n_workers processes. 
+        
+        Returns the bundles that were installed. 
+        '''
         from databundles.bundle import DbBundle
+        from multiprocessing import Pool
    
-        self.logger.info("Clean database {}".format(self.database.dsn))
-        self.database.clean()
+        if incremental:
+            manifest = self.database.manifest(self.cache.repo_id)
+        else:
+            self.logger.info("Clean database {}".format(self.database.dsn))
+            self.database.clean()
+            manifest = {}
+
         self.logger.info("Create database {}".format(self.database.dsn))
         self.database.create()
-   
-        bundles = []
         
         self.logger.info("Rebuilding from dir {}".format(self.cache.cache_dir))
         
+        jobs = []
+        found = set()
+        
         for r,d,f in os.walk(self.cache.cache_dir): #@UnusedVariable
             
             if '/meta/' in r:
@@ -2169,22 +2820,59 @@ class Library(object):
             
                 if file_.endswith(".db"):
                     path_ = os.path.join(r,file_)
-                    try:
-                        b = DbBundle(path_)
-                        # This is a fragile hack -- there should be a flag in the database
-                        # that diferentiates a partition from a bundle. 
-                        f = os.path.splitext(file_)[0]
-    
-                        if b.db_config.get_value('info','type') == 'bundle':
-                            self.logger.info("Queing: {} from {}".format(b.identity.vname, file_))
-                            bundles.append(b)
-                            
-                    except Exception as e:
-                        pass
-                        #self.logger.error('Failed to process {}, {} : {} '.format(file_, path_, e))
+                    found.add(path_)
 
-        
-        for bundle in bundles:
+                    size, modified, md5, _, _ = manifest.get(path_, (None, None, None, None, None))
+
+                    stat = os.stat(path_)
+                    
+                    if size == stat.st_size and modified == int(stat.st_mtime):
+                        continue
+
+                    jobs.append((path_, md5, incremental))
+
+        # Files in the manifest that have been deleted
+        for path_, (_, _, _, type_, _) in manifest.items():
+            if path_ not in found and type_ in ('bundle', 'partition') and path_.startswith(self.cache.cache_dir):
+                self.logger.info("Removing: {}".format(path_))
+                self.database.remove_file(path_)
+
+        self.logger.info("Scanning {} files in {} files".format(len(jobs), len(found)))
+
+        if len(jobs) > 1 and n_workers != 1:
+            pool = Pool(n_workers)
+            try:
+                results = pool.map(_rebuild_scan, jobs, chunksize = max(1, len(jobs) / 64))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = map(_rebuild_scan, jobs)
+
+        bundles = []
+        files = []
+
+        # The hashes of the files that were scanned, or that are unchanged 
+        # since the manifest was written, for the partitions of re-installed bundles
+        hashes = dict( (path_, md5) for path_, (_, _, md5, _, _) in manifest.items() )
+        hashes.update( (r['path'], r['md5']) for r in results if not r['error'] )
+
+        def add_file(path, ref, type_, md5=None):
+            files.append(dict(path=path, group=self.cache.repo_id, ref=ref, state='rebuilt', 
+                              type_=type_, content_hash=md5))
+
+        for r in results:
+            if r['error']:
+                self.logger.error('Failed to process {}: {} '.format(r['path'], r['error']))
+            elif r['type'] == 'unchanged':
+                # Only the stat signature changed, so just update it. 
+                _, _, _, type_, ref = manifest[r['path']]
+                add_file(r['path'], ref, type_, r['md5'])
+            elif r['type'] == 'bundle':
+                self.logger.info("Queing: {} from {}".format(r['vname'], r['path']))
+                bundles.append((DbBundle(r['path']), r['md5']))
+
+        for bundle, md5 in bundles:
             self.logger.info('Installing: {} '.format(bundle.identity.vname))
              
             try:
@@ -2193,16 +2881,21 @@ class Library(object):
                 self.logger.error('Failed to install bundle {}'.format(bundle.identity.vname))
                 continue
 
-            self.database.add_file(bundle.database.path, self.cache.repo_id, bundle.identity.vid,  'rebuilt', type_='bundle')
+            add_file(bundle.database.path, bundle.identity.vid, 'bundle', md5)
 
             for p in bundle.partitions:
                 if self.cache.has(p.identity.cache_key, use_upstream=False):
                     self.logger.info('            {} '.format(p.identity.vname))
-                    self.database.add_file(p.database.path, self.cache.repo_id, p.identity.vid,  'rebuilt', type_='partition')
-    
+                    add_file(p.database.path, p.identity.vid, 'partition', hashes.get(p.database.path))
+
+        # Partition files, after the bundles, so their records get the hashes
+        for r in results:
+            if r['type'] == 'partition' and not r['error']:
+                add_file(r['path'], r['vid'], 'partition', r['md5'])
+
+        self.database.add_files(files)
 
-        self.database.commit()
-        return bundles
+        return [ b for b, _ in bundles ]
 
     @property
     def info(self):
@@ -2214,6 +2907,78 @@ Remote:   {remote}
         """.format(name=self.name, database=self.database.dsn, 
                    cache=self.cache, remote=self.remote if self.remote else '')
 
+def _rebuild_scan(args):
+    '''Hash and open a file in the cache, for Library.rebuild(). Run in a
+    worker process, so it returns a dict of the path, stat signature, md5 and, 
+    if the md5 differs from the one in the manifest, the type and vid from the 
+    file's database. If hash_ is False, the file is opened without hashing it. '''
+    from databundles.util import md5_for_file
+
+    path, manifest_md5, hash_ = args
+
+    stat = os.stat(path)
+
+    r = dict(path=path, size=stat.st_size, modified=int(stat.st_mtime), 
+             md5=None, type=None, vid=None, vname=None, error=None)
+
+    try:
+        if hash_:
+            r['md5'] = md5_for_file(path)
+   
+        if manifest_md5 and r['md5'] == manifest_md5:
+            r['type'] = 'unchanged'
+            return r
+
+        b = DbBundle(path)
+
+        # This is a fragile hack -- there should be a flag in the database
+        # that diferentiates a partition from a bundle. 
+        r['type'] = b.db_config.get_value('info','type')
+
+        if r['type'] == 'partition':
+            r['vid'] = b.db_config.get_value('partition','vid')
+            r['vname'] = b.db_config.get_value('partition','vname')
+        else:
+            r['vid'] = b.identity.vid
+            r['vname'] = b.identity.vname
+
+        b.database.close()
+
+    except Exception as e:
+        r['error'] = str(e)
+
+    return r
+
+# Weights of the search_index columns in the search rank. The first four 
+# columns are not indexed. 
+_SEARCH_WEIGHTS = (0, 0, 0, 0, 4.0, 2.0, 1.0, 1.0)
+
+def _search_rank(matchinfo):
+    '''Rank a full text search match from the FTS4 matchinfo(search_index, 'pcnx')
+    blob. Each column with a hit counts the column's weight, scaled by the 
+    inverse document frequency of the phrase, so that rare terms, and 
+    matches on names, count more. '''
+    import array
+    import math
+
+    info = array.array('I', str(matchinfo))
+
+    n_phrases, n_cols, n_docs = info[0], info[1], info[2]
+
+    rank = 0.0
+    for i in range(n_phrases):
+        x = [ 3 + 3 * (i * n_cols + j) for j in range(n_cols) ]
+
+        idf = math.log(1.0 + float(n_docs) / (1 + max(info[k+2] for k in x)))
+
+        rank += idf * sum(_SEARCH_WEIGHTS[j] for j, k in enumerate(x) if info[k])
+
+    return rank
+
+def _search_on_connect(dbapi_con, con_record):
+    '''Register the rank function for full text searches'''
+    dbapi_con.create_function('search_rank', 1, _search_rank)
+
 def _pragma_on_connect(dbapi_con, con_record):
     '''ISSUE some Sqlite pragmas when the connection is created'''
 
@@ -15,6 +15,7 @@ from sqlalchemy.types import TypeDecorator, TEXT, PickleType
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.mutable import Mutable
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm.exc import DetachedInstanceError
 
 from sqlalchemy.sql import text
 from databundles.identity import  DatasetNumber, ColumnNumber
@@ -560,10 +561,7 @@ Columns:
     
     @orm.reconstructor
     def init_on_load(self):
-        self._or_validator = None
-        self._and_validator = None
-        self._null_row = None
-        self._row_hasher = None
+        self._memo = {}
         
     @staticmethod
     def before_insert(mapper, conn, target):
@@ -644,6 +642,9 @@ Columns:
         if kwargs.get('commit', True):
             s.commit()
     
+        # The new column isn't in self.columns until they are reloaded
+        self.clear_memo()
+    
         return row
    
     def column(self, name_or_id, default=None):
@@ -718,130 +719,144 @@ Columns:
            
             return partial(struct.unpack, unpack_str), header, unpack_str, length
 
+    def get_fixed_reader(self, f, engine='numpy', **kwargs):
+            '''Return a databundles.fixed.FixedReader that reads a fixed width
+            file in blocks, with the column sizes, as for get_fixed_unpack().
+            Columns without a size get an empty string, so the rows have a value
+            for each column, in order, for the caster and ValueInserter.insert().
+            With the numpy engine, integer columns are parsed to ints.'''
+            from databundles.fixed import FixedReader
+
+            unpack_str = ''.join( "{}s".format(col.width if col.width else col.size or 0)
+                                  for col in self.columns )
+
+            return FixedReader(f, unpack_str, names = [ col.name for col in self.columns ],
+                               types = [ col.python_type for col in self.columns ], 
+                               engine = engine, **kwargs)
+
+    def clear_memo(self):
+        '''Clear the memoized caster, validators and hasher. Called from the 
+        attribute events when the table data or the columns change. Changing
+        the contents of a column's data dict in place doesn't fire an event, 
+        so call this after doing that. '''
+        self._memo = {}
+
+    def _memoized(self, key, build):
+        '''Return the object cached for key, or call build() to create it. '''
+            
+        try:
+            return self._memo[key]
+        except KeyError:
+            o = self._memo[key] = build()
+            return o
+
+    def _null_value(self, col):
+        if col.is_primary_key:
+            return None
+        elif col.default:
+            return col.default
+        else:
+            return None
+
     @property
     def null_row(self):
-        if self._null_row is None:
-            self._null_row = []
-            for col in self.columns:
-                if col.is_primary_key:
-                    v = None
-                elif col.default:
-                    v = col.default
-                else:
-                    v = None
-                    
-                self._null_row.append(v)
-            
-        return self._null_row
+        return self._memoized('null_row', lambda: [ self._null_value(col) for col in self.columns ])
 
     @property
     def null_dict(self):
-        if self._null_row is None:
-            self._null_row = {}
-            for col in self.columns:
-                if col.is_primary_key:
-                    v = None
-                elif col.default:
-                    v = col.default
-                else:
-                    v = None
-                    
-                self._null_row[col.name] = v
-            
-        return self._null_row
+        return self._memoized('null_dict', lambda: { col.name: self._null_value(col) for col in self.columns })
 
     def _get_validator(self, and_join=True):
-        '''Return a lambda function that, when given a row to this table, 
-        returns true or false to indicate the validitity of the row
+        '''Return a function that, when given a row to this table, 
+        returns true or false to indicate the validitity of the row. The 
+        function is generated code, with one comparison per mandatory 
+        column.  
         
         :param and_join: If true, join multiple column validators with AND, other
         wise, OR
         :type and_join: Bool
         
-        :rtype: a `LibraryDb` object
-    
-            
+        :rtype: a function
         '''
 
-        f = prior = lambda row : True
-        first = True
-        for i,col in  enumerate(self.columns):
+        tests = [ "str(row[{}]) != {}".format(i, repr(str(col.default)))
+                  for i, col in enumerate(self.columns) if (col.data or {}).get('mandatory', False) ]
 
-            if col.data.get('mandatory', False):
-                default_value = col.default
-                index = i
-                
-                if and_join:
-                    f = lambda row, default_value=default_value, index=index, prior=prior: prior(row) and str(row[index]) != str(default_value)
-                elif first:
-                    # OR joins would either need the initial F to be 'false', or just don't use it
-                    f = lambda row, default_value=default_value, index=index:  str(row[index]) != str(default_value)  
-                else:
-                    f = lambda row, default_value=default_value, index=index, prior=prior: prior(row) or str(row[index]) != str(default_value)
-                            
-                prior = f
-                first = False
-            
-        return f
-    
-    def validate_or(self, values):
+        if not tests:
+            body = "True"
+        else:
+            body = (" and " if and_join else " or ").join(tests)
+        
+        code = "def validator(row):\n    return {}\n".format(body)
 
-        if self._or_validator is None:
-            self._or_validator = self._get_validator(and_join=False)
+        env = {}
+        exec(code, env)
         
-        return self._or_validator(values)
+        return env['validator']
+
+    def validator(self, and_join=True):
+        '''Return the memoized validator function from _get_validator()'''
+        return self._memoized(('validator', and_join), lambda: self._get_validator(and_join=and_join))
+    
+    def validate_or(self, values):
+        return self.validator(and_join=False)(values)
      
     def validate_and(self, values):
-
-        if self._and_validator is None:
-            self._and_validator = self._get_validator(and_join=True)
-        
-        return self._and_validator(values)
+        return self.validator(and_join=True)(values)
     
-    def _get_hasher(self):
-        '''Return a  function to generate a hash for the row'''
-        import hashlib
+    @property
+    def hash_engine(self):
+        '''The name of the row hash engine, from the 'row_hash' value in the
+        table data. Defaults to md5, the engine for existing hash values. '''
+        return (self.data or {}).get('row_hash', 'md5')
+
+    def _get_hasher(self, engine=None):
+        '''Return a function to generate a hash for the row, from the 
+        values of the columns marked 'hash', or all of the columns except the
+        primary key. The function is a databundles.rowhash.RowHasher, for the 
+        table's engine by default. The md5 engine concatenates the values, 
+        each followed by a '|', so 1,23,4 and 12,3,4 aren't the same, and 
+        returns the first 14 hex digits of the md5 as an integer'''
+        from databundles.rowhash import new_hasher
  
         # Try making the hash set from the columns marked 'hash'
         indexes = [ i for i,c in enumerate(self.columns) if  
-                   c.data.get('hash',False) and  not c.is_primary_key  ]
+                   (c.data or {}).get('hash',False) and  not c.is_primary_key  ]
  
         # Otherwise, just use everything by the primary key. 
         if len(indexes) == 0:
             indexes = [ i for i,c in enumerate(self.columns) if not c.is_primary_key ]
 
-        def hasher(values):
-            m = hashlib.md5()
-            for index in indexes: 
-                x = values[index]
-                try:
-                    m.update(x.encode('utf-8')+'|') # '|' is so 1,23,4 and 12,3,4 aren't the same  
-                except:
-                    m.update(str(x)+'|') 
-            return int(m.hexdigest()[:14], 16)
-        
-        return hasher
+        # The widths, for engines that hash fixed-width fields
+        widths = [ self.columns[i].width or self.columns[i].size for i in indexes ]
+
+        return new_hasher(engine or self.hash_engine, indexes, widths)
+
+    @property
+    def hasher(self):
+        '''Return the memoized row hash function from _get_hasher()'''
+        return self._memoized(('hasher', self.hash_engine), self._get_hasher)
     
     def row_hash(self, values):
         '''Calculate a hash from a database row''' 
-        
-        if self._row_hasher is None:
-            self._row_hasher = self._get_hasher()
-            
-        return self._row_hasher(values)
+        return self.hasher(values)
          
     @property
     def caster(self):
         '''Returns a function that takes a row that can be indexed by positions which returns a new
-        row with all of the values cast to schema types. '''
+        row with all of the values cast to schema types. The caster, and the code it
+        compiles, are memoized until the columns change. '''
         from databundles.transform import CasterTransformBuilder
         
-        bdr = CasterTransformBuilder()
-        
-        for c in self.columns:
-            bdr.append(c.name, c.python_type)
+        def build():
+            bdr = CasterTransformBuilder()
+            
+            for c in self.columns:
+                bdr.append(c.name, c.python_type)
+            
+            return bdr
         
-        return bdr
+        return self._memoized('caster', build)
 
     @property
     def vid_enc(self):
@@ -851,6 +866,29 @@ Columns:
 event.listen(Table, 'before_insert', Table.before_insert)
 event.listen(Table, 'before_update', Table.before_update)
 
+def _clear_table_memo(target, *args):
+    '''event.listen method to clear the memoized caster, validators and hasher
+    of a table when its data or columns change, or of the column's table'''
+    
+    if isinstance(target, Column):
+        try:
+            target = target.table
+        except DetachedInstanceError:
+            return
+        
+    if target is not None and hasattr(target, '_memo'):
+        target.clear_memo()
+
+for _attr in (Column.name, Column.datatype, Column.size, Column.width, Column.is_primary_key,
+              Column.default, Column.data):
+    event.listen(_attr, 'set', _clear_table_memo)
+
+event.listen(Table.data, 'set', _clear_table_memo)
+event.listen(Table.columns, 'append', _clear_table_memo)
+event.listen(Table.columns, 'remove', _clear_table_memo)
+event.listen(Table, 'refresh', _clear_table_memo)
+event.listen(Table, 'expire', _clear_table_memo)
+
 class Config(Base):
     
     ROOT_CONFIG_NAME = 'a0'
@@ -915,7 +953,57 @@ class File(Base, SavableMixin):
 
         return  dict((col, getattr(self, col)) for col 
                      in ['path', 'source_url', 'process', 'state', 'content_hash', 'modified', 'size', 'group', 'ref', 'type_','data'])
- 
+
+class ColumnStat(Base):
+    '''Statistics for a column of a partition's table. The table is stored in
+    the partition database, so it has one row per column. The minimum and
+    maximum are stored as strings, with dates and times in ISO format. '''
+
+    __tablename__ = 'colstats'
+
+    c_vid = SAColumn('cs_c_vid',String(16), primary_key=True, nullable=False)
+    p_vid = SAColumn('cs_p_vid',String(16))
+    name = SAColumn('cs_name',Text)
+    count = SAColumn('cs_count',BigInteger)
+    nulls = SAColumn('cs_nulls',BigInteger)
+    min = SAColumn('cs_min',Text)
+    max = SAColumn('cs_max',Text)
+    nuniques = SAColumn('cs_nuniques',BigInteger)
+    hist = SAColumn('cs_hist',MutationDict.as_mutable(JSONEncodedObj))
+
+    def __init__(self,**kwargs):
+        self.c_vid = kwargs.get("c_vid",None)
+        self.p_vid = kwargs.get("p_vid",None)
+        self.name = kwargs.get("name",None)
+        self.count = kwargs.get("count",None)
+        self.nulls = kwargs.get("nulls",None)
+        self.min = self._str(kwargs.get("min",None))
+        self.max = self._str(kwargs.get("max",None))
+        self.nuniques = kwargs.get("nuniques",None)
+        self.hist = kwargs.get("hist",None)
+
+    @staticmethod
+    def _str(v):
+        if v is None or isinstance(v, basestring):
+            return v
+        elif hasattr(v, 'isoformat'):
+            return v.isoformat()
+        else:
+            return unicode(v)
+
+    def to_dict(self):
+
+        return  dict((col, getattr(self, col)) for col
+                     in ['c_vid', 'p_vid', 'name', 'count', 'nulls', 'min', 'max', 'nuniques', 'hist'])
+
+    def to_row(self):
+        '''Return the record as a dict keyed by the database column names, for
+        inserting with the table's insert() statement'''
+        return dict((c.name, getattr(self, k)) for k, c in self.__mapper__.columns.items())
+
+    def __repr__(self):
+        return "<colstat: {}: {}>".format(self.c_vid, self.name)
+
 
 class Partition(Base):
     __tablename__ = 'partitions'
@@ -358,7 +358,20 @@ class PartitionBase(PartitionInterface):
         from ..database.dbm import Dbm
         
         return Dbm(self.bundle, base_path=self.path, suffix=suffix)
-        
+
+    def hash_index(self, suffix = None):
+        '''Return a HashIndex, a sorted file that maps row hashes to ids,
+        related to this partition'''
+
+        from ..dedup import HashIndex
+
+        path = self.path
+
+        if suffix:
+            path += '-'+suffix
+
+        return HashIndex(path+'.hidx')
+
         
     @property
     def help(self):
@@ -40,27 +40,15 @@ class CsvPartition(PartitionBase):
         if not min_key and not max_key and not count:
             t = self.table
             
-            if not t:
+            if not t or not self.database.exists():
                 return
     
+            # O(1) from the inserter's stats file, or a scan of the file
+            d = self.database.stats()
     
-            count = 0
-            min_ = 2**63
-            max_ = -2**63
-            
-            try:
-                for row in self.database.reader():
-                    count += 1
-                    v = int(row[0])
-                    min_ = min(min_, v)
-                    max_ = max(max_, v)
-            except ValueError:
-                min_ = None
-                max_  = None
-    
-            self.record.count = count
-            self.record.min_key = min_
-            self.record.max_key = max_
+            self.record.count = d['count']
+            self.record.min_key = d['min_key']
+            self.record.max_key = d['max_key']
         else:
             if min_key:
                 self.record.min_key = min_key
@@ -23,6 +23,7 @@ class SqlitePartition(PartitionBase):
         self.format = self.FORMAT
 
 
+
     @property
     def database(self):
         if self._database is None:
@@ -113,6 +114,8 @@ class SqlitePartition(PartitionBase):
     def clean(self):
         '''Delete all of the records in the tables declared for this oartition'''
         
+        self.collected_stats = None
+        
         for table in self.data.get('tables',[]):
             try: self.database.query("DELETE FROM {}".format(table))
             except: pass
@@ -228,14 +231,16 @@ class SqlitePartition(PartitionBase):
         
         self.clean()
       
-        lr = self.bundle.init_log_rate(100000)
-      
         if table is None:
             table = self.table
       
         for p in parts:
             self.bundle.log("Loading CSV partition: {}".format(p.identity.vname))
-            self.database.load(p.database, table, logger=lr )
+            
+        self.collected_stats = False
+        
+        # Load all of the parts at once, so the indexes are only rebuilt once. 
+        return self.database.load_bulk([p.database for p in parts], table, logger=self.bundle.log )
         
 
     @property
@@ -245,9 +250,78 @@ class SqlitePartition(PartitionBase):
         return self.database.query("SELECT * FROM {} ORDER BY {} ".format(self.get_table().name,pk))
         
 
-    def write_stats(self):
-        '''Record in the partition entry basic statistics for the partition's
-        primary table'''
+    def updater(self, table_or_name=None, **kwargs):
+        # Updates can change the minimums and maximums
+        self.collected_stats = False
+        
+        return self.database.updater(table_or_name, **kwargs)
+
+    @property
+    def collected_stats(self):
+        '''Column statistics collected by inserters, None if there are none, 
+        or False if rows were written that the statistics don't include. 
+        They are kept on the bundle's Partitions, so other objects for the 
+        same partition share them. '''
+        return self.bundle.partitions.collected_stats.get(self.identity.vid)
+    
+    @collected_stats.setter
+    def collected_stats(self, stats):
+        self.bundle.partitions.collected_stats[self.identity.vid] = stats
+
+    def inserter_stats(self, table):
+        '''Return the Stats object that inserters into the partition's table
+        add their rows to, or None if the table has rows that weren't 
+        written by an inserter of this partition object. '''
+        from ..stats import Stats
+        
+        if self.table is None or table.name != self.table.name:
+            return None
+        
+        if self.collected_stats is None:
+            if self.database.query("SELECT 1 FROM {} LIMIT 1".format(table.name)).fetchone():
+                self.collected_stats = False
+            else:
+                self.collected_stats = Stats(self.get_table())
+                
+        return self.collected_stats if self.collected_stats else None
+
+    def compute_stats(self):
+        '''Compute the column statistics of the partition's table in one 
+        scan of the table'''
+        from ..stats import Stats
+        
+        t = self.get_table()
+        
+        cols = ','.join('"{}"'.format(c.name) for c in t.columns)
+        
+        return Stats(t).scan(self.database.query("SELECT {} FROM {}".format(cols, t.name)))
+
+    @property
+    def stats(self):
+        '''The column statistics written by write_stats(), as a dict of 
+        orm.ColumnStat records, keyed by column name'''
+        from ..orm import ColumnStat
+        
+        if not 'colstats' in self.database.inspector.get_table_names():
+            return {}
+        
+        return { cs.name: cs for cs in self.database.session.query(ColumnStat).populate_existing().all() }
+
+    def write_stats(self, scan=False, merge=True):
+        '''Record in the partition entry the count and key range of the 
+        partition's primary table, and write statistics for each of the 
+        table's columns to the colstats table of the partition database. 
+        
+        The statistics collected by this partition's inserters are used if 
+        they cover all of the rows of the table. Otherwise, or with scan=True, 
+        they are computed in one scan of the table. 
+        
+        With merge=False, the partition record isn't merged into the bundle
+        database, so the caller can merge many records in one transaction. 
+        
+        Returns a dict of the count, min_key and max_key. '''
+        from ..orm import ColumnStat
+        
         t = self.get_table()
         
         if not t:
@@ -257,17 +331,35 @@ class SqlitePartition(PartitionBase):
             from ..dbexceptions import ConfigurationError
             raise ConfigurationError("Table {} does not have a primary key; can't compute states".format(t.name))
         
-        s = self.database.session
-        self.record.count = s.execute("SELECT COUNT(*) FROM {}".format(self.table.name)).scalar()
-        self.record.min_key = s.execute("SELECT MIN({}) FROM {}".format(t.primary_key.name,self.table.name)).scalar()
-        self.record.max_key = s.execute("SELECT MAX({}) FROM {}".format(t.primary_key.name,self.table.name)).scalar()
-        s.commit()
+        count = self.database.query("SELECT COUNT(*) FROM {}".format(t.name)).scalar()
         
-        with self.bundle.session as s:
-            s.merge(self.record)
-
-
+        stats = self.collected_stats
+        
+        if scan or not stats or not stats.valid or stats.count != count:
+            stats = self.compute_stats()
+       
+        pk = stats[t.primary_key.name]
+        
+        self.record.count = stats.count
+        self.record.min_key = pk.min
+        self.record.max_key = pk.max
 
+        table = ColumnStat.__table__
+        
+        table.create(bind=self.database.engine, checkfirst=True)
+        
+        rows = [ ColumnStat(c_vid = c.vid, p_vid = self.identity.vid, **stats[c.name].to_dict()).to_row() 
+                 for c in t.columns ]
+        
+        with self.database.connection.begin():
+            self.database.connection.execute(table.delete())
+            self.database.connection.execute(table.insert(), rows)
+        
+        if merge:
+            with self.bundle.session as s:
+                s.merge(self.record)
+            
+        return {'count': self.record.count, 'min_key': self.record.min_key, 'max_key': self.record.max_key}
 
     def __repr__(self):
         return "<db partition: {}>".format(self.identity.vname)
@@ -17,6 +17,11 @@ class Partitions(object):
     
     def __init__(self, bundle):
         self.bundle = bundle
+        
+        # Column statistics collected by partition inserters, keyed by the 
+        # partition vid, so they outlive the partition objects. See 
+        # SqlitePartition.inserter_stats()
+        self.collected_stats = {}
 
     def partition(self, arg,  **kwargs):
         '''Get a local partition object from either a Partion ORM object, or
@@ -0,0 +1,270 @@
+"""Row hash engines, which turn a subset of the values in a row into an integer
+that identifies the row, for de-duplicating geo dimension rows and linking
+them to record codes.
+
+There are two engines:
+
+md5
+    The original hash: the values, each followed by a '|', are hashed with
+    md5, and the first 14 hex digits are the hash. This is the default, since
+    the hashes are stored in partitions and translation files.
+
+fnv64
+    A 64 bit FNV-1a hash, computed over 64 bit little-endian words rather than
+    single bytes, then folded with the byte length. When all of the hashed
+    columns have a width or size, the values are packed to fixed-width fields
+    with the struct format from Table.get_fixed_unpack(), otherwise they are
+    delimited as for md5. Rows of the same width are hashed in batches with
+    numpy, and raw fixed-width records can be hashed straight from a buffer,
+    without splitting them into values.
+
+Both engines return 56 bit integers, so the hashes fit in a signed 64 bit
+database integer, and either can be used for the hash column of a table::
+
+    hasher = new_hasher('fnv64', indexes, widths)
+
+    hasher(values)                 # One row
+    hasher.hash_rows(rows)         # A list of rows, as a uint64 array
+    hasher.hash_records(buf, 120)  # Fixed-width records of 120 bytes
+
+Copyright (c) 2013 Clarinova. This file is licensed under the terms of the
+Revised BSD License, included in this distribution as LICENSE.txt
+"""
+
+import struct
+import hashlib
+import numpy as np
+
+FNV64_OFFSET = 0xcbf29ce484222325
+FNV64_PRIME = 0x100000001b3
+MASK64 = 0xffffffffffffffff
+
+def _part(x):
+    try:
+        return x.encode('utf-8')+'|'
+    except:
+        return str(x)+'|'
+
+def _field(x):
+    if isinstance(x, str):
+        return x
+    elif isinstance(x, unicode):
+        return x.encode('utf-8')
+    elif x is None:
+        return ''
+    else:
+        return str(x)
+
+def fnv64(s):
+    '''Return the 56 bit word-wise FNV-1a hash of a byte string'''
+
+    n = len(s)
+    pad = -n % 8
+
+    if pad:
+        s += '\0' * pad
+
+    h = FNV64_OFFSET
+    for w in struct.unpack('<{}Q'.format((n + pad) / 8), s):
+        h = ((h ^ w) * FNV64_PRIME) & MASK64
+
+    h = ((h ^ n) * FNV64_PRIME) & MASK64
+
+    return h >> 8
+
+def fnv64_array(strings, lengths=None):
+    '''Return the fnv64() hashes of a list of byte strings, or a numpy
+    array of fixed-width byte strings, as a numpy uint64 array. Each step of
+    the hash is done for all of the strings at once. '''
+
+    if not isinstance(strings, np.ndarray):
+        if lengths is None:
+            lengths = np.fromiter((len(s) for s in strings), dtype=np.uint64, count=len(strings))
+        strings = np.array(strings, dtype=np.string_)
+
+    n = len(strings)
+    width = strings.dtype.itemsize
+
+    if lengths is None:
+        lengths = np.empty(n, dtype=np.uint64)
+        lengths.fill(width)
+
+    # Pad the records to whole words. Shorter strings are already padded
+    # with zeros, and the words past their ends are skipped.
+    words = -(-width // 8)
+    buf = np.zeros((n, words * 8), dtype=np.uint8)
+    if n and width:
+        buf[:, :width] = strings.view(np.uint8).reshape(n, width)
+    buf = buf.view('<u8')
+
+    h = np.empty(n, dtype=np.uint64)
+    h.fill(FNV64_OFFSET)
+    prime = np.uint64(FNV64_PRIME)
+
+    variable = bool(n) and lengths.min() != lengths.max()
+
+    for i in range(words):
+        hw = (h ^ buf[:, i]) * prime
+        if variable:
+            h = np.where(lengths > i * 8, hw, h)
+        else:
+            h = hw
+
+    h = (h ^ lengths.astype(np.uint64)) * prime
+
+    return h >> np.uint64(8)
+
+class RowHasher(object):
+    '''Base class for row hash engines. A hasher is called with a row, and
+    hashes the values at the positions in indexes. '''
+
+    name = None
+
+    def __init__(self, indexes, widths=None):
+        self.indexes = list(indexes)
+        self.widths = widths
+        self._hash = self.compile()
+
+    def compile(self):
+        raise NotImplementedError()
+
+    def __call__(self, values):
+        return self._hash(values)
+
+    def hash_rows(self, rows):
+        '''Hash a list of rows, returning a numpy uint64 array'''
+        return np.fromiter((self._hash(row) for row in rows), dtype=np.uint64, count=len(rows))
+
+    def hash_records(self, buf, length, offsets=None):
+        raise NotImplementedError("The {} engine can't hash fixed-width records".format(self.name))
+
+    def _compile(self, template, env):
+        '''Generate the hash function. The template has a {fast} slot, for an
+        expression that works on rows of strings, and a {slow} slot, for one
+        that converts any values. '''
+
+        fast = " + ".join("values[{}].encode('utf-8') + '|'".format(i) for i in self.indexes) or "''"
+        slow = " + ".join("_part(values[{}])".format(i) for i in self.indexes) or "''"
+
+        env = dict(env, _part=_part)
+        exec(template.format(fast=fast, slow=slow), env)
+
+        return env['hasher']
+
+class Md5Hasher(RowHasher):
+    '''The original row hash: the first 14 hex digits of the md5 of the
+    delimited values'''
+
+    name = 'md5'
+
+    def compile(self):
+
+        return self._compile("""def hasher(values):
+    try:
+        s = {fast}
+    except Exception:
+        s = {slow}
+    return int(_md5(s).hexdigest()[:14], 16)
+""", {'_md5': hashlib.md5})
+
+class Fnv64Hasher(RowHasher):
+    '''The word-wise FNV-1a hash of the values, packed to fixed-width fields
+    when all of the hashed columns have widths, or delimited otherwise. '''
+
+    name = 'fnv64'
+
+    def compile(self):
+
+        self.fixed = bool(self.indexes) and self.widths is not None and all(self.widths)
+
+        if not self.fixed:
+            return self._compile("""def hasher(values):
+    try:
+        s = {fast}
+    except Exception:
+        s = {slow}
+    return _fnv64(s)
+""", {'_fnv64': fnv64})
+
+        self.struct = struct.Struct(''.join('{}s'.format(w) for w in self.widths))
+        self.length = self.struct.size
+
+        args = ", ".join("values[{}]".format(i) for i in self.indexes)
+        slow = ", ".join("_field(values[{}])".format(i) for i in self.indexes)
+
+        code = """def hasher(values):
+    try:
+        s = _pack({args})
+    except Exception:
+        s = _pack({slow})
+    return _fnv64(s)
+""".format(args=args, slow=slow)
+
+        env = {'_pack': self.struct.pack, '_field': _field, '_fnv64': fnv64}
+        exec(code, env)
+
+        return env['hasher']
+
+    def pack(self, row):
+        '''Return the bytes that are hashed for a row'''
+
+        if self.fixed:
+            return self.struct.pack(*[ _field(row[i]) for i in self.indexes ])
+        else:
+            return ''.join(_part(row[i]) for i in self.indexes)
+
+    def hash_rows(self, rows):
+        '''Hash a list of rows with numpy, returning a uint64 array. The
+        values are packed one row at a time, and hashed all at once. '''
+
+        if self.fixed:
+            pack = self.struct.pack
+            try:
+                data = ''.join(pack(*[ row[i] for i in self.indexes ]) for row in rows)
+            except Exception:
+                data = ''.join(self.pack(row) for row in rows)
+
+            return fnv64_array(np.frombuffer(data, dtype='S{}'.format(self.length)))
+        else:
+            return fnv64_array([ self.pack(row) for row in rows ])
+
+    def hash_records(self, buf, length, offsets=None):
+        '''Hash the fixed-width records in a buffer, such as a block read from
+        a fixed-width file, with records of length bytes, including any line
+        ending. offsets is the position of each hashed field in the record,
+        which defaults to the hashed fields being the leading fields of the
+        record, in order. The hashes are the same as for rows of the unpacked,
+        unstripped field values. '''
+
+        if not self.fixed:
+            raise ValueError("Records can only be hashed when all of the hashed columns have widths")
+
+        if offsets is None:
+            offsets = []
+            pos = 0
+            for w in self.widths:
+                offsets.append(pos)
+                pos += w
+
+        a = np.frombuffer(buf, dtype=np.uint8)
+        a = a[:len(a) - len(a) % length].reshape(-1, length)
+
+        # Gather the bytes of the hashed fields into contiguous records
+        fields = np.concatenate([ a[:, o:o+w] for o, w in zip(offsets, self.widths) ], axis=1)
+
+        return fnv64_array(np.ascontiguousarray(fields).view('S{}'.format(self.length)).ravel())
+
+HASHERS = {
+    Md5Hasher.name: Md5Hasher,
+    Fnv64Hasher.name: Fnv64Hasher
+}
+
+def new_hasher(engine, indexes, widths=None):
+    '''Create a row hasher for the named engine'''
+
+    try:
+        cls = HASHERS[engine or 'md5']
+    except KeyError:
+        raise ValueError("Unknown row hash engine '{}'; expected one of {}".format(engine, sorted(HASHERS.keys())))
+
+    return cls(indexes, widths)
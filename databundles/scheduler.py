@@ -0,0 +1,338 @@
+"""Run bundle build tasks, usually one per partition, across a pool of worker
+processes.
+
+A build method declares tasks that name a method on the bundle, the arguments
+to call it with, and the names of other tasks that must finish first::
+
+    def build(self):
+        s = self.scheduler()
+
+        for state in self.states:
+            s.add('geo-'+state, 'run_geo_dim', state)
+
+        s.add('join', 'join_partitions', deps = [ 'geo-'+state for state in self.states ])
+
+        return s.run()
+
+Each worker process constructs its own instance of the bundle class, so each
+worker opens its own database and partition connections.
+
+Copyright (c) 2013 Clarinova. This file is licensed under the terms of the
+Revised BSD License, included in this distribution as LICENSE.txt
+"""
+
+import time
+
+class Task(object):
+    '''A call to a bundle method, with dependencies on other tasks'''
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+
+    def __init__(self, name, method, args=None, kwargs=None, deps=None, retries=0):
+        self.name = name
+        self.method = method
+        self.args = tuple(args) if args else tuple()
+        self.kwargs = kwargs if kwargs else {}
+        self.deps = list(deps) if deps else []
+        self.retries = retries
+
+        self.state = self.PENDING
+        self.attempts = 0
+        self.time = 0.0
+        self.result = None
+        self.error = None
+
+    @property
+    def call(self):
+        '''The picklable part of the task that is sent to the worker'''
+        return (self.name, self.method, self.args, self.kwargs)
+
+    def __repr__(self):
+        return "<task: {} {}{} {}>".format(self.name, self.method, self.args, self.state)
+
+#
+# Worker process functions. The bundle is created once per worker process, in
+# the pool initializer, and re-created after a task fails, so a failure can't
+# leave a broken session or connection for the next task.
+#
+
+_worker_init_args = None
+_worker_bundle = None
+
+def _init_worker(bundle_class, bundle_dir, run_args):
+    global _worker_init_args, _worker_bundle
+
+    _worker_init_args = (bundle_class, bundle_dir, run_args)
+    _worker_bundle = None
+
+def _get_worker_bundle():
+    global _worker_bundle
+
+    if _worker_bundle is None:
+        bundle_class, bundle_dir, run_args = _worker_init_args
+        _worker_bundle = bundle_class(bundle_dir)
+
+        if run_args is not None:
+            _worker_bundle.run_args = run_args
+
+    return _worker_bundle
+
+def _run_task(call):
+    '''Run a task in a worker process. Returns a tuple of the task name,
+    a success flag, the return value or an error message, and the elapsed time '''
+    global _worker_bundle
+
+    name, method, args, kwargs = call
+
+    start = time.time()
+
+    try:
+        bundle = _get_worker_bundle()
+        r = getattr(bundle, method)(*args, **kwargs)
+        return name, True, r, time.time() - start
+    except (KeyboardInterrupt, SystemExit):
+        raise
+    except Exception as e:
+        import traceback
+        _worker_bundle = None
+        return name, False, "{}: {}\n{}".format(type(e).__name__, e, traceback.format_exc()), time.time() - start
+
+class TaskScheduler(object):
+    '''Schedule bundle tasks, respecting dependencies, on a pool of worker processes.
+
+    Failed tasks are re-run up to their number of retries. When a task fails
+    for the last time, the tasks that depend on it are skipped, but other
+    tasks continue to run.
+    '''
+
+    def __init__(self, bundle, n_workers=None, retries=0, poll_interval = .1):
+        '''
+        Args:
+            bundle. The BuildBundle that the task methods are called on.
+
+            n_workers. Number of worker processes. If None, 0 or 1, the tasks
+            are run in this process, on the bundle.
+
+            retries. The default number of times to retry a failed task
+        '''
+
+        self.bundle = bundle
+        self.n_workers = n_workers
+        self.retries = retries
+        self.poll_interval = poll_interval
+
+        self.tasks = {}
+        self._order = []
+
+    def add(self, name, method, *args, **kwargs):
+        '''Add a task.
+
+        Args:
+            name. A unique name for the task
+
+            method. The name of the bundle method to call
+
+            args, kwargs. Arguments for the method. These must be picklable.
+
+            deps. Keyword argument, a list of names of tasks that must
+            complete before this one is run.
+
+            retries. Keyword argument, overrides the scheduler's retries for this task
+
+        '''
+
+        deps = kwargs.pop('deps', None)
+        retries = kwargs.pop('retries', self.retries)
+
+        if name in self.tasks:
+            raise ValueError("Task '{}' already exists".format(name))
+
+        if not hasattr(self.bundle, method):
+            raise ValueError("Bundle does not have a method named '{}'".format(method))
+
+        task = Task(name, method, args, kwargs, deps = deps, retries = retries)
+
+        self.tasks[name] = task
+        self._order.append(name)
+
+        return task
+
+    def check(self):
+        '''Check that all dependencies exist, and that there are no cycles'''
+
+        for task in self.tasks.values():
+            for dep in task.deps:
+                if dep not in self.tasks:
+                    raise ValueError("Task '{}' depends on unknown task '{}'".format(task.name, dep))
+
+        done = set()
+        remaining = set(self.tasks.keys())
+
+        while remaining:
+            ready = set( name for name in remaining if all(dep in done for dep in self.tasks[name].deps))
+
+            if not ready:
+                raise ValueError("Dependency cycle among tasks: {}".format(', '.join(sorted(remaining))))
+
+            done |= ready
+            remaining -= ready
+
+    def _ready(self):
+        '''Return the pending tasks whose dependencies are done, and skip
+        the tasks whose dependencies failed'''
+
+        skipped = True
+
+        # Repeat until no more tasks are skipped, since skips cascade
+        while skipped:
+            ready = []
+            skipped = False
+
+            for name in self._order:
+                task = self.tasks[name]
+
+                if task.state != Task.PENDING:
+                    continue
+
+                dep_states = [ self.tasks[dep].state for dep in task.deps ]
+
+                if any(s in (Task.FAILED, Task.SKIPPED) for s in dep_states):
+                    task.state = Task.SKIPPED
+                    task.error = "Dependency failed"
+                    self.bundle.error("Skipping task {}: a dependency failed".format(name))
+                    skipped = True
+                elif all(s == Task.DONE for s in dep_states):
+                    ready.append(task)
+
+        return ready
+
+    def _finish(self, name, ok, r, elapsed):
+        '''Record the result of one attempt of a task. Returns True if the
+        task should be re-run'''
+
+        task = self.tasks[name]
+        task.time += elapsed
+
+        if ok:
+            task.state = Task.DONE
+            task.result = r
+            self.bundle.log("Finished task {} in {:.1f}s".format(name, elapsed))
+            return False
+
+        task.error = r
+
+        if task.attempts <= task.retries:
+            self.bundle.error("Task {} failed, attempt {} of {}; retrying: {}"
+                              .format(name, task.attempts, task.retries + 1, r))
+            task.state = Task.PENDING
+            return True
+        else:
+            self.bundle.error("Task {} failed: {}".format(name, r))
+            task.state = Task.FAILED
+            return False
+
+    def _run_serial(self):
+
+        while True:
+            ready = self._ready()
+
+            if not ready:
+                break
+
+            for task in ready:
+                task.state = Task.RUNNING
+                task.attempts += 1
+                start = time.time()
+
+                try:
+                    r = getattr(self.bundle, task.method)(*task.args, **task.kwargs)
+                    self._finish(task.name, True, r, time.time() - start)
+                except (KeyboardInterrupt, SystemExit):
+                    raise
+                except Exception as e:
+                    import traceback
+                    self._finish(task.name, False, "{}: {}\n{}".format(type(e).__name__, e, traceback.format_exc()),
+                                 time.time() - start)
+
+    def _run_pool(self):
+        from multiprocessing import Pool
+
+        pool = Pool(processes = int(self.n_workers), initializer = _init_worker,
+                    initargs = (self.bundle.__class__, self.bundle.bundle_dir, getattr(self.bundle, 'run_args', None)))
+
+        running = {}
+
+        try:
+            while True:
+                for task in self._ready():
+                    task.state = Task.RUNNING
+                    task.attempts += 1
+                    running[task.name] = pool.apply_async(_run_task, (task.call,))
+
+                if not running:
+                    break
+
+                done = [ name for name, result in running.items() if result.ready() ]
+
+                if not done:
+                    time.sleep(self.poll_interval)
+                    continue
+
+                for name in done:
+                    result = running.pop(name)
+
+                    try:
+                        self._finish(*result.get())
+                    except Exception as e:
+                        # Errors that escape _run_task, such as a result that can't be pickled
+                        self._finish(name, False, "{}: {}".format(type(e).__name__, e), 0)
+
+            pool.close()
+
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def run(self):
+        '''Run all of the tasks. Returns True if all of the tasks completed'''
+
+        self.check()
+
+        start = time.time()
+
+        if self.n_workers and int(self.n_workers) > 1:
+            self._run_pool()
+        else:
+            self._run_serial()
+
+        self.time = time.time() - start
+
+        self.report()
+
+        return all( t.state == Task.DONE for t in self.tasks.values() )
+
+    @property
+    def failed(self):
+        return [ self.tasks[name] for name in self._order if self.tasks[name].state in (Task.FAILED, Task.SKIPPED) ]
+
+    def report(self):
+        '''Log the state, attempts and wall-clock time of each task'''
+
+        width = max([len(name) for name in self._order] + [4])
+
+        self.bundle.log("{:{w}s} {:8s} {:>8s} {:>10s}".format('task', 'state', 'attempts', 'seconds', w = width))
+
+        for name in self._order:
+            task = self.tasks[name]
+            self.bundle.log("{:{w}s} {:8s} {:8d} {:10.2f}".format(name, task.state, task.attempts, task.time, w = width))
+
+        busy = sum( t.time for t in self.tasks.values() )
+
+        self.bundle.log("{} tasks, {} failed, {:.2f}s elapsed, {:.2f}s in tasks"
+                        .format(len(self.tasks), len(self.failed), self.time, busy ))
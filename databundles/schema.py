@@ -27,6 +27,15 @@ def _clean_int(i):
         return None
         raise ValueError("Input must be convertable to an int. got:  ".str(i)) 
 
+class _DictRows(object):
+    '''Iterate rows as dicts, for each iteration of an iterable of rows'''
+    
+    def __init__(self, rows):
+        self.rows = rows
+        
+    def __iter__(self):
+        return (dict(row) for row in self.rows)
+
 class Schema(object):
     """Represents the table and column definitions for a bundle
     """
@@ -1047,6 +1056,8 @@ class {name}(Base):
                 c.datatype = type_map[fields[i]['type']]
                 c.default = '-' if fields[i]['type'] == str  else -1
                 s.merge(c)
+
+            table.clear_memo()
            
         # Need to expire the unmanaged cache, or the regeneration of the schema in _revise_schema will 
         # use the cached schema object rather than the ones we just updated, if the schem objects
@@ -1055,14 +1066,36 @@ class {name}(Base):
         
                 
                 
-    def update(self, table_name, itr, logger=None):
-        '''Update the schema from an interator that returns rows. '''
-        
-        memo = None
+    def intuit_rows(self, rows, sample=False, **kwargs):
+        '''Like intuit(), but for all of the rows at once, testing all of the 
+        values of a column together. With sample, only the head and tail
+        rows and a reservoir sample of the others are tested, and, if rows 
+        can be iterated again, the columns whose sampled values have 
+        conflicting types are tested with all of the rows. Returns a memo for 
+        _update_from_memo(), with a confidence for each field. 
+        
+        See databundles.intuit.intuit_rows() for the other arguments. '''
+        from databundles.intuit import intuit_rows
+        
+        return intuit_rows(rows, sample=sample, **kwargs)
+                
+    def update(self, table_name, itr, logger=None, sample=False):
+        '''Update the schema from an interator that returns rows. With sample,
+        use intuit_rows() to test a sample of the rows. '''
         
-        for row in itr:
-            memo = self.intuit(dict(row), memo)
-            logger()
+        if sample:
+            if iter(itr) is itr:
+                rows = (dict(row) for row in itr)
+            else:
+                rows = _DictRows(itr)
+                
+            memo = self.intuit_rows(rows, sample=True)
+        else:
+            memo = None
+            
+            for row in itr:
+                memo = self.intuit(dict(row), memo)
+                logger()
 
         self._update_from_memo(table_name, memo)
 
@@ -14,6 +14,7 @@ import databundles.util
 from databundles.bundle import DbBundle
 import logging
 import os
+import types
 from sqlalchemy.orm.exc import NoResultFound
 
 import databundles.client.exceptions as exc
@@ -25,14 +26,113 @@ logger.setLevel(logging.DEBUG)
 # The LibraryPlugin allows the library to be inserted into a reuest handler with a
 # 'library' argument. 
 class LibraryPlugin(object):
+    '''Pass a library to request handlers that have a `library` argument. 
     
-    def __init__(self, library_creator, keyword='library'):
+    The Sqlite driver isn't multi-threaded, so each server thread gets its own
+    library, which is kept open and re-used for later requests on that thread. 
+    The session is closed after each request. A thread's library is closed and 
+    re-created when the library database file is replaced, or after a request
+    raises an exception. 
+    
+    With pool=False, a new library is created for every request. 
+    '''
+    
+    name = 'library'
+    
+    def __init__(self, library_creator, keyword='library', pool=True):
+        import threading
 
         self.library_creator = library_creator
         self.keyword = keyword
+        self.pool = pool
+        
+        self._local = threading.local()
+        self._lock = threading.Lock() # For creating libraries, and the list of them
+        self._libraries = []
 
     def setup(self, app):
         pass
+    
+    def close(self):
+        '''Close all of the libraries in the pool'''
+        with self._lock:
+            libraries, self._libraries = self._libraries, []
+            
+        for l in libraries:
+            self._close_library(l)
+            
+        self._local = type(self._local)()
+    
+    @staticmethod
+    def _db_stamp(library):
+        '''Identify the library database file, so we can tell if it was replaced. 
+        Returns None for server databases. '''
+        
+        db = library.database
+        
+        if db.driver != 'sqlite':
+            return None
+        
+        try:
+            st = os.stat(db.dbname)
+            return (st.st_dev, st.st_ino)
+        except OSError:
+            return None
+    
+    def _close_library(self, library):
+        try:
+            library.database.close()
+        except Exception as e:
+            logger.error("Failed to close library: {}".format(e))
+    
+    def _new_library(self):
+        
+        # The library creator usually resets a global library cache, so it 
+        # is not safe to call from more than one thread at a time. 
+        with self._lock:
+            l = self.library_creator()
+            self._libraries.append(l)
+            
+        return l, self._db_stamp(l)
+    
+    def _discard(self, library):
+        
+        with self._lock:
+            if library in self._libraries:
+                self._libraries.remove(library)
+                
+        self._close_library(library)
+        self._local.library = None
+    
+    def get_library(self):
+        '''Return the library for this thread'''
+        
+        l = getattr(self._local, 'library', None)
+        
+        if l is not None and self._db_stamp(l) != self._local.stamp:
+            logger.info("Library database changed, re-opening")
+            self._discard(l)
+            l = None
+            
+        if l is None:
+            l, self._local.stamp = self._new_library()
+            self._local.library = l
+            
+        return l
+    
+    def release_library(self, library, failed=False):
+        '''Reset the library's state at the end of a request'''
+        
+        if failed:
+            self._discard(library)
+            return
+        
+        try:
+            library.database.close_session()
+            library.clear_dependencies()
+        except Exception as e:
+            logger.error("Failed to reset library: {}".format(e))
+            self._discard(library)
 
     def apply(self, callback, context):
         import inspect
@@ -52,13 +152,24 @@ class LibraryPlugin(object):
 
         def wrapper(*args, **kwargs):
 
-            #
-            # NOTE! Creating the library every call. This is bacuase the Sqlite driver
-            # isn't multi-threaded. 
-            #
-            kwargs[keyword] = self.library_creator()
+            if not self.pool:
+                kwargs[keyword] = self.library_creator()
+                return callback(*args, **kwargs)
 
-            rv = callback(*args, **kwargs)
+            library = self.get_library()
+            kwargs[keyword] = library
+
+            try:
+                rv = callback(*args, **kwargs)
+            except HTTPResponse:
+                # Bottle raises redirects and aborts as exceptions. 
+                self.release_library(library)
+                raise
+            except:
+                self.release_library(library, failed = True)
+                raise
+            
+            self.release_library(library)
 
             return rv
 
@@ -125,6 +236,9 @@ class AllJSONPlugin(object):
 
             if isinstance(rv, basestring ):
                 return rv
+            
+            if isinstance(rv, types.GeneratorType):
+                return rv # A streaming response
 
             #Attempt to serialize, raises exception on failure
             try:
@@ -615,6 +729,121 @@ def process_pid(did, pid, library):
  
     
 
+def _csv_key(p):
+    '''Return the name of the column for paging through the main table of a 
+    partition: the integer primary key, or the rowid '''
+    from ..orm import Column
+    
+    pks = [ c for c in p.table.columns if c.is_primary_key ]
+    
+    if len(pks) == 1 and pks[0].datatype == Column.DATATYPE_INTEGER:
+        return pks[0].name
+    else:
+        return 'rowid'
+    
+def _key_range(p, table, key, where=None, params={}):
+    '''Return the minimum and maximum values of the key. Both are read
+    from the key index '''
+    from sqlalchemy import text
+    
+    where = "WHERE {}".format(where) if where else ''
+    
+    lo = p.query(text("SELECT min({key}) FROM {table} {where}".format(key=key, table=table, where=where)), params).fetchone()[0]
+    hi = p.query(text("SELECT max({key}) FROM {table} {where}".format(key=key, table=table, where=where)), params).fetchone()[0]
+    
+    return lo, hi
+
+def _key_segment(lo, hi, i, n):
+    '''Return the [start, end) key range of segment i of n, dividing the 
+    range of keys from lo to hi into equal parts'''
+
+    span = hi - lo + 1
+    
+    return lo + (i-1) * span // n, lo + i * span // n
+
+def _keyset_pages(p, table, key, start=None, end=None, where=None, params={}, page_size=10000):
+    '''Yield pages of rows of a table, in key order, with the key in the 
+    range [start, end). Each page is selected by key, from the last key of 
+    the previous page, so the cost of a page does not depend on its position '''
+    from sqlalchemy import text
+    
+    conds = []
+    params = dict(params)
+
+    if where:
+        conds.append("({})".format(where))
+
+    if start is not None:
+        conds.append("{} >= :_csv_start".format(key))
+        params['_csv_start'] = start
+        
+    if end is not None:
+        conds.append("{} < :_csv_end".format(key))
+        params['_csv_end'] = end
+    
+    last = None
+        
+    while True:
+        
+        if last is not None:
+            params['_csv_last'] = last
+            page_conds = conds + ["{} > :_csv_last".format(key)]
+        else:
+            page_conds = conds
+        
+        q = "SELECT {key}, * FROM {table} {where} ORDER BY {key} LIMIT {limit}".format(
+               key=key, table=table, limit=int(page_size),
+               where = "WHERE "+" AND ".join(page_conds) if page_conds else '')
+        
+        rows = p.query(text(q), params).fetchall()
+        
+        if not rows:
+            return
+        
+        yield [ tuple(row)[1:] for row in rows ]
+        
+        if len(rows) < page_size:
+            return
+        
+        last = rows[-1][0]
+
+def _csv_chunks(pages, header=None, sep='|', compress=False):
+    '''Yield CSV text for pages of rows, one chunk per page, optionally
+    gzip compressed'''
+    import unicodecsv as csv
+    import zlib
+    from StringIO import StringIO
+    
+    out = StringIO()
+    writer = csv.writer(out, delimiter=sep)
+    
+    # wbits of 16+MAX_WBITS produces a gzip header and trailer
+    z = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+
+    if header:
+        writer.writerow(header)
+    
+    for page in pages:
+        writer.writerows(page)
+        
+        chunk = out.getvalue()
+        out.seek(0)
+        out.truncate()
+        
+        if z:
+            chunk = z.compress(chunk)
+            
+        if chunk:
+            yield chunk
+            
+    chunk = out.getvalue()
+    
+    if z:
+        chunk = z.compress(chunk) + z.flush()
+        
+    if chunk:
+        yield chunk
+
 @get('/datasets/<did>/partitions/<pid>/csv') 
 @CaptureException   
 def get_partition_csv(did, pid, library):
@@ -623,12 +852,13 @@ def get_partition_csv(did, pid, library):
     Query
         n: The total number of segments to break the CSV into
         i: Which segment to retrieve
+        start, end: Alternately, the range of primary key values to retrieve, 
+            including start but not end
         header:If existent and not 'F', include the header on the first line. 
     
+    The response is gzip compressed if the client accepts it. 
+    
     '''
-    import unicodecsv as csv
-    from StringIO import StringIO
-    from sqlalchemy import text
      
     did, d_on, b = process_did(did, library)
     pid, p_on, p_orm  = process_pid(did, pid, library)
@@ -648,44 +878,44 @@ def get_partition_csv(did, pid, library):
         raise exc.BadRequest("Segment number starts at 1")
     
     table = p.table.name
+    key = _csv_key(p)
     
-    count = p.query("SELECT count(*) FROM {}".format(table)).fetchone()
+    params = dict(request.query.items()) if where else {}
     
-    if count:
-        count = count[0]
-    else:
-        raise exc.BadRequest("Failed to get count of number of rows")
-
-    base_seg_size, rem = divmod(count, int(n))
-
-    if i == n:
-        seg_size = base_seg_size + rem
+    if request.query.get('start', None) is not None or request.query.get('end', None) is not None:
+        start = request.query.get('start', None)
+        end = request.query.get('end', None)
+        start = int(start) if start else None
+        end = int(end) if end else None
+        
+    elif n > 1:
+        lo, hi = _key_range(p, table, key, where, params)
+        
+        if lo is None:
+            start, end = None, None
+        else:
+            start, end = _key_segment(lo, hi, i, n)
     else:
-        seg_size = base_seg_size
+        start, end = None, None
 
-    out = StringIO()
-    writer = csv.writer(out, delimiter=sep)
+    header = tuple([c.name for c in p.table.columns]) if request.query.header else None
     
-    if request.query.header:
-        writer.writerow(tuple([c.name for c in p.table.columns]))
-
-    if where:
-        q = "SELECT * FROM {} WHERE {} LIMIT {} OFFSET {} ".format(table, where, seg_size, base_seg_size*(i-1))
-     
-        params = dict(request.query.items())
-    else:
-        q = "SELECT * FROM {} LIMIT {} OFFSET {} ".format(table, seg_size, base_seg_size*(i-1))
-        params = {}
+    compress = 'gzip' in request.headers.get('Accept-Encoding', '')
 
-    for row in p.query(text(q), params):
-        writer.writerow(tuple(row))
+    # The query parameters are read now; the generator runs after this 
+    # function returns. 
+    chunks = _csv_chunks(_keyset_pages(p, table, key, start, end, where, params), 
+                         header = header, sep = sep, compress = compress)
 
     response.content_type = 'text/csv'
     
-    response.headers["content-disposition"] = "attachment; filename='{}-{}-{}-{}.csv'".format(p.identity.vname,table,i,n)
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
     
-    return out.getvalue()
+    response.headers["content-disposition"] = "attachment; filename='{}-{}-{}-{}.csv'".format(p.identity.vname,table,i,n)
     
+    return chunks
     
         
 @get('/datasets/<did>/partitions/<pid>/csv/parts') 
@@ -716,31 +946,29 @@ def get_partition_csv_parts(did, pid, library):
         pass
     else:
         # This partition does not have CSV parts, so we'll have to make them. 
+        # The parts are ranges of the primary key, which are found from the 
+        # key index, without counting or scanning the rows. 
         
         TARGET_ROW_COUNT = 50000
      
-        # For large partitions, this could be really slow, and
-        # can cause the server to run out of disk space. 
         p = library.get(pid).partition
      
         table = p.table.name
+        key = _csv_key(p)
         
-        count = p.query("SELECT count(*) FROM {}".format(table)).fetchone()
-        
-        if count:
-            count = count[0]
-        else:
-            raise exc.BadRequest("Failed to get count of number of rows")
-    
-        part_count, rem = divmod(count, TARGET_ROW_COUNT)
+        lo, hi = _key_range(p, table, key)
         
         template = "{}/datasets/{}/partitions/{}/csv".format(_host_port(library), b.identity.vid_enc, p.identity.vid_enc)
         
-        if part_count == 0:
+        # For dense keys, the size of the key range is the number of rows
+        part_count = (hi - lo + 1) // TARGET_ROW_COUNT if lo is not None else 0
+        
+        if part_count <= 1:
             parts.append(template)
         else:
             for i in range(1, part_count+1):
-                parts.append(template +"?i={}&n={}".format(i,part_count))
+                start, end = _key_segment(lo, hi, i, part_count)
+                parts.append(template +"?i={}&n={}&start={}&end={}".format(i, part_count, start, end))
         
     return parts
     
@@ -72,11 +72,11 @@ class Us2000CensusDimBundle(UsCensusDimBundle):
     def build_generate_rows(self, state):
         '''A generator that yields rows from the state geo files. It will 
         unpack the fixed width file and return a dict'''
-        import struct
         import zipfile
+        from databundles.fixed import FixedReader
 
         table = self.schema.table('geofile')
-        header, unpack_str, length = table.get_fixed_unpack() #@UnusedVariable    
+        unpack, header, unpack_str, length = table.get_fixed_unpack() #@UnusedVariable    
 
         rows = 0;
 
@@ -93,24 +93,16 @@ class Us2000CensusDimBundle(UsCensusDimBundle):
 
         grf = self.filesystem.unzip(geo_zip_file)
 
-        geofile = open(grf, 'rbU', buffering=1*1024*1024)
+        # Read in blocks. Raises ValueError for a record of the wrong length
+        geofile = FixedReader(grf, unpack_str, names=header)
 
-        for line in geofile.readlines():
+        for geo in geofile:
             
             rows  += 1
             
             if rows > 20000 and self.run_args.test:
                 break
 
-            try:
-                geo = struct.unpack(unpack_str, line[:-1])
-            except struct.error as e:
-                self.error("Struct error for state={}, file={}, line_len={}, row={}, \nline={}"
-                           .format(state,grf,len(line),rows, line))
-             
-            if not geo:
-                raise ValueError("Failed to match regex on line: "+line) 
-
             yield dict(zip(header,geo))
 
         geofile.close()
@@ -283,10 +275,10 @@ class Us2000CensusFactBundle(UsCensusFactBundle):
     def build_generate_rows(self, state, geodim=False):
         '''A Generator that yelds a tuple that has the logrecno row
         for all of the segment files and the geo file. '''
-        import struct
+        from databundles.fixed import FixedReader
 
         table = self.schema.table('geofile')
-        header, unpack_str, length = table.get_fixed_unpack() #@UnusedVariable
+        unpack, header, unpack_str, length = table.get_fixed_unpack() #@UnusedVariable
          
         geo_source = self.urls['geos'][state]
       
@@ -306,26 +298,17 @@ class Us2000CensusFactBundle(UsCensusFactBundle):
 
         geo_zip_file = self.filesystem.download(geo_source, test_zip_file)
         grf = self.filesystem.unzip(geo_zip_file)
-        geofile = open(grf, 'rbU', buffering=1*1024*1024)
+        # Read in blocks. Raises ValueError for a record of the wrong length
+        geofile = FixedReader(grf, unpack_str, names=header)
 
         first = True
-        for line in geofile.readlines():
+        for geo in geofile:
             
             rows  += 1
             
             if rows > 20000 and self.run_args.test:
                 break
 
-            try:
-                geo = struct.unpack(unpack_str, line[:-1])
-            except struct.error as e:
-                self.error("Struct error for state={}, file={}, line_len={}, row={}, \nline={}"
-                           .format(state,grf,len(line),rows, line))
-                raise e
-             
-            if not geo:
-                raise ValueError("Failed to match regex on line: "+line) 
-
             segments = {}
     
             lrn = geo[6]
@@ -193,7 +193,7 @@ class Bundle(BuildBundle):
         import re
         
         table = self.schema.table('sf1geo2010')
-        header, unpack_str, length = table.get_fixed_unpack() #@UnusedVariable
+        unpack, header, unpack_str, length = table.get_fixed_unpack() #@UnusedVariable
          
         source_url = self.urls['geos'][state]
         
@@ -141,6 +141,9 @@ class UsCensusBundle(BuildBundle):
 
 class UsCensusDimBundle(UsCensusBundle):
     
+    # The number of geo rows that run_geo_dim() hashes at once
+    GEO_HASH_BATCH = 10000
+    
     #####################################
     # Peparation
     #####################################
@@ -195,6 +198,11 @@ class UsCensusDimBundle(UsCensusBundle):
                 table.add_column('hash',  datatype=Column.DATATYPE_INTEGER,
                                   uindexes = 'uihash')
 
+            # The row hash engine, from build.row_hash. The default, md5,
+            # matches the hashes in existing translation files.
+            if self.config.build.get('row_hash', False):
+                table.data = dict(table.data or {}, row_hash=self.config.build.get('row_hash'))
+
 
     def generate_partitions(self):
         from databundles.partition import PartitionIdentity
@@ -345,6 +353,7 @@ class UsCensusDimBundle(UsCensusBundle):
         holds the hash values of the split table entries. '''
         
         import time, copy
+        from collections import OrderedDict
      
         # Create the record_code partition, since it doesn't get created with the other
         # geo tables. 
@@ -358,6 +367,11 @@ class UsCensusDimBundle(UsCensusBundle):
         row_hash_map = {} #@RservedAssignment
         for table_id, cp in geo_processors.items(): #@UnusedVariable
             row_hash_map[table_id] = set()
+
+        # With the sort dedup, the rows for each geo dim table go to sorted
+        # run files, which load_geo_dim() merges across all of the states, 
+        # rather than through the sets and the tempfiles. 
+        runs = self.geo_run_writers(state, geo_processors) if self.geo_dedup == 'sort' else None
      
         row_i = 0
         
@@ -397,6 +411,55 @@ class UsCensusDimBundle(UsCensusBundle):
                 pass
 
 
+        # The validators and row hashers, looked up once rather than for each row
+        validators = { table_id: cp[0].validator(and_join=False) for table_id, cp in geo_processors.items() }
+        hashers = { table_id: cp[0].hasher for table_id, cp in geo_processors.items() }
+
+        def write_batch(codes, batch):
+            '''Hash the rows of each geo dim table for a batch of geo rows at once,
+            with hash_rows(), which is vectorized for the fnv64 engine, then write
+            the geo dim rows and the record codes. '''
+            
+            hashes = []
+            
+            for table_id, rows in batch.items():
+                partition = geo_partitions[table_id]
+                th = row_hash_map[table_id]
+                
+                table_hashes = hashers[table_id].hash_rows(rows).tolist()
+
+                for values, row_hash in zip(rows, table_hashes):
+
+                    # The local row_hash check reduces the number of calls to writerow, but
+                    # since we are operating on states independently, it does not
+                    # guarantee uniqueness across states. 
+                    if runs is not None:
+                        values[-1] = row_hash
+                        runs[table_id].add(row_hash, values)
+                    
+                    elif row_hash not in th:  
+                        th.add(row_hash)
+                        
+                        values[-1] = row_hash
+                        
+                        tf = partition.tempfile( suffix=state)
+    
+                        tf.writer.writerow(values)
+
+                hashes.append(table_hashes)
+
+            # The first None is for the primary id, the last is for the 
+            # row_hash, which was added automatically to geo_dim tables.           
+            # The fileid comes from the bundle.yaml configuration b/c it is the same for all records
+            # in the bundle. 
+            tf = record_code_partition.tempfile(suffix=state)
+            
+            for code, hash_keys in zip(codes, zip(*hashes)):
+                tf.writer.writerow(code + list(hash_keys))
+
+        codes = []
+        batch = OrderedDict( (table_id, []) for table_id in geo_processors )
+
         # Iterate over all of the geo rows for this state. 
         for geo in self.build_generate_rows(state): #@UnusedVariable
          
@@ -412,64 +475,127 @@ class UsCensusDimBundle(UsCensusBundle):
             geo['abbrev'] = state
 
             # Iterate over all of the geo dimension tables, taking part of this
-            # geo row and putting it into the temp file for that geo dim table. 
-      
-            hash_keys = []
+            # geo row for the batch of rows for that geo dim table. 
             for table_id, cp in geo_processors.items():
 
                 table,  columns, processors = cp #@UnusedVariable
-            
-                partition = geo_partitions[table_id]
 
                 # Extract a subset form the geo row for this geo dim table. 
                 values = [ f(geo) for f in processors ]
-                         
+
                 # If the row does not have all of the required fields, 
                 # map it to the empyt row
-                if not table.validate_or(values):
+                if not validators[table_id](values):
                     # Substitute the empty row
                     values = copy.copy( table.null_row)
 
+                batch[table_id].append(values)
 
+            codes.append([None, int(geo['logrecno']),int(geo['sumlev']),int(geo['geocomp'])])
 
-                row_hash = table.row_hash(values)
-                th = row_hash_map[table.id_]
-             
-                # The local row_hash check reduces the number of calls to writerow, but
-                # since we are operating on states independently, it does not
-                # guarantee uniqueness across states. 
-                if row_hash not in th:  
-                    th.add(row_hash)
-                    
-                    values[-1] = row_hash
-                    
-                    tf = partition.tempfile( suffix=state)
-
-                    tf.writer.writerow(values)
+            if len(codes) == self.GEO_HASH_BATCH:
+                write_batch(codes, batch)
+                codes = []
+                batch = OrderedDict( (table_id, []) for table_id in geo_processors )
 
-                hash_keys.append(row_hash)
-
-            # The first None is for the primary id, the last is for the 
-            # row_hash, which was added automatically to geo_dim tables.           
-            # The fileid comes from the bundle.yaml configuration b/c it is the same for all records
-            # in the bundle. 
-         
-            values = [None, int(geo['logrecno']),int(geo['sumlev']),int(geo['geocomp'])]  + hash_keys
-            tf = record_code_partition.tempfile(suffix=state)
-            tf.writer.writerow(values)
+        if codes:
+            write_batch(codes, batch)
 
         # Close all of the tempfiles. 
         for table_id, cp in geo_processors.items():
             partition = geo_partitions[table_id]
-            partition.database.tempfile(partition.table, suffix=state).close()
+            if runs is not None:
+                runs[table_id].close()
+            else:
+                partition.database.tempfile(partition.table, suffix=state).close()
  
         record_code_partition.database.tempfile(record_code_partition.table, suffix=state).close()  
             
         with open(marker_f, 'w') as f:
             f.write(str(time.time()))
 
+    @property
+    def geo_dedup(self):
+        '''How run_geo_dim() and load_geo_dim() de-duplicate the geo dim rows, 
+        from build.geo_dedup: 'set', for sets in memory, tempfiles, and DBM 
+        files that translate hashes to primary keys, or 'sort', for sorted 
+        run files, merged with bounded memory, and hash index files. '''
+        return self.config.build.get('geo_dedup', 'set')
+
+    def geo_run_dir(self, table):
+        '''The directory for the run files of a geo dim table'''
+        return os.path.join(self.filesystem.build_path('geodim'), table.name)
+
+    def geo_run_writers(self, state, geo_processors):
+        '''Return a RunWriter for each geo dim table, keyed by table id, for the 
+        rows from a state, after deleting the runs from an earlier build of 
+        the state'''
+        from databundles.dedup import RunWriter, find_runs
+        
+        run_size = int(self.config.build.get('geo_run_size', 500000))
+        
+        writers = {}
+        for table_id, (table, columns, processors) in geo_processors.items(): #@UnusedVariable
+            dir_ = self.geo_run_dir(table)
+            
+            for path in find_runs(dir_, state+'-'):
+                os.remove(path)
+                
+            writers[table_id] = RunWriter(dir_, prefix=state, run_size=run_size)
+            
+        return writers
+
+    def load_geo_dim_runs(self, partition):
+        '''Merge the sorted run files that run_geo_dim() wrote for all of the 
+        states into the geo dim partition, numbering the unique rows in hash order,
+        and write the partition's hash index, which translates the hashes to
+        the primary keys. Only the head record of each run is in memory. '''
+        import time
+        from databundles.dedup import find_runs, merge_runs
+        
+        t_start = time.time()
+        table_name = partition.table.name
+        
+        marker_f = self.filesystem.build_path('markers',"join_geo_dim_"+table_name)
+
+        if os.path.exists(marker_f):
+            self.log("Geo database marker exists for {}, skipping".format(table_name))
+            return partition.identity.name
+        else:
+            self.log("Merge geo dim runs for {}".format(table_name))
+        
+        dir_ = self.geo_run_dir(partition.table)
+        paths = [ path for state in self.states for path in find_runs(dir_, state+'-') ]
+        
+        row_i = 0
+        
+        index = partition.hash_index()
+        
+        with partition.database.inserter(partition.table) as ins:
+            with index.writer as idx:
+                for hash_, row in merge_runs(paths):
+                    row_i += 1
+                    
+                    row = list(row)
+                    row[0] = row_i
+                    
+                    ins.insert(row)
+                    idx.add(hash_, row_i)
+                    
+                    if row_i % 100000 == 0:
+                        self.log("Merge "+table_name+" "+
+                                 str(int( row_i/(time.time()-t_start)))+'/s '+str(row_i/1000)+"K ")
+
+        with open(marker_f, 'w') as f:
+            f.write(str(time.time()))
+
+        self.log("Merged geo dim table: {} from {} runs, len = {}".format(table_name, len(paths), row_i))
+        
+        return partition.identity.name
+
     def rebuild_hash_translations(self):
-        '''Rebuild the DBM files that link the hash values to primary keys
+        '''Rebuild the DBM files, or, for the sort dedup, the hash index files, 
+        that link the hash values to primary keys
         '''
         import time
         import struct
@@ -477,6 +603,15 @@ class UsCensusDimBundle(UsCensusBundle):
         row_i = 0;
         for partition in  self.geo_partition_map().values(): 
             
+            if self.geo_dedup == 'sort':
+                with partition.hash_index().writer as idx:
+                    sql = "SELECT * FROM {} WHERE hash IS NOT NULL ORDER BY hash".format(partition.table.name)
+                    for row in partition.database.session.execute(sql):
+                        idx.add(row['hash'], row[0])
+                        
+                self.log("Rehash "+partition.table.name+" "+str(idx.count))
+                continue
+            
             # Get a handle on the dmb database that translated hash values to 
             # primary keeys
             partition.database.dbm(partition.table).delete()
@@ -496,13 +631,23 @@ class UsCensusDimBundle(UsCensusBundle):
                     
             dbm.close()
 
-    def reindex_record_code(self):
+    def reindex_record_code(self, bulk=None, batch_size=50000):
         '''Translate the hash values in the foreign keys point to the geo dim tables
         with the primary keys for the corresponding records.
         
         After translating the rows, inserts the row into the main database. 
+        
+        With bulk, which defaults to true when build.reindex is 'bulk', the 
+        translations are loaded into sorted arrays, and the rows are translated
+        batch_size rows at a time, with one binary search per column for the 
+        whole batch, rather than a DBM lookup per value. 
         '''
         import time
+        from databundles.dedup import HashIndex, translate_rows
+        
+        if bulk is None:
+            bulk = self.config.build.get('reindex', 'row') == 'bulk'
+        
         rcp = self.get_record_code_partition();
 
         translators = []
@@ -514,15 +659,29 @@ class UsCensusDimBundle(UsCensusBundle):
                 self.error("MISSING PARTITION! for table: "+name)
                 continue
 
-            # Get a handle on the dmb database that translated hash values to 
-            # primary keeys
+            # Get a handle on the dmb database, or the hash index, that translates
+            # hash values to primary keeys
          
             try:
+                if self.geo_dedup == 'sort':
+                    translators.append(partition.hash_index())
+                    continue
+                
                 dbm = partition.database.dbm(partition.table).reader      
-                translators.append(dbm)
+                
+                if bulk:
+                    translators.append(HashIndex.from_items( (k, dbm[k]) for k in dbm.keys() ))
+                    dbm.close()
+                else:
+                    translators.append(dbm)
             except: 
                 self.error("Failed to get DBM file for partition {}".format(partition.identity.name))
 
+        # translate_rows() would leave the columns without a translator untranslated
+        if len(translators) != len(rcp.table.columns[4:]):
+            raise Exception("Reindex needs a translator for each of the {} foreign keys of {}, but only got {}"
+                            .format(len(rcp.table.columns[4:]), rcp.table.name, len(translators)))
+
         row_i = 0
      
         
@@ -534,7 +693,26 @@ class UsCensusDimBundle(UsCensusBundle):
         with self.database.inserter(rcp.table) as ins:
             try:
                 self.log("Getting record_code rows from "+rcp.database.path)
-                for row in rcp.database.session.execute("SELECT * FROM record_code"):
+                result = rcp.database.session.execute("SELECT * FROM record_code")
+                
+                while bulk:
+                    rows = result.fetchmany(batch_size)
+                    
+                    if row_i == 0:
+                        t_start = time.time()
+                        
+                    if not rows:
+                        break
+                    
+                    for new_row in translate_rows(rows, 4, translators):
+                        ins.insert(new_row)
+                        
+                    row_i += len(rows)
+                    
+                    self.log("Reindex record_code "+
+                             str(int( row_i/(time.time()-t_start)))+'/s '+str(row_i/1000)+"K ")
+                
+                for row in (result if not bulk else []):
                     
                     if row_i == 0:
                         t_start = time.time() # Here b/c query take a long time, so low reported rate at start. 
@@ -592,6 +770,9 @@ class UsCensusDimBundle(UsCensusBundle):
 
         table_name = partition.table.name
         
+        if self.geo_dedup == 'sort' and table_name != 'record_code':
+            return self.load_geo_dim_runs(partition)
+        
         marker_f = self.filesystem.build_path('markers',"join_geo_dim_"+table_name)
 
         if os.path.exists(marker_f):
@@ -972,13 +1153,19 @@ class UsCensusFactBundle(UsCensusBundle):
     def build(self,  run_state_tables_f=None,run_fact_db_f=None):
         '''Create data  partitions. 
         First, creates all of the state segments, one partition per segment per 
-        state. Then creates a partition for each of the geo files. '''
+        state. Then creates a partition for each of the geo files. 
+        
+        With build.fact_pipeline set to 'segment', the fact tables are split 
+        from each (state, segment) file in a pool of processes, and loaded from
+        the CSV files they write. '''
         from multiprocessing import Pool
 
         if self.run_args.subphase in ['test']:
             print self.states
             print self.states_dict
          
+        if self.config.build.get('fact_pipeline', 'state') == 'segment':
+            return self.build_segments()
  
         # Combine the geodim tables with the  state population tables, and
         # produce .csv files for each of the tables. 
@@ -1208,6 +1395,209 @@ class UsCensusFactBundle(UsCensusBundle):
             tf = partition.database.tempfile(table, suffix=state)
             tf.delete()
 
+    def build_segments(self):
+        '''Build the fact tables with a process for each state. Each process 
+        reads the state's record code rows once, then reads each of the state's
+        segment files once, and writes the columns of all of the segment's 
+        tables to CSV files. Then, a process for each table loads the CSV files
+        for all of the states into the partition. '''
+        from multiprocessing import Pool
+        
+        if self.run_args.subphase in ['all','fact']:
+            units = self.segment_work_units()
+            
+            if self.run_args.multi:
+                pool = Pool(processes=int(self.run_args.multi))
+                
+                args = [ (self.__class__, self.bundle_dir, self.run_args, state, seg_numbers) 
+                         for state, seg_numbers in units ]
+                
+                for results in pool.imap_unordered(run_state_segments, args):
+                    for r in results:
+                        self.log("Split {} segment {}: {} rows".format(*r))
+                    
+                pool.close()
+                pool.join()
+            else:
+                for state, seg_numbers in units:
+                    self.run_state_segments(state, seg_numbers)
+                    
+        if self.run_args.subphase in ['all','load-fact']:
+            ids = [ table.id_ for table in self.fact_tables() ]
+            
+            if self.run_args.multi:
+                pool = Pool(processes=int(self.run_args.multi))
+                
+                args = [ (self.__class__, self.bundle_dir, self.run_args, table_id) for table_id in ids ]
+                
+                for r in pool.imap_unordered(load_fact_segments, args):
+                    self.log("Loaded fact table {}".format(r))
+                    
+                pool.close()
+                pool.join()
+            else:
+                for table_id in ids:
+                    self.load_fact_segments(table_id)
+    
+        return True
+
+    def segment_work_units(self):
+        '''Return a (state, segment numbers) pair for each state, for the fact 
+        pipeline, so the record code rows for a state are only read once. The
+        larger segments, which have more tables, are first within each state,
+        and the states with the most tables are first. '''
+
+        range_map = self.range_map
+        
+        units = []
+        
+        for state in self.states:
+            seg_numbers = sorted([ seg_number for seg_number in self.urls['tables'][state].keys() 
+                                   if seg_number in range_map ], key=lambda n: -len(range_map[n]))
+            
+            if seg_numbers:
+                units.append((state, seg_numbers))
+        
+        return sorted(units, key=lambda u: -sum(len(range_map[n]) for n in u[1]))
+
+    @property
+    def range_map(self):
+        '''The range map, from make_range_map(), which gives the columns of each 
+        table in each segment'''
+        
+        if getattr(self, '_range_map', None) is None:
+            with open(self.rangemap_file, 'r') as f:
+                self._range_map = yaml.load(f) 
+        
+        return self._range_map
+
+    def state_geo_keys(self, state):
+        '''Return a dict that maps logrecnos to the leading values of the fact
+        table rows, from the record code rows for a state. The dict for the last
+        state is cached, for the segments of the state in run_state_segments(). '''
+        
+        cached = getattr(self, '_state_geo_keys', None)
+        
+        if cached and cached[0] == state:
+            return cached[1]
+        
+        keys = { int(row[0]): (row[0],) + tuple(row[3:-1]) for row in self.build_generate_geodim_rows(state) }
+        
+        self._state_geo_keys = (state, keys)
+        
+        return keys
+
+    def fact_segment_path(self, table_id, state):
+        '''The CSV file for the rows of a fact table from one state'''
+        table = self.get_table_by_table_id(table_id)
+        return self.filesystem.build_path('fact', table.name, state+'.csv')
+
+    def run_state_segments(self, state, seg_numbers):
+        '''Split the segment files of a state, with one read of the state's 
+        record code rows. Returns the results of run_state_segment(). '''
+        
+        return [ self.run_state_segment(state, seg_number) for seg_number in seg_numbers ]
+
+    def run_state_segment(self, state, seg_number):
+        '''Split a state's segment file into the CSV files of the fact tables in
+        the segment, in one pass over the file. '''
+        import csv
+        import time
+        from itertools import islice
+        
+        marker_f = self.filesystem.build_path('markers',"run_state_segment_{}_{}".format(state, seg_number))
+        
+        if os.path.exists(marker_f):
+            self.log("Segment {} complete for {}, skipping ".format(seg_number, state))
+            return state, seg_number, 0
+
+        t_start = time.time()
+        ranges = self.range_map[seg_number]
+        geo_keys = self.state_geo_keys(state)
+        source = self.urls['tables'][state][seg_number]
+
+        # The CSV rows have all of the table's columns but the primary key
+        widths = { table_id: len(self.get_table_by_table_id(table_id).columns) - 1 for table_id in ranges }
+
+        files = { table_id: open(self.fact_segment_path(table_id, state), 'wb') for table_id in ranges }
+        
+        try:
+            writers = { table_id: csv.writer(f) for table_id, f in files.items() }
+            
+            rows = ( row for _, row in self.build_generate_seg_rows(seg_number, source) )
+            
+            if self.run_args.test:
+                rows = islice(rows, 20000)
+        
+            count, missing, bad = split_segment_rows(rows, ranges, geo_keys, writers, widths)
+        finally:
+            for f in files.values():
+                f.close()
+            
+        if missing:
+            self.error("{} segment {}: {} rows with logrecnos that aren't in record_code"
+                       .format(state, seg_number, missing))
+            
+        for table_id, n in bad.items():
+            self.error("Fact Table write error. {} rows for table {} in {} segment {} are not the same length as the header ({})"
+                       .format(n, table_id, state, seg_number, widths[table_id]))
+
+        self.log("Fact {} segment {}: {} rows, {} tables, {}/s"
+                 .format(state, seg_number, count, len(ranges), int(count/(time.time()-t_start+.001))))
+
+        with open(marker_f, 'w') as f:
+            f.write(str(time.time()))
+
+        return state, seg_number, count
+
+    def load_fact_segments(self, table_id):
+        '''Load the CSV files that run_state_segment() wrote for a fact table,
+        for all of the states, into the table's partition, and put the partition
+        in the library. '''
+        import csv
+   
+        table = self.schema.table(table_id)
+        
+        partition = self.fact_partition(table, False)
+        
+        if self.library.get(partition) and not self.run_args.test:
+            self.log("Found in fact table bundle library, skipping.: "+table.name)
+            return table.name
+        
+        partition = self.fact_partition(table, True)
+        
+        db = partition.database
+        db.clean_table(table) # In case we are restarting this run
+        
+        with db.inserter(table, bulk=True, update_size=False) as ins:
+            for state in self.states:
+                path = self.fact_segment_path(table_id, state)
+                
+                if not os.path.exists(path):
+                    if self.run_args.test:
+                        self.log("Missing fact CSV file, ignoring b/c in test: {}".format(path))
+                        continue
+                    else:
+                        raise Exception("Fact table CSV file does not exist table={} state={} path={}"
+                                        .format(table.name, state, path) )
+                
+                # The CSV files have all of the columns but the primary key
+                with open(path, 'rb') as f:
+                    for row in csv.reader(f):
+                        ins.insert([None] + row)
+                        
+        dest = self.library.put(partition)
+        self.log("Install Fact table in library: "+str(dest))
+
+        partition.database.delete()
+        
+        for state in self.states:
+            path = self.fact_segment_path(table_id, state)
+            if os.path.exists(path):
+                os.remove(path)
+                
+        return table.name
+
     #############
     # Fact Table and Partition Acessors. 
     
@@ -1257,6 +1647,82 @@ class UsCensusFactBundle(UsCensusBundle):
  
         return partitions 
  
+
+def split_segment_rows(rows, ranges, geo_keys, writers, widths=None):
+    '''Write the columns of each of the tables in a segment file to the table's
+    writer, in one pass over the rows of the segment. 
+    
+    :param rows: The rows of the segment file, as lists
+    :param ranges: The range map entry for the segment: the start and end 
+    positions of each table's columns, keyed by table id
+    :param geo_keys: A dict that maps the logrecno of a row to the values that
+    start each fact table row
+    :param writers: csv writers, keyed by table id
+    :param widths: The number of values in a row of each table, keyed by table
+    id. Rows with a different number of values are counted, and still written. 
+    
+    :rtype: the number of rows, the number of rows with a logrecno that 
+    isn't in geo_keys, which are skipped, and a dict of the number of rows 
+    of the wrong width, for each table that has any.
+    '''
+    
+    widths = widths or {}
+    
+    slices = [ (table_id, writers[table_id].writerow, r['start'], r['end'], widths.get(table_id)) 
+               for table_id, r in ranges.items() ]
+    
+    count = 0
+    missing = 0
+    bad = {}
+    
+    for row in rows:
+        
+        # Blank rows fill the gaps in the PCT tables
+        if not row:
+            continue
+        
+        keys = geo_keys.get(int(row[4]))
+        
+        if keys is None:
+            missing += 1
+            continue
+        
+        count += 1
+        
+        for table_id, writerow, start, end, width in slices:
+            seg = row[start:end]
+            
+            if seg:
+                values = keys + tuple(seg)
+                
+                if width is not None and len(values) != width:
+                    bad[table_id] = bad.get(table_id, 0) + 1
+                
+                writerow(values)
+                
+    return count, missing, bad
+
+def _worker_bundle(cls, bundle_dir, run_args):
+    '''Construct a bundle in a worker process'''
+    
+    b = cls(bundle_dir)
+    b.run_args = run_args
+    
+    return b
+
+def run_state_segments(args):
+    '''Pool worker for UsCensusFactBundle.build_segments()'''
+    
+    cls, bundle_dir, run_args, state, seg_numbers = args
+    
+    return _worker_bundle(cls, bundle_dir, run_args).run_state_segments(state, seg_numbers)
+
+def load_fact_segments(args):
+    '''Pool worker for UsCensusFactBundle.build_segments()'''
+    
+    cls, bundle_dir, run_args, table_id = args
+    
+    return _worker_bundle(cls, bundle_dir, run_args).load_fact_segments(table_id)
        
 def make_geoid(state, county, tract, block=None, blockgroup=None):
     '''Create a geoid for common blocks. This is not appropriate for
@@ -5,6 +5,8 @@ Copyright (c) 2013 Clarinova. This file is licensed under the terms of the
 Revised BSD License, included in this distribution as LICENSE.txt
 """
 
+import datetime
+
 def coerce_int(v):   
     '''Convert to an int, or return if isn't an int'''
     try:
@@ -294,6 +296,77 @@ def parse_datetime(v):
         raise TypeError("Expected datetime.datetime or basestring, got {{}}".format(type(v)))        
         
 
+def row_transform_failed_column(row, casters):
+    '''Return the name of the first column in a positional row that 
+    fails to cast, for error messages'''
+    for (name, caster), v in zip(casters, row):
+        try:
+            caster(v)
+        except Exception:
+            return name
+
+    return None
+
+#
+# Fast path casters for positional rows. These return the value without
+# conversion when it already has the right type, and fall back to the
+# parse_* functions otherwise. 
+#
+
+def cast_int(v):
+    
+    if type(v) is int:
+        return v
+    elif isinstance(v, basestring):
+        try:
+            return int(v)
+        except ValueError:
+            pass
+        
+    return parse_int(v)
+    
+def cast_long(v):
+    
+    if type(v) is long or type(v) is int:
+        return v
+    
+    return parse_type(long, v)
+    
+def cast_float(v):
+    
+    if type(v) is float:
+        return v
+    
+    return parse_type(float, v)
+
+def cast_text(v):
+    
+    if type(v) is unicode:
+        return None if is_nothing(v) else v
+    
+    return parse_type(unicode, v)
+
+def cast_date(v):
+
+    if type(v) is datetime.date:
+        return v
+    
+    return parse_date(v)
+
+def cast_time(v):
+
+    if type(v) is datetime.time:
+        return v
+    
+    return parse_time(v)
+
+def cast_datetime(v):
+
+    if type(v) is datetime.datetime:
+        return v
+    
+    return parse_datetime(v)
+
 class CasterTransformBuilder(object):
     
     def __init__(self):
@@ -306,46 +379,58 @@ class CasterTransformBuilder(object):
     def makeListTransform(self):
         import uuid
         import datetime
-        f_name = "row_transform_"+str(uuid.uuid4()).replace('-','')
         
-        raise NotImplementedError("Needs to be fixed")
+        f_name = "row_transform_"+str(uuid.uuid4()).replace('-','')
         
-        o = """
-def {}(row):
-
-    raise NotImplementedError()
-
-    stripped_num = lambda x: x.strip() if isinstance(x, basestring) else x
-    is_not_nothing = lambda x: True if x!='' and x != None else False
+        o = """def {}(row):
     
+    from databundles.transform import cast_int, cast_long, cast_float, cast_text
+    from databundles.transform import cast_date, cast_time, cast_datetime, parse_type
+    from databundles.transform import row_transform_failed_column
+
     try:
-        return [
+        return (
 """.format(f_name)
     
         for i,(name,type_) in enumerate(self.types):
             if i != 0:
                 o += ',\n'
                 
-            if type_ == float or type_ == int:
-                o += "{type}(row[{i}]) if is_not_nothing(stripped_num(row[{i}])) else None".format(type=type_.__name__,i=i)
-            else:
-                o += "{type}(row[{i}].strip()) if is_not_nothing(row[{i}]) else None".format(type=type_.__name__,i=i)
-            
-            
-        names = ','.join([ "('{}',{})".format(name, type_.__name__) for name,type_ in self.types])
+            o += "            {}(row[{}])".format(self._list_caster_name(type_), i)
+
+        casters = ','.join([ "('{}',{})".format(name, self._list_caster_name(type_)) for name,type_ in self.types])
             
         o+="""
-        ]
-    except ValueError as e:
-        for i,(name,type_) in  enumerate( [{names}] ):
-            try:
-                type_(row[i].strip()) if row[i] else None
-            except ValueError:
-                raise ValueError("Failed to convert value '{{}}' in field '{{}}' to '{{}}'".format(row[i], name,type_.__name__))
-        raise
-""".format(names=names)
+        )
+    except Exception as e:
+        raise TypeError("Row transform failed for row {{}}, column {{}}\\n{{}}: {{}}"
+                        .format(row, row_transform_failed_column(row, [{casters}]), type(e), e))
+        
+""".format(casters=casters)
  
         return f_name, o
+    
+    @staticmethod
+    def _list_caster_name(type_):
+        '''Return the source for the fast path caster for a type'''
+        import datetime
+        
+        if type_ == str or type_ == unicode:
+            return "cast_text"
+        elif type_ == int:
+            return "cast_int"
+        elif type_ == long:
+            return "cast_long"
+        elif type_ == float:
+            return "cast_float"
+        elif type_ == datetime.date:
+            return "cast_date"
+        elif type_ == datetime.time:
+            return "cast_time"
+        elif type_ == datetime.datetime:
+            return "cast_datetime"
+        else:
+            return "(lambda v: parse_type({},v))".format(type_.__name__)
          
     def makeDictTransform(self):
         import uuid
@@ -397,12 +482,11 @@ def {}(row):
 
         if not self._compiled:
                     
-            #lfn, lf = self.makeListTransform()
+            lfn, lf = self.makeListTransform()
             dfn, df = self.makeDictTransform()
 
-            #exec(lf)
-            #lf = locals()[lfn]
-            lf = None
+            exec(lf)
+            lf = locals()[lfn]
             
             exec(df)
             df = locals()[dfn]
@@ -421,7 +505,10 @@ def {}(row):
             return f[1]({k.lower():v for k,v in row.items()})
         
         elif isinstance(row, (list,tuple)):
-            raise Exception("Casters are not implemented for lists and tuples, use zip() to create a dict: dict(zip(headers,row))")
+            # Short rows are padded with None, like missing keys in dicts. 
+            if len(row) < len(self.types):
+                row = tuple(row) + (None,) * (len(self.types) - len(row))
+                
             return f[0](row) 
           
         elif isinstance(row, RowProxy):
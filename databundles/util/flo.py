@@ -173,10 +173,10 @@ class MetadataFlo(object):
     def tell(self):
         return self.o.tell()
   
-    def read(self,size=0):
+    def read(self,size=-1):
         return self.o.read(size)
 
-    def readline(self,size=0):
+    def readline(self,size=-1):
         return self.o.readline(size)
     
     def readlines(self,size=0):
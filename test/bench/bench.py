@@ -0,0 +1,132 @@
+'''
+Time the hot paths of a bundle build and of library access, on a synthetic
+bundle of a configurable size, and write the results as JSON.
+
+    python test/bench/bench.py -n 200000 -o results.json
+
+Compare two result files with compare.py.
+'''
+import os
+import sys
+import shutil
+import tempfile
+import argparse
+
+def bench_inserter(result, b, n):
+    '''ValueInserter, with dict rows, tuple rows and the bulk executemany() path'''
+    from harness import synthetic_row, SYNTHETIC_COLUMNS
+
+    header = [ c[0] for c in SYNTHETIC_COLUMNS ]
+
+    p = b.partitions.find_or_new_db(table='synthetic')
+
+    with result.phase('insert-dict', rows = n):
+        with p.inserter() as ins:
+            for i in xrange(n):
+                ins.insert(synthetic_row(i))
+
+    p2 = b.partitions.find_or_new_db(table='synthetic', grain='tuples')
+
+    with result.phase('insert-tuple', rows = n):
+        with p2.inserter() as ins:
+            for i in xrange(n):
+                row = synthetic_row(i)
+                ins.insert(tuple( row[k] for k in header ))
+
+    p3 = b.partitions.find_or_new_db(table='synthetic', grain='bulk')
+
+    with result.phase('insert-bulk', rows = n):
+        with p3.inserter(bulk = True) as ins:
+            for i in xrange(n):
+                ins.insert(synthetic_row(i))
+
+    return p
+
+def bench_csvize(result, p, n, rows_per_seg):
+
+    with result.phase('csvize', rows = n):
+        p.csvize(rows_per_seg = rows_per_seg)
+
+def bench_csv_endpoint(result, p, n):
+    '''The generators behind the server's partition CSV endpoint'''
+    from databundles.server.main import _keyset_pages, _csv_chunks, _csv_key
+
+    key = _csv_key(p)
+
+    for compress in (False, True):
+        with result.phase('csv-endpoint' + ('-gzip' if compress else ''), rows = n) as d:
+            d['bytes'] = sum( len(c) for c in _csv_chunks(_keyset_pages(p, p.table.name, key), compress = compress) )
+
+def bench_cache(result, root, path):
+    '''FsCache.get() of a file that is only in the upstream cache'''
+    from databundles.cache.filesystem import FsCache
+
+    upstream = FsCache(os.path.join(root, 'upstream-cache'))
+    upstream.put(path, 'bench/partition.db')
+
+    cache = FsCache(os.path.join(root, 'local-cache'), upstream = upstream)
+
+    with result.phase('fscache-get', bytes = os.path.getsize(path)):
+        cache.get('bench/partition.db')
+
+def bench_library(result, root, b, p):
+    '''Library.put() and Library.get() for the bundle and a partition'''
+    from harness import synthetic_library
+
+    config, l = synthetic_library(root)
+
+    with result.phase('library-put', bytes = os.path.getsize(p.database.path)):
+        l.put(b)
+        l.put(p)
+
+    # A library on a new cache directory, with the first as its upstream, so
+    # get() has to copy the files.
+    config['filesystem'] = {'dir': os.path.join(root, 'cache2'),
+                            'upstream': {'dir': os.path.join(root, 'cache')}}
+
+    from databundles.library import new_library
+    l2 = new_library(config, True)
+
+    with result.phase('library-get', bytes = os.path.getsize(p.database.path)):
+        l2.get(b.identity.vid)
+        r = l2.get(p.identity.vid)
+        r.partition.query("SELECT count(*) FROM synthetic").fetchone()
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark bundle build and library hot paths')
+    parser.add_argument('-n', '--rows', type=int, default=100000, help='Number of rows in the synthetic table')
+    parser.add_argument('-s', '--segment-rows', type=int, default=None, help='Rows per CSV segment for csvize')
+    parser.add_argument('-o', '--out', default='bench-results.json', help='File to write the results to')
+    parser.add_argument('-d', '--dir', help='Directory for the bundle and caches. Defaults to a temp dir')
+    args = parser.parse_args()
+
+    from harness import BenchResult, synthetic_bundle
+
+    root = args.dir if args.dir else tempfile.mkdtemp()
+
+    result = BenchResult(rows = args.rows, segment_rows = args.segment_rows)
+
+    try:
+        with result.phase('create-bundle'):
+            b = synthetic_bundle(root)
+
+        p = bench_inserter(result, b, args.rows)
+
+        bench_csv_endpoint(result, p, args.rows)
+        bench_cache(result, root, p.database.path)
+        bench_library(result, root, b, p)
+        bench_csvize(result, p, args.rows, args.segment_rows or max(args.rows / 4, 1))
+
+    finally:
+        if not args.dir:
+            shutil.rmtree(root)
+
+    result.write(args.out)
+
+    print "Wrote results to {}".format(args.out)
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+    main()
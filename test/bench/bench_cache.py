@@ -0,0 +1,82 @@
+'''
+Benchmark the bookkeeping of FsLimitedCache, with a cache database that 
+holds many entries. 
+
+    python test/bench/bench_cache.py [-n 500000] [-s 1000]
+'''
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+from StringIO import StringIO
+
+def fill(cache, n):
+    '''Add n records for files that don't exist, directly to the database, 
+    so the cache is full. '''
+    
+    db = cache.database
+    now = time.time()
+    
+    db.executemany("INSERT INTO files (path, size, time) VALUES (?, ?, ?)",
+                   ( ('filler/{}'.format(i), 1000, now - n + i) for i in xrange(n) ))
+    db.execute("DELETE FROM file_total")
+    db.commit()
+    
+    cache._update_schema(db)
+    
+def latency(f, samples):
+    times = []
+    
+    for i in xrange(samples):
+        t = time.time()
+        f(i)
+        times.append(time.time() - t)
+        
+    times.sort()
+    
+    return (sum(times) / len(times) * 1000, times[len(times)/2] * 1000, times[int(len(times) * .99)] * 1000)
+
+def main():
+    from databundles.cache.filesystem import FsLimitedCache
+
+    parser = argparse.ArgumentParser(description='Benchmark FsLimitedCache put() and get()')
+    parser.add_argument('-n', '--entries', type=int, default=500000, help='Number of entries in the cache')
+    parser.add_argument('-s', '--samples', type=int, default=1000, help='Number of puts and gets to time')
+    parser.add_argument('-d', '--dir', help='Directory for the cache. Defaults to a temp dir')
+    args = parser.parse_args()
+
+    d = args.dir if args.dir else tempfile.mkdtemp()
+    cache_dir = os.path.join(d, 'bench-cache')
+    
+    try:
+        # The cache is 1000 bytes larger than the filler, so every put evicts. 
+        cache = FsLimitedCache(cache_dir, size = 1)
+        cache.maxsize = args.entries * 1000 + 1000
+
+        t = time.time()
+        fill(cache, args.entries)
+        print "Filled {} entries in {:.2f}s".format(args.entries, time.time() - t)
+
+        t = time.time()
+        cache.database.execute("SELECT sum(size) FROM files").fetchone()
+        print "Full scan for SELECT sum(size): {:.2f}ms".format((time.time() - t) * 1000)
+        
+        data = 'x' * 1000
+        
+        put_stats = latency(lambda i: cache.put(StringIO(data), 'put/{}'.format(i)), args.samples)
+        get_stats = latency(lambda i: cache.get('put/{}'.format(i)), args.samples)
+
+        for name, stats in (('put', put_stats), ('get', get_stats)):
+            print "{}: mean {:.3f}ms median {:.3f}ms p99 {:.3f}ms".format(name, *stats)
+        
+        assert cache.size <= cache.maxsize, "Cache over size: {} > {}".format(cache.size, cache.maxsize)
+        
+    finally:
+        if not args.dir:
+            shutil.rmtree(d)
+            
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+    main()
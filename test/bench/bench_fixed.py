@@ -0,0 +1,101 @@
+'''
+Time reading a fixed-width file, like a PUMS person file: unpacking each line
+with struct, and unpacking blocks of records with FixedReader, with the struct
+and numpy engines, and with the numpy engine parsing the integer fields, with
+and without casting the rows with the table caster.
+
+    python test/bench/bench_fixed.py [-n 2000000] [-o results.json]
+'''
+import os
+import sys
+import time
+import struct
+import argparse
+import tempfile
+
+# Widths of the fields of a person record, and whether they are integers
+FIELDS = [ (w, i % 4 != 3) for i, w in enumerate([1, 7, 2, 2, 5, 1, 2, 3, 1, 1, 2, 2, 1, 4, 6, 6, 7,
+                                                    1, 2, 2, 3, 1, 1, 5, 5, 2, 1, 8, 7, 3, 2, 1, 4, 6]) ]
+
+def write_file(path, n):
+
+    fmt = ''.join('{}s'.format(w) for w, _ in FIELDS)
+    s = struct.Struct(fmt)
+
+    with open(path, 'wb', buffering=1024*1024) as f:
+        for i in xrange(n):
+            f.write(s.pack(*[ str((i * 7919 + j) % (10 ** w)).zfill(w) for j, (w, _) in enumerate(FIELDS) ]))
+            f.write('\n')
+
+    return fmt
+
+def caster():
+    from databundles.transform import CasterTransformBuilder
+
+    bdr = CasterTransformBuilder()
+    for i, (_, is_int) in enumerate(FIELDS):
+        bdr.append('f{}'.format(i), int if is_int else str)
+
+    return bdr
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark the fixed-width reader')
+    parser.add_argument('-n', '--rows', type=int, default=2000000, help='Number of records')
+    parser.add_argument('-o', '--out', default='bench-fixed-results.json', help='File to write the results to')
+    args = parser.parse_args()
+
+    from harness import BenchResult
+    from databundles.fixed import FixedReader
+
+    path = os.path.join(tempfile.mkdtemp(), 'pums.dat')
+    fmt = write_file(path, args.rows)
+    size = os.path.getsize(path)
+
+    result = BenchResult(rows = args.rows, bytes = size, fields = len(FIELDS))
+
+    def lines():
+        unpack = struct.Struct(fmt).unpack
+        with open(path, 'rb', buffering=1024*1024) as f:
+            for line in f:
+                yield unpack(line[:-1])
+
+    def blocks(engine, types=None):
+        with FixedReader(path, fmt, engine=engine, types=types) as r:
+            for row in r:
+                yield row
+
+    types = [ int if is_int else str for _, is_int in FIELDS ]
+
+    sources = [('lines', lines), ('block-struct', lambda: blocks('struct')), ('block-numpy', lambda: blocks('numpy')),
+               ('block-numpy-ints', lambda: blocks('numpy', types))]
+
+    for name, source in sources:
+        with result.phase(name, rows = args.rows, bytes = size):
+            n = 0
+            for row in source():
+                n += 1
+            assert n == args.rows
+
+    cast = caster()
+
+    for name, source in sources[:1] + sources[3:]:
+        with result.phase(name + '-cast', rows = args.rows, bytes = size):
+            for row in source():
+                cast(row)
+
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+    result.write(args.out)
+
+    phases = { p['name']: p for p in result.phases }
+
+    print "Speedup: {:.1f}x read, {:.1f}x read and cast".format(
+        phases['lines']['seconds'] / phases['block-struct']['seconds'],
+        phases['lines-cast']['seconds'] / phases['block-numpy-ints-cast']['seconds'])
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+    main()
@@ -0,0 +1,232 @@
+'''
+Benchmark de-duplicating geo dim rows from a synthetic 50 state geo file, with
+the sets and DBM files of UsCensusDimBundle.load_geo_dim(), and with sorted
+runs, written by a process per state, merged into hash index files.
+
+Each engine runs in its own process, so the peak RSS of one doesn't hide the
+other's. The peak RSS of the sort engine is the largest of the main process
+and the workers.
+
+    python test/bench/bench_geodedup.py [-n 10000000] [-s 50] [-w 4] [-o results.json]
+'''
+import os
+import sys
+import shutil
+import tempfile
+import argparse
+import struct
+
+# state, county, tract, block group, place, name
+GEO_FORMAT = struct.Struct('2s3s6s1s5s30s1s')
+
+# The geo dim tables, as the fields of the geo record they take
+DIM_TABLES = {
+    'county': [0, 1],
+    'place': [0, 4, 5],
+    'blkgrp': [0, 1, 2, 3],
+}
+
+def write_geo_file(path, state, n):
+    '''Write a fixed width geo file for a state, with n records'''
+
+    with open(path, 'wb') as f:
+        for i in xrange(n):
+            county = i % 211
+            tract = (i / 5) % 40000
+            place = (i / 3) % 9000
+
+            f.write(GEO_FORMAT.pack(state, '{:03d}'.format(county), '{:06d}'.format(tract),
+                                    str(i % 4), '{:05d}'.format(place),
+                                    'Place {} {}'.format(state, place), '\n'))
+
+def read_geo_file(path):
+    '''Generate the records of a geo file, as lists of stripped fields'''
+
+    size = GEO_FORMAT.size
+    unpack = GEO_FORMAT.unpack
+
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(size * 10000)
+            if not block:
+                break
+
+            for i in xrange(0, len(block), size):
+                yield [ v.strip() for v in unpack(block[i:i+size]) ]
+
+def hashers():
+    from databundles.rowhash import new_hasher
+
+    return { name: (new_hasher('md5', range(1, len(fields) + 1)), fields)
+             for name, fields in DIM_TABLES.items() }
+
+def dim_rows(geo, fields):
+    return [None] + [ geo[i] for i in fields ] + [None]
+
+def set_engine(root, paths, q):
+    '''De-duplicate with a set per state, as in run_geo_dim(), then a set and a
+    DBM file per table, as in load_geo_dim()'''
+    from harness import BenchResult
+    import semidbm
+
+    result = BenchResult()
+    tables = hashers()
+    n = 0
+    unique = {}
+
+    with result.phase('set-hash') as p:
+        state_rows = { name: [] for name in tables }
+
+        for path in paths:
+            seen = { name: set() for name in tables }
+            for geo in read_geo_file(path):
+                n += 1
+                for name, (h, fields) in tables.items():
+                    row = dim_rows(geo, fields)
+                    row_hash = row[-1] = h(row)
+                    if row_hash not in seen[name]:
+                        seen[name].add(row_hash)
+                        state_rows[name].append(row)
+
+        p['rows'] = n
+
+    with result.phase('set-load', rows = n):
+        for name in tables:
+            hash_set = set()
+            pk = 0
+            dbm = semidbm.open(os.path.join(root, name + '.dbm'), 'n')
+            for row in state_rows[name]:
+                if row[-1] not in hash_set:
+                    pk += 1
+                    hash_set.add(row[-1])
+                    dbm[str(row[-1])] = str(pk)
+            dbm.close()
+            unique[name] = pk
+
+    q.put((result.phases, unique))
+
+def _write_runs(args):
+    '''Pool worker: write the runs for one state'''
+    from databundles.dedup import RunWriter
+    from harness import peak_rss
+
+    root, path, run_size = args
+    state = os.path.basename(path).split('.')[0]
+    tables = hashers()
+
+    writers = { name: RunWriter(os.path.join(root, 'runs', name), prefix=state, run_size=run_size)
+                for name in tables }
+
+    for geo in read_geo_file(path):
+        for name, (h, fields) in tables.items():
+            row = dim_rows(geo, fields)
+            row[-1] = h(row)
+            writers[name].add(row[-1], row)
+
+    for w in writers.values():
+        w.close()
+
+    return peak_rss()
+
+def _merge_runs(args):
+    '''Pool worker: merge the runs for one table into a hash index'''
+    from databundles.dedup import merge_runs, find_runs, HashIndex
+    from harness import peak_rss
+
+    root, name = args
+
+    pk = 0
+    with HashIndex(os.path.join(root, name + '.hidx')).writer as idx:
+        for hash_, row in merge_runs(find_runs(os.path.join(root, 'runs', name))):
+            pk += 1
+            idx.add(hash_, pk)
+
+    return name, pk, peak_rss()
+
+def sort_engine(root, paths, n_workers, run_size, q):
+    '''De-duplicate with sorted runs and a k-way merge'''
+    from multiprocessing import Pool
+    from harness import BenchResult, peak_rss
+
+    result = BenchResult()
+    pool = Pool(n_workers)
+
+    with result.phase('sort-hash'):
+        rss = pool.map(_write_runs, [ (root, path, run_size) for path in paths ])
+
+    with result.phase('sort-load'):
+        merged = pool.map(_merge_runs, [ (root, name) for name in DIM_TABLES ])
+
+    pool.close()
+    pool.join()
+
+    result.phases[-1]['worker_peak_rss_mb'] = max(rss + [ r for _, _, r in merged ])
+
+    q.put((result.phases, { name: pk for name, pk, _ in merged }))
+
+def run(target, *args):
+    '''Run an engine in its own process, and return its phases'''
+    from multiprocessing import Process, Queue
+
+    q = Queue()
+    p = Process(target = target, args = args + (q,))
+    p.start()
+    r = q.get()
+    p.join()
+
+    return r
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark geo dim de-duplication')
+    parser.add_argument('-n', '--rows', type=int, default=10000000, help='Number of geo records')
+    parser.add_argument('-s', '--states', type=int, default=50, help='Number of states')
+    parser.add_argument('-w', '--workers', type=int, default=4, help='Number of worker processes')
+    parser.add_argument('-r', '--run-size', type=int, default=500000, help='Rows per run file')
+    parser.add_argument('-o', '--out', default='bench-geodedup-results.json', help='File to write the results to')
+    args = parser.parse_args()
+
+    from harness import BenchResult
+
+    root = tempfile.mkdtemp()
+
+    result = BenchResult(rows = args.rows, states = args.states, workers = args.workers, run_size = args.run_size)
+
+    try:
+        paths = []
+        with result.phase('write-geo-files', rows = args.rows):
+            for i in range(args.states):
+                path = os.path.join(root, '{:02d}.geo'.format(i + 1))
+                write_geo_file(path, '{:02d}'.format(i + 1), args.rows / args.states)
+                paths.append(path)
+
+        for phases, unique in (run(set_engine, root, paths), run(sort_engine, root, paths, args.workers, args.run_size)):
+            for p in phases:
+                p['rows'] = args.rows
+                p['rows_per_sec'] = args.rows / p['seconds']
+                result.phases.append(p)
+
+            result.config.setdefault('unique', []).append(unique)
+
+    finally:
+        shutil.rmtree(root)
+
+    result.write(args.out)
+
+    assert result.config['unique'][0] == result.config['unique'][1]
+
+    print "Unique rows: {}".format(result.config['unique'][0])
+
+    phases = { p['name']: p for p in result.phases }
+
+    for engine in ('set', 'sort'):
+        seconds = phases[engine+'-hash']['seconds'] + phases[engine+'-load']['seconds']
+        rss = max(max(p['peak_rss_mb'], p.get('worker_peak_rss_mb', 0))
+                  for p in (phases[engine+'-hash'], phases[engine+'-load']))
+
+        print "{:6s} {:8.3f}s {:8.1f}MB peak RSS".format(engine, seconds, rss)
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+    main()
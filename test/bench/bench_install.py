@@ -0,0 +1,87 @@
+'''
+Time LibraryDb.install_bundle() on a synthetic bundle with a wide schema, like
+a census fact table bundle, with the session merges and with the bulk path.
+
+    python test/bench/bench_install.py [-c 20000] [-t 100] [-o results.json]
+'''
+import os
+import sys
+import shutil
+import tempfile
+import argparse
+
+def wide_bundle(root, n_tables, n_columns, n_partitions):
+    '''Create a synthetic bundle with n_columns more columns, spread over
+    n_tables more tables, and n_partitions partition records'''
+    from harness import synthetic_bundle
+
+    b = synthetic_bundle(root, 'wide')
+
+    per_table = max(n_columns / n_tables, 1)
+
+    with b.session:
+        for i in range(n_tables):
+            t = b.schema.add_table('table{}'.format(i))
+            b.schema.add_column(t, 'id', datatype = 'integer', is_primary_key = True)
+
+            for j in range(per_table - 1):
+                b.schema.add_column(t, 'c{}_{}'.format(i, j), datatype = 'integer',
+                                    description = 'Column {} of table {}'.format(j, i))
+
+    with b.session:
+        for i in range(n_partitions):
+            b.partitions.new_db_partition(table = 'table{}'.format(i % n_tables), space = 's{}'.format(i))
+
+    return b
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark installing a wide bundle into a library')
+    parser.add_argument('-c', '--columns', type=int, default=20000, help='Number of columns')
+    parser.add_argument('-t', '--tables', type=int, default=100, help='Number of tables')
+    parser.add_argument('-p', '--partitions', type=int, default=200, help='Number of partitions')
+    parser.add_argument('-o', '--out', default='bench-install-results.json', help='File to write the results to')
+    args = parser.parse_args()
+
+    from harness import BenchResult
+    from databundles.library import LibraryDb
+    from databundles.bundle import DbBundle
+
+    root = tempfile.mkdtemp()
+
+    result = BenchResult(columns = args.columns, tables = args.tables, partitions = args.partitions)
+
+    try:
+        with result.phase('create-bundle', rows = args.columns):
+            b = wide_bundle(root, args.tables, args.columns, args.partitions)
+
+        path = b.database.path
+
+        for bulk in (False, True):
+            db = LibraryDb(driver = 'sqlite', dbname = os.path.join(root, 'library-{}.db'.format(bulk)))
+            db.create()
+
+            # Open the bundle file for each install, as Library.put() does, so
+            # records loaded by one install don't get merged by the next
+            with result.phase('install-bundle' + ('-bulk' if bulk else '-merge'), rows = args.columns):
+                db.install_bundle(DbBundle(path), bulk = bulk)
+
+            # Re-installing replaces the records
+            with result.phase('reinstall-bundle' + ('-bulk' if bulk else '-merge'), rows = args.columns):
+                db.install_bundle(DbBundle(path), bulk = bulk)
+
+            db.close()
+
+    finally:
+        shutil.rmtree(root)
+
+    result.write(args.out)
+
+    phases = { p['name']: p for p in result.phases }
+
+    print "Speedup: {:.1f}x".format(phases['install-bundle-merge']['seconds'] / phases['install-bundle-bulk']['seconds'])
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+    main()
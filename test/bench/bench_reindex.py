@@ -0,0 +1,78 @@
+'''
+Time translating the hash columns of record code rows to geo dim primary keys,
+with a DBM lookup for each value, as in UsCensusDimBundle.reindex_record_code(),
+and with translate_rows() on batches of rows, with hash indexes loaded from the
+DBM files.
+
+    python test/bench/bench_reindex.py [-n 1000000] [-b 50000] [-o results.json]
+'''
+import os
+import sys
+import shutil
+import tempfile
+import argparse
+
+# The number of rows in each geo dim table
+DIM_SIZES = (50, 5000, 20000, 200000)
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark reindexing record code rows')
+    parser.add_argument('-n', '--rows', type=int, default=1000000, help='Number of record code rows')
+    parser.add_argument('-b', '--batch', type=int, default=50000, help='Rows per batch')
+    parser.add_argument('-o', '--out', default='bench-reindex-results.json', help='File to write the results to')
+    args = parser.parse_args()
+
+    import numpy as np
+    from harness import BenchResult
+    from databundles.database.dbm import Dbm
+    from databundles.dedup import HashIndex, translate_rows
+
+    result = BenchResult(rows = args.rows, batch = args.batch, dims = list(DIM_SIZES))
+
+    dir_ = tempfile.mkdtemp()
+    rs = np.random.RandomState(2)
+
+    try:
+        tables = []
+        for i, n in enumerate(DIM_SIZES):
+            hashes = sorted(set(rs.randint(0, 2**55, n).tolist()))
+            dbm = Dbm(None, os.path.join(dir_, 'dim{}'.format(i))).writer
+            for pk, h in enumerate(hashes, 1):
+                dbm[h] = pk
+            dbm.close()
+            tables.append(hashes)
+
+        rows = [ (j, j % 7, 1, 0) + tuple(hashes[rs.randint(len(hashes))] for hashes in tables)
+                 for j in xrange(args.rows) ]
+
+        with result.phase('dbm', rows = args.rows):
+            translators = [ Dbm(None, os.path.join(dir_, 'dim{}'.format(i))).reader for i in range(len(tables)) ]
+            expected = [ list(row[0:4]) + [ int(translators[i][str(v)]) for i,v in enumerate(row[4: ])] for row in rows ]
+
+        with result.phase('bulk', rows = args.rows):
+            indexes = []
+            for i in range(len(tables)):
+                dbm = Dbm(None, os.path.join(dir_, 'dim{}'.format(i))).reader
+                indexes.append(HashIndex.from_items( (k, dbm[k]) for k in dbm.keys() ))
+                dbm.close()
+
+            translated = []
+            for j in xrange(0, len(rows), args.batch):
+                translated.extend(translate_rows(rows[j:j+args.batch], 4, indexes))
+
+        assert expected == translated
+
+    finally:
+        shutil.rmtree(dir_)
+
+    result.write(args.out)
+
+    phases = { p['name']: p for p in result.phases }
+
+    print "Speedup: {:.1f}x".format(phases['dbm']['seconds'] / phases['bulk']['seconds'])
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+    main()
@@ -0,0 +1,93 @@
+'''
+Time the row hash engines on geo dim rows: the md5 and fnv64 engines one row
+at a time, the fnv64 engine on batches of rows, and on raw fixed-width records.
+Also counts the collisions in the hashes of the distinct rows.
+
+    python test/bench/bench_rowhash.py [-n 10000000] [-b 100000] [-o results.json]
+'''
+import os
+import sys
+import time
+import argparse
+
+WIDTHS = [2, 3, 6, 13]
+
+def geo_rows(start, n):
+    '''Distinct rows, like the values of a geo dim table'''
+
+    return [ [None, '{:02d}'.format(i % 52), '{:03d}'.format(i % 997), '{:06d}'.format(i % 1000000),
+              'Place {}'.format(i / 1000000), None] for i in xrange(start, start + n) ]
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark the row hash engines')
+    parser.add_argument('-n', '--rows', type=int, default=10000000, help='Number of rows')
+    parser.add_argument('-b', '--batch', type=int, default=100000, help='Rows per batch')
+    parser.add_argument('-o', '--out', default='bench-rowhash-results.json', help='File to write the results to')
+    args = parser.parse_args()
+
+    import struct
+    import numpy as np
+    from harness import BenchResult
+    from databundles.rowhash import new_hasher
+
+    result = BenchResult(rows = args.rows, batch = args.batch)
+
+    indexes = [1, 2, 3, 4]
+    fmt = struct.Struct(''.join('{}s'.format(w) for w in WIDTHS) + '1s')
+
+    engines = [
+        ('md5-row', new_hasher('md5', indexes), False),
+        ('fnv64-row', new_hasher('fnv64', indexes), False),
+        ('fnv64-batch', new_hasher('fnv64', indexes), True),
+        ('fnv64-fixed-batch', new_hasher('fnv64', indexes, WIDTHS), True),
+    ]
+
+    hashes = {}
+
+    # The rows are generated a batch at a time, and only the hashing is timed
+    for name, h, batch in engines:
+        out = []
+        seconds = 0
+        for start in xrange(0, args.rows, args.batch):
+            rows = geo_rows(start, min(args.batch, args.rows - start))
+
+            t = time.time()
+            if batch:
+                out.append(h.hash_rows(rows))
+            else:
+                out.append(np.fromiter((h(row) for row in rows), dtype=np.uint64, count=len(rows)))
+            seconds += time.time() - t
+
+        result.add_phase(name, seconds, rows = args.rows)
+        hashes[name] = np.concatenate(out)
+
+    # The same rows, as a fixed-width file, so the time to generate the rows
+    # is separate from the hashing.
+    h = new_hasher('fnv64', indexes, WIDTHS)
+    blocks = [ ''.join(fmt.pack(*(row[1:5] + ['\n'])) for row in geo_rows(start, min(args.batch, args.rows - start)))
+               for start in xrange(0, args.rows, args.batch) ]
+
+    with result.phase('fnv64-records', rows = args.rows, bytes = sum(len(b) for b in blocks)):
+        hashes['fnv64-records'] = np.concatenate([ h.hash_records(b, fmt.size) for b in blocks ])
+
+    assert (hashes['fnv64-records'] == hashes['fnv64-fixed-batch']).all()
+    assert (hashes['fnv64-row'] == hashes['fnv64-batch']).all()
+
+    for name in sorted(hashes):
+        collisions = len(hashes[name]) - len(np.unique(hashes[name]))
+        result.config['collisions-' + name] = collisions
+        print "{:24s} {} collisions".format(name, collisions)
+
+    result.write(args.out)
+
+    phases = { p['name']: p for p in result.phases }
+
+    print "Speedup: {:.1f}x batch, {:.1f}x records".format(
+        phases['md5-row']['seconds'] / phases['fnv64-fixed-batch']['seconds'],
+        phases['md5-row']['seconds'] / phases['fnv64-records']['seconds'])
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+    main()
@@ -0,0 +1,121 @@
+'''
+Load test the library server, with and without the pool of library handles
+in LibraryPlugin.
+
+Runs the server in this process, in a threaded WSGI server, and requests
+/datasets, /datasets/<did> and /datasets/<did>/partitions/<pid> from
+several client threads for a fixed time.
+
+    python test/bench/bench_server.py [-l library] [-c threads] [-t seconds]
+'''
+import os
+import sys
+import time
+import json
+import random
+import threading
+import urllib2
+import argparse
+
+def make_server(host, port):
+    from SocketServer import ThreadingMixIn
+    from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+    from bottle import default_app
+
+    class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(*args, **kw): pass
+
+    return make_server(host, port, default_app(), ThreadingWSGIServer, QuietHandler)
+
+def urls(base):
+    '''Return the URLs to request, from the datasets in the library'''
+
+    l = [ base + '/datasets' ]
+
+    for did, d in json.loads(urllib2.urlopen(base + '/datasets').read()).items():
+        l.append(base + '/datasets/{}'.format(did))
+
+        for pid in json.loads(urllib2.urlopen(base + '/datasets/{}'.format(did)).read()).get('partitions',{}):
+            l.append(base + '/datasets/{}/partitions/{}'.format(did, pid))
+
+    return l
+
+def hammer(urls, n_threads, seconds):
+    '''Request random URLs from n_threads threads for a number of seconds.
+    Returns the requests per second and the number of errors'''
+
+    counts = [0] * n_threads
+    errors = [0] * n_threads
+    stop = time.time() + seconds
+
+    def run(n):
+        while time.time() < stop:
+            try:
+                urllib2.urlopen(random.choice(urls)).read()
+                counts[n] += 1
+            except Exception:
+                errors[n] += 1
+
+    threads = [ threading.Thread(target = run, args = (i,)) for i in range(n_threads) ]
+
+    for t in threads:
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    return sum(counts) / float(seconds), sum(errors)
+
+def main():
+    from bottle import install, uninstall
+    from databundles.run import get_runconfig
+    from databundles.library import new_library
+    from databundles.server.main import LibraryPlugin
+
+    parser = argparse.ArgumentParser(description='Load test the library server')
+    parser.add_argument('-l', '--library', default='default', help='Name of the library to serve')
+    parser.add_argument('-f', '--config', help='Path to a run config file')
+    parser.add_argument('-p', '--port', type=int, default=7981, help='Port for the test server')
+    parser.add_argument('-c', '--clients', type=int, default=8, help='Number of client threads')
+    parser.add_argument('-t', '--time', type=float, default=10, help='Seconds to run each test')
+    args = parser.parse_args()
+
+    rc = get_runconfig(args.config)
+    config = rc.library(args.library)
+
+    lf = lambda: new_library(config, True)
+    lf().database.create()
+
+    base = 'http://localhost:{}'.format(args.port)
+
+    srv = make_server('localhost', args.port)
+    t = threading.Thread(target = srv.serve_forever)
+    t.setDaemon(True)
+    t.start()
+
+    results = {}
+
+    try:
+        for pool in (False, True):
+            plugin = LibraryPlugin(lf, pool = pool)
+            install(plugin)
+
+            try:
+                test_urls = urls(base)
+                results[pool] = hammer(test_urls, args.clients, args.time)
+            finally:
+                uninstall(plugin)
+
+            print "pool={}: {} urls, {:.1f} requests/s, {} errors".format(pool, len(test_urls), *results[pool])
+    finally:
+        srv.shutdown()
+
+    if results[False][0]:
+        print "Speedup: {:.2f}x".format(results[True][0] / results[False][0])
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+    main()
@@ -0,0 +1,104 @@
+'''
+Compare two benchmark result files, written by bench.py, and report the
+phases that got slower, or used more memory, by more than a threshold.
+
+    python test/bench/compare.py baseline.json new.json [-t 10]
+
+Exits with status 1 if there are regressions.
+'''
+import os
+import sys
+import argparse
+
+def rate(phase):
+    '''The throughput of a phase, higher is better. Uses rows/sec or bytes/sec
+    when they were recorded, otherwise the inverse of the time'''
+
+    for key in ('rows_per_sec', 'bytes_per_sec'):
+        if phase.get(key):
+            return phase[key]
+
+    return 1.0 / phase['seconds'] if phase.get('seconds') else None
+
+def rss_growth(phase):
+    '''How much a phase raised the peak RSS. Results from before the growth 
+    was recorded only have the peak RSS at the end of the phase'''
+    
+    return phase.get('rss_growth_mb', phase.get('peak_rss_mb', 0))
+
+def compare(base_phases, new_phases, threshold, rss_threshold):
+    '''Return a list of (name, base_rate, new_rate, change, rss_change, regressed) 
+    tuples for the phases in both results, and the names of phases missing from
+    new. The rss_change is the difference in how much the phase raised the 
+    peak RSS, as a percent of the baseline's peak RSS, so a regression is 
+    only reported for the phase that caused it. '''
+
+    rows = []
+
+    for name, base in base_phases.items():
+        new = new_phases.get(name)
+
+        if not new:
+            continue
+
+        base_rate, new_rate = rate(base), rate(new)
+
+        if not base_rate or not new_rate:
+            continue
+
+        change = (new_rate - base_rate) / base_rate * 100.0
+
+        rss_change = ((rss_growth(new) - rss_growth(base)) / base['peak_rss_mb'] * 100.0
+                      if base.get('peak_rss_mb') else 0)
+
+        regressed = change < -threshold or rss_change > rss_threshold
+
+        rows.append((name, base_rate, new_rate, change, rss_change, regressed))
+
+    missing = sorted(set(base_phases) - set(new_phases))
+
+    return rows, missing
+
+def main():
+    from harness import load_result
+
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('base', help='Baseline results')
+    parser.add_argument('new', help='New results')
+    parser.add_argument('-t', '--threshold', type=float, default=10.0,
+                        help='Percent drop in throughput that is a regression')
+    parser.add_argument('-m', '--rss-threshold', type=float, default=25.0,
+                        help='Increase in the growth of the peak RSS in a phase, as a percent of the peak RSS, that is a regression')
+    args = parser.parse_args()
+
+    base, base_phases = load_result(args.base)
+    new, new_phases = load_result(args.new)
+
+    if base['config'] != new['config']:
+        print "Warning: the runs have different configurations: {} != {}".format(base['config'], new['config'])
+
+    rows, missing = compare(base_phases, new_phases, args.threshold, args.rss_threshold)
+
+    order = [ p['name'] for p in base['phases'] ]
+    rows.sort(key = lambda r: order.index(r[0]))
+
+    print "{:24s} {:>14s} {:>14s} {:>8s} {:>8s}".format('phase', 'base', 'new', 'change', 'rss')
+
+    for name, base_rate, new_rate, change, rss_change, regressed in rows:
+        print "{:24s} {:14.1f} {:14.1f} {:+7.1f}% {:+7.1f}% {}".format(name, base_rate, new_rate,
+                                                                      change, rss_change, 'REGRESSION' if regressed else '')
+
+    for name in missing:
+        print "{:24s} missing from {}".format(name, args.new)
+
+    regressions = [ r[0] for r in rows if r[5] ]
+
+    if regressions:
+        print "{} regressions: {}".format(len(regressions), ', '.join(regressions))
+        return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(main())
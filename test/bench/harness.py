@@ -0,0 +1,158 @@
+'''
+Support for the benchmarks: timing phases, recording peak memory, writing
+results, and building synthetic bundles.
+'''
+import os
+import sys
+import time
+import json
+import platform
+import resource
+from contextlib import contextmanager
+
+def peak_rss():
+    '''Return the peak resident set size of this process, in MB'''
+
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on OS X, KB on Linux
+    if sys.platform == 'darwin':
+        return r / (1024.0 * 1024.0)
+    else:
+        return r / 1024.0
+
+class BenchResult(object):
+    '''Timings for the phases of a benchmark run. Each phase records its
+    wall-clock time, the number of rows or bytes it processed, the peak RSS
+    of the process at the end of the phase and, since the peak RSS is the 
+    high-water mark for the whole process, how much the phase raised it. '''
+
+    def __init__(self, **config):
+        self.config = config
+        self.phases = []
+        self.start = time.time()
+        self.last_rss = peak_rss()
+
+    @contextmanager
+    def phase(self, name, rows=None, bytes=None):
+        '''Time the body of a with block. The rows and bytes counts may also be
+        set on the yielded dict, for phases that don't know them in advance'''
+
+        d = {'name': name, 'rows': rows, 'bytes': bytes}
+
+        rss = peak_rss()
+        t = time.time()
+
+        yield d
+
+        self.add_phase(name, time.time() - t, d['rows'], d['bytes'], rss_before = rss)
+
+    def add_phase(self, name, seconds, rows=None, bytes=None, rss_before=None):
+        '''Record a phase that was timed elsewhere, such as one that is timed in
+        pieces, to leave out the setup between the pieces. The RSS growth is
+        from rss_before, or from the peak RSS at the end of the last phase'''
+
+        d = {'name': name, 'rows': rows, 'bytes': bytes, 'seconds': seconds}
+        d['peak_rss_mb'] = peak_rss()
+        d['rss_growth_mb'] = d['peak_rss_mb'] - (self.last_rss if rss_before is None else rss_before)
+
+        self.last_rss = d['peak_rss_mb']
+
+        if d['rows'] and d['seconds']:
+            d['rows_per_sec'] = d['rows'] / d['seconds']
+
+        if d['bytes'] and d['seconds']:
+            d['bytes_per_sec'] = d['bytes'] / d['seconds']
+
+        self.phases.append(d)
+
+        print "{:24s} {:8.3f}s {:>14s} {:8.1f}MB {:+8.1f}MB".format(name, d['seconds'],
+               "{:.0f} rows/s".format(d['rows_per_sec']) if 'rows_per_sec' in d else '', 
+               d['peak_rss_mb'], d['rss_growth_mb'])
+
+        return d
+
+    def to_dict(self):
+        return {
+            'config': self.config,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'seconds': time.time() - self.start,
+            'peak_rss_mb': peak_rss(),
+            'phases': self.phases
+        }
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4, sort_keys=True)
+
+def load_result(path):
+    '''Load a result file, returning the phases as a dict keyed by name'''
+
+    with open(path) as f:
+        d = json.load(f)
+
+    return d, { p['name']: p for p in d['phases'] }
+
+SYNTHETIC_COLUMNS = [('id','integer'), ('text','text'), ('integer','integer'),
+                     ('real','real'), ('date','date'), ('datetime','datetime')]
+
+def synthetic_row(i):
+    '''A row for the synthetic table, as a dict of strings and numbers, like
+    values read from a source file'''
+
+    return {
+        'id': i+1,
+        'text': u'text {}'.format(i % 1000) if i % 7 else None,
+        'integer': str(i * 3),
+        'real': i / 3.0,
+        'date': '20{:02d}-{:02d}-{:02d}'.format(i % 10, 1 + i % 12, 1 + i % 28),
+        'datetime': '2013-10-{:02d}T12:{:02d}'.format(1 + i % 28, i % 60)
+    }
+
+def synthetic_bundle(root, name='synthetic'):
+    '''Create a bundle in root/name, with a schema for the synthetic table,
+    and return it. '''
+    from databundles.bundle import BuildBundle
+
+    bundle_dir = os.path.join(root, name)
+
+    if not os.path.exists(bundle_dir):
+        os.makedirs(bundle_dir)
+
+    with open(os.path.join(bundle_dir, 'bundle.yaml'), 'w') as f:
+        f.write('''
+identity:
+    creator: bench
+    dataset: {name}
+    id: a1Bnch
+    name: bench-{name}
+    revision: 1
+    source: bench
+    variation: orig
+'''.format(name = name))
+
+    b = BuildBundle(bundle_dir)
+    b.database.create()
+
+    with b.session:
+        t = b.schema.add_table('synthetic')
+        for col_name, datatype in SYNTHETIC_COLUMNS:
+            b.schema.add_column(t, col_name, datatype = datatype, is_primary_key = (col_name == 'id'))
+
+    b.schema.create_tables()
+
+    return b
+
+def synthetic_library(root):
+    '''Create a library with a filesystem cache and a sqlite database under root'''
+    from databundles.library import new_library
+
+    config = {
+        '_name': 'bench',
+        'filesystem': {'dir': os.path.join(root, 'cache')},
+        'database': {'driver': 'sqlite', 'dbname': os.path.join(root, 'library.db')}
+    }
+
+    return config, new_library(config, True)
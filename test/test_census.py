@@ -0,0 +1,67 @@
+import unittest
+import os
+import csv
+import shutil
+import tempfile
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_split_segment_rows(self):
+        '''One pass over a segment file writes the same rows as slicing it once
+        for each table'''
+        from databundles.sourcesupport.uscensus import split_segment_rows
+
+        # FILEID, STUSAB, CHARITER, CIFSN, LOGRECNO, then the table columns
+        ranges = {
+            'a': {'start': 5, 'end': 8, 'length': 3, 'table': 'p1'},
+            'b': {'start': 8, 'end': 9, 'length': 1, 'table': 'p2'},
+            'c': {'start': 9, 'end': 14, 'length': 5, 'table': 'p3'},
+        }
+
+        def segment_rows():
+            for lrn in range(1, 1001):
+                if lrn % 50 == 0:
+                    yield [] # A gap, as in the PCT tables
+                else:
+                    yield ['uSF1', 'CA', '000', '01', '{:07d}'.format(lrn)] + [ str(lrn * 100 + i) for i in range(9) ]
+
+        # Logrecno 999 isn't in record_code
+        geo_keys = { lrn: (lrn, 6, 1000 + lrn) for lrn in range(1, 999) }
+
+        files = { table_id: open(os.path.join(self.dir, table_id + '.csv'), 'wb') for table_id in ranges }
+        writers = { table_id: csv.writer(f) for table_id, f in files.items() }
+
+        # Table p2 has one column too many
+        widths = {'a': 6, 'b': 3, 'c': 8}
+
+        count, missing, bad = split_segment_rows(segment_rows(), ranges, geo_keys, writers, widths)
+
+        for f in files.values():
+            f.close()
+
+        self.assertEquals((1000 - 20 - 1, 1), (count, missing))
+        self.assertEquals({'b': count}, bad)
+
+        for table_id, r in ranges.items():
+            expected = [ [ str(v) for v in geo_keys[int(row[4])] ] + row[r['start']:r['end']]
+                         for row in segment_rows() if row and int(row[4]) in geo_keys ]
+
+            with open(os.path.join(self.dir, table_id + '.csv'), 'rb') as f:
+                written = list(csv.reader(f))
+
+            self.assertEquals(expected, written, table_id)
+            self.assertEquals(3 + r['length'], len(written[0]))
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Test))
+    return suite
+
+if __name__ == "__main__":
+    unittest.TextTestRunner().run(suite())
@@ -0,0 +1,104 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+class CsvPartition(object):
+    '''Stands in for a CsvPartition, which only has to supply the path'''
+
+    def __init__(self, path):
+        self.path = path
+        self.table = None
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def db(self, name='part'):
+        from databundles.database.csv import CsvDb
+
+        return CsvDb(None, CsvPartition(os.path.join(self.dir, name)), None)
+
+    def test_inserter_stats(self):
+        '''The inserter writes a stats file that matches a scan of the file'''
+        from databundles.database.csv import read_stats_file, scan_stats, stats_path
+
+        db = self.db()
+
+        with db.inserter(header = ['id', 'text']) as ins:
+            for i in range(1000):
+                ins.insert({'id': 500 - i, 'text': u'text|{}'.format(i)})
+
+        self.assertEquals({'count': 1000, 'min_key': -499, 'max_key': 500},
+                          dict((k, v) for k, v in read_stats_file(db.path).items() if k in ('count', 'min_key', 'max_key')))
+
+        d = scan_stats(db.path)
+        self.assertEquals((1000, -499, 500), (d['count'], d['min_key'], d['max_key']))
+
+        # Non-integer keys have no range
+        db2 = self.db('part2')
+        with db2.inserter() as ins:
+            for i in range(10):
+                ins.insert(['a{}'.format(i), i])
+
+        self.assertEquals({'count': 10, 'min_key': None, 'max_key': None}, scan_stats(db2.path))
+        self.assertEquals(10, db2.stats()['count'])
+        self.assertEquals(None, db2.stats()['min_key'])
+
+        # Changing the file invalidates the stats file, and stats() rescans
+        with open(db.path, 'a') as f:
+            f.write('2000|more\n')
+
+        self.assertIsNone(read_stats_file(db.path))
+        d = db.stats()
+        self.assertEquals((1001, -499, 2000), (d['count'], d['min_key'], d['max_key']))
+        self.assertIsNotNone(read_stats_file(db.path))
+
+        db.delete()
+        self.assertFalse(os.path.exists(stats_path(db.path)))
+
+        # A header line isn't counted, whether the out of date stats file 
+        # records it, or there is no stats file
+        db3 = self.db('part3')
+        with db3.inserter(header = ['id', 'text'], write_header = True) as ins:
+            for i in range(10):
+                ins.insert([i + 1, 'text'])
+
+        self.assertEquals((10, 1, 10), tuple(db3.stats()[k] for k in ('count', 'min_key', 'max_key')))
+
+        with open(db3.path, 'a') as f:
+            f.write('11|more\n')
+
+        self.assertEquals((11, 1, 11), tuple(db3.stats()[k] for k in ('count', 'min_key', 'max_key')))
+
+        os.remove(stats_path(db3.path))
+        self.assertEquals((11, 1, 11), tuple(db3.stats()[k] for k in ('count', 'min_key', 'max_key')))
+
+    def test_parallel_scan(self):
+        '''Scan a file in chunks, with tiny blocks and a header, in several processes'''
+        from databundles.database.csv import scan_stats
+
+        path = os.path.join(self.dir, 'external.csv')
+
+        with open(path, 'w') as f:
+            f.write('id|name\n')
+            for i in range(5003):
+                f.write('{}|name {}\n'.format(i * 7 - 100, i))
+            # No newline on the last line
+            f.write('-1000|last')
+
+        for n_workers in (1, 3, 8):
+            d = scan_stats(path, header = True, n_workers = n_workers, block_size = 1000, min_parallel_size = 0)
+            self.assertEquals({'count': 5004, 'min_key': -1000, 'max_key': 5002 * 7 - 100}, d, n_workers)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Test))
+    return suite
+
+if __name__ == "__main__":
+    unittest.TextTestRunner().run(suite())
@@ -0,0 +1,175 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+def _write_state_runs(args):
+    '''Pool worker: write the runs for the rows of one state'''
+    from databundles.dedup import RunWriter
+    from databundles.rowhash import new_hasher
+
+    dir_, state, n = args
+
+    h = new_hasher('md5', [1, 2, 3])
+
+    with RunWriter(dir_, prefix=state, run_size=1000) as w:
+        for row in geo_rows(state, n):
+            w.add(h(row), row)
+
+    return w.paths, w.count
+
+def geo_rows(state, n):
+    '''Rows with values that repeat within a state, and with some rows, for
+    the '00' county, that are the same in every state'''
+
+    for i in range(n):
+        if i % 10 == 0:
+            yield [None, '00', '{:03d}'.format(i % 30), None]
+        else:
+            yield [None, state, '{:03d}'.format(i % 97), None]
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_merge_runs(self):
+        '''Runs written in several processes merge to one row for each hash, in
+        hash order, the same rows as de-duplicating with a set'''
+        from multiprocessing import Pool
+        from databundles.dedup import merge_runs, find_runs, read_run
+        from databundles.rowhash import new_hasher
+
+        states = ['{:02d}'.format(i) for i in range(1, 11)]
+
+        pool = Pool(3)
+        results = pool.map(_write_state_runs, [ (self.dir, state, 500) for state in states ])
+        pool.close()
+        pool.join()
+
+        self.assertEquals([500] * 10, [ count for _, count in results ])
+
+        # 100 unique rows per state, so each state writes one run
+        paths = find_runs(self.dir)
+        self.assertEquals(sorted(p for paths, _ in results for p in paths), paths)
+        self.assertEquals(10, len(paths))
+
+        for path in paths:
+            hashes = [ h for h, _ in read_run(path) ]
+            self.assertEquals(sorted(set(hashes)), hashes)
+
+        h = new_hasher('md5', [1, 2, 3])
+        expected = {}
+        for state in states:
+            for row in geo_rows(state, 500):
+                expected.setdefault(h(row), tuple(row))
+
+        merged = list(merge_runs(paths))
+
+        self.assertEquals(sorted(expected.items()), merged)
+        self.assertEquals(10 * 97 + 3, len(merged))
+
+        # Smaller runs, with duplicates across the runs of one writer
+        from databundles.dedup import RunWriter
+
+        with RunWriter(os.path.join(self.dir, 'small'), run_size=7) as w:
+            for row in geo_rows('01', 500):
+                w.add(h(row), row)
+
+        self.assertTrue(len(w.paths) > 10)
+        self.assertEquals(sorted(expected.items()), sorted(set(merged) | set(merge_runs(w.paths))))
+        self.assertEquals(100, len(list(merge_runs(w.paths))))
+
+    def test_hash_index(self):
+        '''The index translates hashes to ids, one at a time and in arrays'''
+        import numpy as np
+        from databundles.dedup import HashIndex
+
+        index = HashIndex(os.path.join(self.dir, 'geo.hidx'))
+        self.assertFalse(index.exists)
+
+        hashes = sorted(set(np.random.RandomState(1).randint(0, 2**55, 200000).tolist()))
+
+        with index.writer as w:
+            for i, h in enumerate(hashes):
+                w.add(h, i + 1)
+
+        self.assertEquals(len(hashes), len(index))
+        self.assertEquals(1, index[hashes[0]])
+        self.assertEquals(len(hashes), index[str(hashes[-1])])
+        self.assertIn(hashes[100], index)
+        self.assertNotIn(hashes[100] + 1, index)
+        self.assertRaises(KeyError, index.__getitem__, 0)
+
+        probe = hashes[::7] + [1, 2**56 - 1]
+        ids = index.lookup(probe)
+        self.assertEquals(range(1, len(hashes) + 1, 7) + [-1, -1], ids.tolist())
+
+        # Hashes must be added in order, and writing again replaces the index
+        with index.writer as w:
+            self.assertRaises(ValueError, lambda: [ w.add(h, 0) for h in (5, 3) ])
+
+        with index.writer as w:
+            pass
+
+        self.assertEquals(0, len(index))
+        self.assertEquals([-1], index.lookup([5]).tolist())
+        self.assertEquals(None, index.get(5))
+
+        index.delete()
+        self.assertFalse(index.exists)
+
+    def test_translate_rows(self):
+        '''Translating record code rows in batches gives the same rows as DBM
+        lookups for each value. test/bench/bench_reindex.py times them. '''
+        import numpy as np
+        from databundles.database.dbm import Dbm
+        from databundles.dedup import HashIndex, translate_rows
+
+        rs = np.random.RandomState(2)
+
+        # Three geo dim tables, with hashes mapped to primary keys, as load_geo_dim() writes them
+        tables = []
+        for i, n in enumerate((50, 5000, 20000)):
+            hashes = sorted(set(rs.randint(0, 2**55, n).tolist()))
+            dbm = Dbm(None, os.path.join(self.dir, 'dim{}'.format(i))).writer
+            for pk, h in enumerate(hashes, 1):
+                dbm[h] = pk
+            dbm.close()
+            tables.append(hashes)
+
+        rows = [ (j, j % 7, 1, 0) + tuple(hashes[rs.randint(len(hashes))] for hashes in tables)
+                 for j in range(100000) ]
+
+        translators = [ Dbm(None, os.path.join(self.dir, 'dim{}'.format(i))).reader for i in range(3) ]
+        expected = [ list(row[0:4]) + [ int(translators[i][str(v)]) for i,v in enumerate(row[4: ])] for row in rows ]
+
+        indexes = []
+        for i in range(3):
+            dbm = Dbm(None, os.path.join(self.dir, 'dim{}'.format(i))).reader
+            indexes.append(HashIndex.from_items( (k, dbm[k]) for k in dbm.keys() ))
+            dbm.close()
+
+        translated = []
+        for j in range(0, len(rows), 10000):
+            translated.extend(translate_rows(rows[j:j+10000], 4, indexes))
+
+        self.assertEquals(expected, translated)
+
+        self.assertEquals([], translate_rows([], 4, indexes))
+        self.assertRaises(KeyError, translate_rows, [(1, 2, 3, 4, 5, 6, 7)], 4, indexes)
+
+        # A missing index would leave a hash column untranslated
+        self.assertRaises(ValueError, translate_rows, rows[:10], 4, indexes[:2])
+        self.assertRaises(ValueError, HashIndex.from_items, [(1, 1), (1, 2)])
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Test))
+    return suite
+
+if __name__ == "__main__":
+    unittest.TextTestRunner().run(suite())
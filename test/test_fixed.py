@@ -0,0 +1,159 @@
+import unittest
+import os.path
+import shutil
+import struct
+import tempfile
+
+WIDTHS = [('state', 2, 'text'), ('county', 3, 'text'), ('logrecno', 7, 'integer'),
+          ('pop', 9, 'integer'), ('area', 12, 'real'), ('name', 20, 'text')]
+
+def records(n):
+    '''Fixed-width records, without line endings'''
+
+    for i in range(n):
+        yield '{:2s}{:03d}{:07d}{:9d}{:12.4f}{:20s}'.format(
+            'CA' if i % 3 else 'NV', i % 997, i + 1, i * 17, i / 7.0, 'Place {}'.format(i))
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, n, eol='\n', last_eol=True):
+
+        path = os.path.join(self.dir, 'fixed.dat')
+
+        with open(path, 'wb') as f:
+            for i, r in enumerate(records(n)):
+                f.write(r)
+                if i < n - 1 or last_eol:
+                    f.write(eol)
+
+        return path
+
+    def orm_table(self):
+        '''An ORM table for the records, with an id column that has no width'''
+        from databundles.orm import Dataset, Table, Column
+
+        ds = Dataset(id='a1DxuZ', revision=1, name='source-dataset', vname='source-dataset-r1',
+                     source='source', dataset='dataset', creator='creator')
+
+        table = Table(ds, name='geo', sequence_id=1)
+
+        table.columns.append(Column(table, name='id', datatype='integer', sequence_id=1, is_primary_key=True))
+
+        for i, (name, width, datatype) in enumerate(WIDTHS):
+            table.columns.append(Column(table, name=name, datatype=datatype, width=width, sequence_id=i + 2))
+
+        return table
+
+    def test_read(self):
+        '''Blocks of records unpack to the same tuples as unpacking each line'''
+        from databundles.fixed import FixedReader
+
+        fmt = ''.join('{}s'.format(w) for _, w, _ in WIDTHS)
+        expected = [ struct.unpack(fmt, r) for r in records(1000) ]
+
+        for eol in ('\n', '\r\n', ''):
+            for last_eol in (True, False):
+                path = self.write(1000, eol, last_eol)
+
+                # Block sizes that do and don't divide the records
+                for block_size in (1, 100, 4096, 1000000):
+                    for engine in ('struct', 'numpy'):
+                        with FixedReader(path, fmt, block_size=block_size, engine=engine) as r:
+                            rows = list(r)
+
+                        self.assertEquals(expected, rows, (repr(eol), last_eol, block_size, engine))
+                        self.assertEquals(1000, r.count)
+                        self.assertEquals(eol, r.eol)
+
+        # Arrays, with names, and skipped fields
+        with FixedReader(path, '2s3x7s41x', names=['state', 'logrecno'], block_size=20000) as r:
+            arrays = list(r.arrays())
+
+        self.assertEquals(3, len(arrays))
+        self.assertEquals([ (e[0], e[2]) for e in expected ], [ tuple(x) for a in arrays for x in a ])
+        self.assertEquals('0000010', arrays[0]['logrecno'][9])
+
+        # Integer fields are parsed with the numpy engine, unless a value in
+        # the batch isn't digits with leading spaces
+        path = os.path.join(self.dir, 'ints.dat')
+        with open(path, 'wb') as f:
+            f.write('   1 -129007\n 230   7   0\n4560  80 8 1\n')
+
+        with FixedReader(path, '4s4s4s', types=[int, int, int], engine='numpy') as r:
+            self.assertEquals([(1, ' -12', '9007'), (230, '   7', '   0'), (4560, '  80', ' 8 1')], list(r))
+
+        with FixedReader(path, '4s4s4s', types=[int, str, int], engine='numpy', batch_size=2) as r:
+            self.assertEquals([(1, ' -12', 9007), (230, '   7', 0), (4560, '  80', ' 8 1')], list(r))
+
+        # A record that is too short
+        path = os.path.join(self.dir, 'short.dat')
+        with open(path, 'wb') as f:
+            f.write(''.join(r + '\n' for r in list(records(10))[:5]))
+            f.write('CA001\n')
+            f.write(''.join(r + '\n' for r in records(10)))
+
+        with self.assertRaises(ValueError) as cm:
+            list(FixedReader(path, fmt, block_size=1000))
+
+        self.assertIn('Record 6', str(cm.exception))
+
+        self.assertRaises(ValueError, FixedReader, path, '2s3i')
+        self.assertRaises(ValueError, FixedReader, path, fmt, engine='regex')
+
+    def test_insert(self):
+        '''Rows from the table's reader go straight to the positional caster and
+        inserter, and give the same records as dicts from unpacked lines'''
+        from databundles.database.relational import RelationalDatabase
+        from databundles.database.inserter import ValueInserter
+        from sqlalchemy import MetaData, Table, Column
+
+        orm_table = self.orm_table()
+
+        db = RelationalDatabase(driver='sqlite', dbname=os.path.join(self.dir, 'fixed.db'))
+        metadata = MetaData()
+
+        def sa_table(name):
+            table = Table(name, metadata, *[ Column(c.name, c.sqlalchemy_type, primary_key=c.is_primary_key)
+                                             for c in orm_table.columns ])
+            table.create(bind=db.engine)
+            table._db_orm_table = orm_table
+            return table
+
+        n = 50000
+        path = self.write(n, '\r\n')
+
+        line_table = sa_table('lines')
+        block_table = sa_table('blocks')
+
+        _, header, unpack_str, _ = orm_table.get_fixed_unpack()
+        with ValueInserter(db, None, line_table, bulk=True) as ins:
+            with open(path, 'rb') as f:
+                for line in f:
+                    ins.insert(dict(zip(header, struct.unpack(unpack_str, line[:-2]))))
+
+        with ValueInserter(db, None, block_table, bulk=True) as ins:
+            with orm_table.get_fixed_reader(path) as r:
+                for row in r:
+                    ins.insert(row)
+
+        line_rows = db.connection.execute('SELECT * FROM lines ORDER BY id').fetchall()
+        block_rows = db.connection.execute('SELECT * FROM blocks ORDER BY id').fetchall()
+
+        self.assertEquals(n, len(block_rows))
+        self.assertEquals(line_rows, block_rows)
+        self.assertEquals((2, u'CA', u'001', 2, 17, u'{:20s}'.format('Place 1')),
+                          tuple(block_rows[1][k] for k in ('id', 'state', 'county', 'logrecno', 'pop', 'name')))
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Test))
+    return suite
+
+if __name__ == "__main__":
+    unittest.TextTestRunner().run(suite())
@@ -45,6 +45,50 @@ class Test(TestBase):
         
         aa.write_geotiff('/tmp/box.tiff',  a,  data_type=GDT_Float32)
 
+    def test_vectorized_kernel(self):
+        '''Check the vectorized convolutions against applying the kernel one point at a time'''
+        import numpy as np
+        from databundles.geo import Point
+        from databundles.geo.kernel import GaussianKernel, DistanceKernel, OutOfBounds
+        from databundles.geo.array import apply_copy
+
+        rs = np.random.RandomState(1)
+
+        h, w = 40, 57
+
+        # Include points on the edges, and one past the far edges, which apply() allows
+        points = [ (rs.randint(0, w+1), rs.randint(0, h+1)) for i in range(300) ]
+        points += [ (0,0), (w,h), (w,0), (0,h), (w-1,h-1) ]
+
+        for k in (GaussianKernel(11,6), DistanceKernel(9)):
+            a = np.zeros((h,w))
+            for x, y in points:
+                k.apply_add(a, Point(x,y))
+
+            b = np.zeros((h,w))
+            k.apply_add_points(b, points)
+
+            self.assertTrue(np.allclose(a, b))
+
+            # Counts in cells, convolved
+            src = np.zeros((h,w))
+            for x, y in points:
+                if x < w and y < h:
+                    src[y,x] += 1
+
+            a = np.zeros((h,w))
+            for x, y in points:
+                if x < w and y < h:
+                    k.apply_add(a, Point(x,y))
+
+            for method in ('scatter','shift','fft'):
+                self.assertTrue(np.allclose(a, k.convolve(src, method=method)), method)
+
+            self.assertTrue(np.allclose(a, apply_copy(k, src, nodata=0)))
+
+        with self.assertRaises(OutOfBounds):
+            k.apply_add_points(b, [(-1, 0)])
+
     def test_sfschema(self):
         from databundles.geo.sfschema import TableShapefile
         from databundles.geo.analysisarea import get_analysis_area
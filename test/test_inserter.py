@@ -0,0 +1,262 @@
+import unittest
+import os.path
+import shutil
+import tempfile
+import datetime
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def orm_table(self, name='foo'):
+        '''Construct an ORM table, without a bundle or a session'''
+        from databundles.orm import Dataset, Table, Column
+
+        ds = Dataset(id='a1DxuZ', revision=1, name='source-dataset', vname='source-dataset-r1',
+                     source='source', dataset='dataset', creator='creator')
+
+        table = Table(ds, name=name, sequence_id=1)
+
+        for i,(col_name, datatype) in enumerate([('id','integer'), ('text','text'), ('integer','integer'),
+                                             ('real','real'), ('date','date'), ('datetime','datetime')]):
+            table.columns.append(Column(table, name=col_name, datatype=datatype,
+                                        sequence_id = i+1, is_primary_key = (col_name == 'id')))
+
+        return table
+
+    def database(self):
+        from databundles.database.relational import RelationalDatabase
+
+        return RelationalDatabase(driver='sqlite', dbname=os.path.join(self.dir, 'inserter.db'))
+
+    def sa_table(self, db, orm_table, name):
+        from sqlalchemy import MetaData, Table, Column
+
+        metadata = MetaData()
+
+        table = Table(name, metadata,
+                      *[ Column(c.name, c.sqlalchemy_type, primary_key = c.is_primary_key)
+                        for c in orm_table.columns ])
+
+        table.create(bind=db.engine)
+        table._db_orm_table = orm_table
+
+        return table
+
+    def rows(self, n):
+
+        for i in range(n):
+            yield {
+                'id': i+1,
+                'text': u'text {}'.format(i) if i % 7 else None,
+                'integer': str(i * 3),
+                'real': i / 3.0,
+                'date': datetime.date(2000 + i % 10, 1 + i % 12 , 1 + i % 28 ),
+                'datetime': '2013-10-{:02d}T12:{:02d}'.format(1 + i % 28, i % 60)
+                }
+
+    def test_bulk(self):
+        '''Check that the executemany() path writes the same values as the session path'''
+
+        db = self.database()
+        orm_table = self.orm_table()
+
+        dict_table = self.sa_table(db, orm_table, 'dict_rows')
+        bulk_table = self.sa_table(db, orm_table, 'bulk_rows')
+
+        with _inserter(db, dict_table, cache_size = 300) as ins:
+            self.assertFalse(ins.bulk)
+            for row in self.rows(1000):
+                ins.insert(row)
+
+        with _inserter(db, bulk_table, cache_size = 300, bulk = True) as ins:
+            self.assertTrue(ins.bulk)
+            self.assertIn('?', ins.bulk_sql)
+            for row in self.rows(1000):
+                ins.insert(row)
+
+        dict_rows = db.connection.execute('SELECT * FROM dict_rows ORDER BY id').fetchall()
+        bulk_rows = db.connection.execute('SELECT * FROM bulk_rows ORDER BY id').fetchall()
+
+        self.assertEquals(1000, len(dict_rows))
+        self.assertEquals(dict_rows, bulk_rows)
+
+        row = db.connection.execute(bulk_table.select().where(bulk_table.c.id == 9)).fetchone()
+
+        self.assertEquals(datetime.date(2008, 9, 9), row['date'])
+        self.assertEquals(datetime.datetime(2013, 10, 9, 12, 8), row['datetime'])
+        self.assertEquals(24, row['integer'])
+        self.assertIsNone(dict_rows[0]['text'])
+
+    def test_tuples(self):
+        '''Positional rows should produce the same records as dict rows, in both 
+        the bulk and session paths'''
+
+        db = self.database()
+        orm_table = self.orm_table()
+        header = [ c.name for c in orm_table.columns ]
+
+        dict_table = self.sa_table(db, orm_table, 'dict_rows')
+
+        with _inserter(db, dict_table) as ins:
+            for row in self.rows(500):
+                ins.insert(row)
+
+        for bulk in (False, True):
+            table_name = 'tuple_rows_{}'.format(int(bulk))
+            tuple_table = self.sa_table(db, orm_table, table_name)
+
+            with _inserter(db, tuple_table, cache_size = 300, bulk = bulk) as ins:
+                for row in self.rows(500):
+                    ins.insert(tuple(row[k] for k in header))
+
+                self.assertEquals(len('text 499'), ins.max_lengths['text'])
+
+            self.assertEquals(db.connection.execute('SELECT * FROM dict_rows ORDER BY id').fetchall(),
+                              db.connection.execute('SELECT * FROM {} ORDER BY id'.format(table_name)).fetchall())
+
+    def test_bulk_replace(self):
+
+        db = self.database()
+        table = self.sa_table(db, self.orm_table(), 'replace_rows')
+
+        for i in range(2):
+            with _inserter(db, table, bulk = True, replace = True) as ins:
+                for row in self.rows(100):
+                    row['text'] = 'pass {}'.format(i)
+                    ins.insert(row)
+
+        rows = db.connection.execute('SELECT DISTINCT text FROM replace_rows').fetchall()
+
+        self.assertEquals([('pass 1',)], [ tuple(r) for r in rows])
+
+    def test_csv_load(self):
+        '''Load a CSV file with the in-process loader and compare to the inserter'''
+        import unicodecsv
+        from sqlalchemy import Index
+        from databundles.database.sqlite import SqliteDatabase
+
+        orm_table = self.orm_table()
+        header = [ c.name for c in orm_table.columns ]
+
+        db = SqliteDatabase(os.path.join(self.dir, 'load.db'))
+        db.get_connection(check_exists=False)
+
+        load_table = self.sa_table(db, orm_table, 'foo')
+        Index('foo_text_idx', load_table.c.text).create(bind=db.engine)
+
+        csv_paths = []
+        for part in range(2):
+            csv_path = os.path.join(self.dir, 'part{}.csv'.format(part))
+            with open(csv_path, 'wb') as f:
+                w = unicodecsv.writer(f, delimiter='|')
+                for i, row in enumerate(self.rows(1000)):
+                    if i % 2 == part:
+                        w.writerow([ row[k] for k in header ])
+                
+                if part == 1:
+                    w.writerow([ 'bad', 'row', 'not an int', 'x', 'y', 'z' ])
+                    
+            csv_paths.append(csv_path)
+
+        messages = []
+
+        with self.assertRaises(ValueError):
+            db.load_bulk(csv_paths, orm_table, logger = messages.append, max_errors = 0)
+
+        db.connection.execute('DELETE FROM foo')
+
+        count, elapsed = db.load_bulk(csv_paths, orm_table, logger = messages.append, 
+                                   chunk_size = 300, max_errors = 1)
+
+        self.assertEquals(1000, count)
+
+        # By default, bad rows are skipped, as with the shell import
+        db.connection.execute('DELETE FROM foo')
+        self.assertEquals(1000, db.load_bulk(csv_paths, orm_table, logger = messages.append)[0])
+        self.assertTrue(any('rows/s' in m for m in messages))
+
+        indexes = db.connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()
+        self.assertIn(('foo_text_idx',), [ tuple(r) for r in indexes ])
+        
+        # Compare to the same rows written with the inserter
+        dict_db = self.database()
+        dict_table = self.sa_table(dict_db, orm_table, 'dict_rows')
+
+        with _inserter(dict_db, dict_table) as ins:
+            for row in self.rows(1000):
+                ins.insert(row)
+
+        self.assertEquals(dict_db.connection.execute('SELECT * FROM dict_rows ORDER BY id').fetchall(),
+                          db.connection.execute('SELECT * FROM foo ORDER BY id').fetchall())
+
+    def test_memoized(self):
+        '''The caster, validators and hasher are built once, until the columns change'''
+        import hashlib
+        from databundles.orm import Column
+
+        table = self.orm_table()
+
+        caster = table.caster
+        self.assertIs(caster, table.caster)
+        self.assertIs(table.hasher, table.hasher)
+        self.assertIs(table.validator(False), table.validator(False))
+        self.assertIsNot(table.validator(False), table.validator(True))
+
+        self.assertEquals((1, u'a', 2, 3.0, None, None), caster([1, 'a', '2', 3]))
+
+        # The hash is the same as the md5 of each value followed by '|'
+        def reference(values):
+            m = hashlib.md5()
+            for x in values[1:]:
+                try:
+                    m.update(x.encode('utf-8')+'|')
+                except:
+                    m.update(str(x)+'|')
+            return int(m.hexdigest()[:14], 16)
+
+        for row in ([1, u'text', u'3', u'4.5', u'x', u'y'], [1, u'caf\xe9', 3, 4.5, None, 'b\xc3\xa9']):
+            self.assertEquals(reference(row), table.row_hash(row))
+
+        # No mandatory columns, so every row is valid
+        self.assertTrue(table.validate_and([1, None, 0]))
+
+        # Changing the columns rebuilds everything
+        table.columns[2].data = {'mandatory': True}
+        table.columns[2].default = 0
+        table.columns[3].data = {'mandatory': True}
+        table.columns.append(Column(table, name='extra', datatype='integer', sequence_id = 7))
+
+        self.assertIsNot(caster, table.caster)
+        self.assertEquals(7, len(table.caster([1])))
+
+        row = [1, 't', 0, 2.5, None, None, None]
+        self.assertFalse(table.validate_and(row))
+        self.assertTrue(table.validate_or(row))
+        self.assertFalse(table.validate_or([1, 't', 0, None]))
+        self.assertTrue(table.validate_and([1, 't', 5, 2.0]))
+        self.assertEquals(len(table.null_row), len(table.null_dict))
+
+        # Changing a column's data in place needs an explicit clear
+        validator = table.validator(True)
+        table.columns[3].data['mandatory'] = False
+        self.assertIs(validator, table.validator(True))
+        table.clear_memo()
+        self.assertTrue(table.validate_and([1, 't', 5, None]))
+
+def _inserter(db, table, **kwargs):
+    from databundles.database.inserter import ValueInserter
+
+    return ValueInserter(db, None, table, **kwargs)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Test))
+    return suite
+
+if __name__ == "__main__":
+    unittest.TextTestRunner().run(suite())
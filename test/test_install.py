@@ -0,0 +1,345 @@
+import unittest
+import os
+import shutil
+import tempfile
+from  testbundle.bundle import Bundle
+from test_base import  TestBase  # @UnresolvedImport
+
+class Test(TestBase):
+
+    def setUp(self):
+        self.copy_or_build_bundle()
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def bundle(self, n_partitions):
+        '''The test bundle, with an install table and n_partitions partitions of it'''
+
+        b = Bundle()
+
+        with b.session:
+            t = b.schema.add_table('install')
+            b.schema.add_column(t, 'id', datatype = 'integer', is_primary_key = True)
+            b.schema.add_column(t, 'value', datatype = 'real', description = 'Median household incomes')
+
+        b.schema.create_tables()
+
+        for i in range(n_partitions):
+            p = b.partitions.find_or_new_db(table='install', space='s{}'.format(i))
+
+            with p.inserter() as ins:
+                for j in range(i * 10, i * 10 + 10 + i):
+                    ins.insert({'id': j, 'value': j / 2.0})
+
+        return b
+
+    def partitions(self, b):
+        '''The partitions of the install table'''
+        return [ p for p in b.partitions if p.identity.table == 'install' ]
+
+    def counts(self, b):
+        '''The numbers of tables, columns and partitions in the bundle'''
+        tables = b.schema.tables
+        return [ len(tables), sum(len(t.columns) for t in tables), len(list(b.partitions)) ]
+
+    def library(self, name, **cache):
+        from databundles.library import new_library
+
+        fs = {'dir': os.path.join(self.dir, name, 'cache')}
+        fs.update(cache)
+
+        config = {
+            '_name': name,
+            'filesystem': fs,
+            'database': {'driver': 'sqlite', 'dbname': os.path.join(self.dir, name, 'library.db')}
+        }
+
+        return new_library(config, True)
+
+    def test_write_stats(self):
+        '''Partitions without collected stats are scanned by worker processes'''
+
+        b = self.bundle(6)
+
+        # Partitions with collected stats are written in this process
+        b.post_build_write_stats()
+
+        counts = dict((p.identity.vid, p.record.count) for p in self.partitions(b))
+        self.assertEquals(sorted(10 + i for i in range(6)), sorted(counts.values()))
+
+        # Forget the collected stats, so all of the partitions are scanned
+        b.partitions.collected_stats.clear()
+
+        with b.session as s:
+            for p in self.partitions(b):
+                p.record.count = None
+                s.merge(p.record)
+
+        b.post_build_write_stats(n_workers = 3)
+
+        for p in self.partitions(b):
+            self.assertEquals(counts[p.identity.vid], p.record.count)
+            self.assertEquals(p.record.min_key + p.record.count - 1, p.record.max_key)
+            self.assertEquals(p.record.count, p.stats['id'].count)
+
+    def test_put_partitions(self):
+        from databundles.orm import File
+        from databundles.util import md5_for_file
+
+        b = self.bundle(12)
+        b.post_build_write_stats()
+
+        for l in (self.library('plain'), self.library('limited', size = 1000)):
+
+            l.put(b)
+
+            self.assertEquals(l.cache.thread_safe, not l.cache.__class__.__name__ == 'FsLimitedCache')
+
+            partitions = self.partitions(b)
+
+            results = list(l.put_partitions(b, partitions, n_workers = 4, batch_size = 5))
+
+            self.assertEquals(set(p.identity.vid for p in partitions),
+                              set(p.identity.vid for p, _, _, _ in results))
+
+            for p, dst, cache_key, url in results:
+                self.assertTrue(os.path.exists(dst))
+                self.assertEquals(p.identity.cache_key, cache_key)
+
+                f = l.database.session.query(File).filter(File.path == dst).one()
+                self.assertEquals(p.identity.vid, f.ref)
+                self.assertEquals(md5_for_file(dst), f.content_hash)
+
+                ds, pt = l.database.get_id(p.identity.vid)
+                self.assertEquals(p.identity.vid, pt.vid)
+
+            r = l.get(partitions[3].identity.vid)
+            self.assertEquals(13, r.partition.query("SELECT count(*) FROM install").fetchone()[0])
+
+    def test_install_bundle(self):
+        '''The bulk install writes the same records as merging them one at a time'''
+        from databundles.orm import Table, Column, Partition
+
+        b = self.bundle(5)
+
+        def records(l):
+            s = l.database.session
+            return [ sorted( tuple( (c.name, v) for c, v in zip(o.__table__.columns, row) )
+                             for row in s.execute(o.__table__.select()).fetchall() )
+                     for o in (Table, Column, Partition) ]
+
+        merged = self.library('merged')
+        merged.database.install_bundle(b, bulk = False)
+
+        bulk = self.library('bulk')
+        bulk.database.install_bundle(b)
+
+        self.assertEquals(records(merged), records(bulk))
+        self.assertEquals(self.counts(b), [ len(r) for r in records(bulk) ])
+
+        # Installing again replaces the records
+        bulk.database.install_bundle(b)
+        self.assertEquals(records(merged), records(bulk))
+
+    def test_dump_restore(self):
+        '''Dump and restore a library, by attaching the databases and by streaming rows'''
+        from databundles.orm import Dataset, Table, Column, Partition, Config
+
+        b = self.bundle(5)
+
+        def records(db):
+            s = db.session
+            r = [ sorted( tuple(row) for row in s.execute(o.__table__.select()).fetchall() )
+                  for o in (Dataset, Table, Column, Partition) ]
+            db.close_session()
+            return r
+
+        l = self.library('dumped')
+        l.put(b)
+
+        expected = records(l.database)
+        self.assertEquals([2] + self.counts(b), [ len(r) for r in expected ])
+
+        path = os.path.join(self.dir, 'dump.db')
+        l.database.dump(path)
+
+        # Restoring replaces the records that are already in the library
+        restored = self.library('restored')
+        restored.put(b)
+        restored.database.restore(path)
+        self.assertEquals(expected, records(restored.database))
+        self.assertIsNotNone(restored.database.get_config_value('activity', 'restore'))
+
+        # The same copy, streamed in small chunks
+        streamed = self.library('streamed')
+        streamed.database._stream_copy(l.database, streamed.database,
+                                       l.database._copy_tables(l.database, streamed.database), 2)
+        self.assertEquals(expected, records(streamed.database))
+
+        s = streamed.database.session
+        self.assertEquals(1, s.query(Config).filter(Config.group == 'activity', Config.key == 'dump').count())
+
+    def test_search(self):
+        '''Full text search finds records that are installed, ranked by where they match'''
+        from databundles.library import QueryCommand
+
+        b = self.bundle(3)
+        b.post_build_write_stats()
+
+        l = self.library('search')
+        l.put(b)
+
+        self.assertTrue(l.database.has_search_index)
+
+        # Stemmed match on the column description
+        r = l.database.search('income')
+        self.assertEquals(['column'], [ o['type'] for o in r ])
+        self.assertEquals('value', r[0]['column']['name'])
+        self.assertEquals('install', r[0]['table']['name'])
+        self.assertEquals(b.identity.vid, r[0]['identity']['vid'])
+
+        # Name matches rank above the description match
+        l.database.connection.execute("UPDATE columns SET c_description = 'An install' WHERE c_name = 'id'")
+        l.database.rebuild_search_index()
+
+        r = l.database.search('install')
+        self.assertEquals(['column', 'partition', 'table'], sorted(set(o['type'] for o in r)))
+        self.assertEquals('column', r[-1]['type'])
+        self.assertEquals(['dataset'], [ o['type'] for o in l.database.search('variation', types=['dataset']) ])
+
+        # Installing the partitions replaces their records
+        self.assertEquals(1, len(l.database.search('s1')))
+
+        for p in self.partitions(b):
+            l.put(p)
+
+        # Each row of the search index has a docs row, to find it by vid
+        count = lambda t: l.database.connection.execute("SELECT count(*) FROM {}".format(t)).fetchone()[0]
+        self.assertEquals(count(l.database.SEARCH_TABLE), count(l.database.SEARCH_DOCS_TABLE))
+        self.assertEquals(self.counts(b)[2], l.database.connection.execute("SELECT count(*) FROM {} WHERE type = 'partition'"
+                                                                           .format(l.database.SEARCH_TABLE)).fetchone()[0])
+
+        r = l.find(QueryCommand().text(any='s1'))
+        self.assertEquals(['partition'], [ o['type'] for o in r ])
+        self.assertEquals([ p.identity.vid for p in b.partitions if p.identity.space == 's1' ], [r[0]['partition']['vid']])
+
+        # With other terms, the text is a filter on the names
+        r = l.find(QueryCommand().partition(any=True).text(any='s1'))
+        self.assertEquals([ p.identity.vid for p in b.partitions if p.identity.space == 's1' ],
+                          [ o['partition']['vid'] for o in r ])
+        self.assertEquals([], l.find(QueryCommand().identity(vid=b.identity.vid).text(any='nomatch')))
+
+        # Restoring a dump rebuilds the index, and removing the bundle drops its records
+        path = os.path.join(self.dir, 'dump.db')
+        l.database.dump(path)
+
+        restored = self.library('restored')
+        restored.database.restore(path)
+        self.assertEquals(len(l.database.search('install OR s1')), len(restored.database.search('install OR s1')))
+
+        l.database.remove_bundle(b)
+        self.assertEquals([], l.database.search('install'))
+
+    def test_rebuild(self):
+        '''An incremental rebuild only re-installs the bundles that changed'''
+        import sqlite3
+        import time
+        from databundles.identity import DatasetNumber
+        from databundles.orm import Dataset
+
+        template = self.bundle(0)
+        template.database.close()
+
+        l = self.library('rebuild')
+
+        cache_dir = os.path.join(l.cache.cache_dir, 'test')
+        os.makedirs(cache_dir)
+
+        # Copies of the template, each with its own identity, and without the 
+        # tables and partitions, which would have the same vids in each of them
+        paths = []
+        for i in range(20):
+            path = os.path.join(cache_dir, 'rebuild-{}.db'.format(i))
+            shutil.copy(template.database.path, path)
+
+            id_ = str(DatasetNumber(10000 + i))
+            vid = str(DatasetNumber(10000 + i, 1))
+            vname = 'test-install-{}-orig-test-r1'.format(i)
+
+            db = sqlite3.connect(path)
+            db.execute("DELETE FROM partitions")
+            db.execute("DELETE FROM columns")
+            db.execute("DELETE FROM tables")
+            db.execute("UPDATE datasets SET d_vid = ?, d_id = ?, d_name = ?, d_vname = ?",
+                       (vid, id_, 'test-install-{}-orig-test'.format(i), vname))
+            db.execute("UPDATE config SET co_d_vid = ? WHERE co_d_vid = ?", (vid, template.identity.vid))
+            db.execute("UPDATE config SET co_value = ? WHERE co_group = 'bundle' AND co_key = 'vid'", ('"{}"'.format(vid),))
+            db.execute("UPDATE config SET co_value = ? WHERE co_group = 'bundle' AND co_key = 'vname'", ('"{}"'.format(vname),))
+            db.commit()
+            db.close()
+
+            paths.append(path)
+
+        def datasets():
+            n = l.database.session.query(Dataset).filter(Dataset.id_ != 'a0').count()
+            l.database.close_session()
+            return n
+
+        # A full rebuild doesn't hash the files
+        self.assertEquals(20, len(l.rebuild()))
+        self.assertEquals(20, datasets())
+        self.assertFalse(any(md5 for _, _, md5, _, _ in l.database.manifest(l.cache.repo_id).values()))
+
+        # An incremental rebuild hashes the files that aren't in the manifest
+        l.database.clean()
+
+        bundles = l.rebuild(incremental = True)
+        self.assertEquals(20, len(bundles))
+        self.assertEquals(20, datasets())
+
+        manifest = l.database.manifest(l.cache.repo_id)
+        self.assertEquals(20, len(manifest))
+        self.assertTrue(all(md5 for _, _, md5, _, _ in manifest.values()))
+
+        # Nothing changed
+        self.assertEquals([], l.rebuild(incremental = True))
+
+        # Change the content of three bundles, only the modification time
+        # of two, and delete one.
+        changed = paths[10:13]
+        for path in changed:
+            db = sqlite3.connect(path)
+            db.execute("UPDATE datasets SET d_data = '{\"changed\": 1}'")
+            db.commit()
+            db.close()
+            os.utime(path, (time.time() + 10, time.time() + 10))
+
+        touched = paths[14:16]
+        for path in touched:
+            os.utime(path, (time.time() + 10, time.time() + 10))
+
+        os.remove(paths[18])
+
+        bundles = l.rebuild(incremental = True)
+
+        self.assertEquals(sorted(changed), sorted(b.database.path for b in bundles))
+        self.assertEquals(19, datasets())
+
+        manifest = l.database.manifest(l.cache.repo_id)
+        self.assertEquals(19, len(manifest))
+        self.assertNotIn(paths[18], manifest)
+
+        for path in touched:
+            self.assertEquals(int(os.stat(path).st_mtime), manifest[path][1])
+
+        self.assertEquals([], l.rebuild(incremental = True))
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Test))
+    return suite
+
+if __name__ == "__main__":
+    unittest.TextTestRunner().run(suite())
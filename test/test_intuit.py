@@ -0,0 +1,126 @@
+import unittest
+
+def intuit(rows):
+    '''The memo from Schema.intuit(), which doesn't use the schema'''
+    from databundles.schema import Schema
+
+    memo = None
+    for row in rows:
+        memo = Schema.intuit.__func__(None, row, memo)
+
+    return memo
+
+class Test(unittest.TestCase):
+
+    def rows(self, n):
+        '''Rows with an integer, a float, a string, a column with '-' and
+        blanks, a column with a string in the middle, and one with a float
+        in every tenth row'''
+
+        for i in range(n):
+            yield (i, '{:.2f}'.format(i / 3.0) if i % 3 else i * 1e6, u'name {}'.format(i),
+                   '-' if i % 5 == 0 else ' {} '.format(i) if i % 5 == 1 else '',
+                   'N/A' if i == n / 2 else str(i),
+                   str(i + .5) if i % 10 == 0 else str(i))
+
+    def test_classify(self):
+        '''The batch classifier gets the same types and lengths as intuit()'''
+        from databundles.intuit import intuit_rows, classify
+
+        rows = list(self.rows(5000))
+        rows.append((None, '1e-3', u'caf\xe9', 'b\xc3\xa9', '+7', '-.5'))
+
+        expected = intuit(rows)
+        memo = intuit_rows(rows, chunk_size=1000)
+
+        self.assertEquals(len(rows), memo['rows'])
+
+        # intuit() stops measuring a column once it is a string, so only the
+        # lengths of the numeric columns are the same
+        for e, f in zip(expected['fields'], memo['fields']):
+            self.assertEquals(e['type'], f['type'], f)
+            self.assertEquals(1.0, f['confidence'])
+            if f['type'] is str:
+                self.assertTrue(f['length'] >= e['length'])
+            else:
+                self.assertEquals(e['length'], f['length'], f)
+
+        self.assertEquals(len(u'name 4999'), memo['fields'][2]['length'])
+
+        self.assertEquals([int, float, str, str, str, float], [ f['type'] for f in memo['fields'] ])
+
+        # Values with line breaks, and with only nulls
+        c = classify(['1\n2', '3', None, ' - '])
+        self.assertEquals((1, 1, 2), (c['strs'], c['ints'], c['nulls']))
+        self.assertEquals(int, intuit_rows([(None,), ('',)])['fields'][0]['type'])
+
+        # Dict rows
+        memo = intuit_rows([ dict(zip(('a', 'b'), row[:2])) for row in rows[:100] ])
+        self.assertEquals({'a': 0, 'b': 1}, dict((k, memo['name_index'][k]) for k in ('a', 'b')))
+        self.assertEquals(float, memo['fields'][memo['name_index']['b']]['type'])
+
+    def test_sample_rows(self):
+        '''The sample is the head, the tail and a reservoir of the rows between'''
+        from databundles.intuit import sample_rows
+
+        sample, n = sample_rows(iter(range(100000)), head=100, tail=50, size=1000, seed=1)
+
+        self.assertEquals(100000, n)
+        self.assertEquals(1150, len(sample))
+        self.assertEquals(range(100), sample[:100])
+        self.assertEquals(range(100000 - 50, 100000), sample[-50:])
+        self.assertEquals(1150, len(set(sample)))
+
+        middle = sample[100:-50]
+        self.assertTrue(all(100 <= x < 100000 - 50 for x in middle))
+
+        # Spread over the middle rows
+        self.assertTrue(20000 < sum(middle) / len(middle) < 80000)
+
+        sample, n = sample_rows(range(10), head=5, tail=5, size=5)
+        self.assertEquals((range(10), 10), (sample, n))
+
+    def test_sample(self):
+        '''Sampled columns with conflicting types are scanned, and the others
+        have a confidence'''
+        from databundles.intuit import intuit_rows
+
+        rows = list(self.rows(100000))
+
+        memo = intuit_rows(rows, sample=True, head=500, tail=500, size=2000, seed=3)
+        fields = memo['fields']
+
+        self.assertEquals([int, float, str, int, int, float], [ f['type'] for f in fields ])
+
+        # The 'N/A' in the middle isn't in the sample
+        self.assertFalse(fields[4]['scanned'])
+        self.assertTrue(0.99 < fields[4]['confidence'] < 1.0)
+
+        # Floats and integers, so the column is scanned
+        self.assertTrue(fields[5]['conflict'])
+        self.assertTrue(fields[5]['scanned'])
+        self.assertEquals(1.0, fields[5]['confidence'])
+        self.assertEquals(100000 / 10, fields[5]['counts']['floats'])
+
+        self.assertEquals(1.0, fields[2]['confidence'])
+
+        # A string in the tail is always in the sample
+        rows[-1] = rows[-1][:4] + ('N/A',) + rows[-1][5:]
+        memo = intuit_rows(rows, sample=True, head=500, tail=500, size=2000, seed=3)
+        self.assertEquals(str, memo['fields'][4]['type'])
+        self.assertTrue(memo['fields'][4]['scanned'])
+        self.assertEquals(2, memo['fields'][4]['counts']['strs'])
+
+        # A one-pass iterator can't be scanned again
+        memo = intuit_rows(iter(rows), sample=True, head=500, tail=500, size=2000, seed=3)
+        self.assertTrue(memo['fields'][5]['conflict'])
+        self.assertFalse(memo['fields'][5]['scanned'])
+        self.assertEquals(float, memo['fields'][5]['type'])
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Test))
+    return suite
+
+if __name__ == "__main__":
+    unittest.TextTestRunner().run(suite())
@@ -0,0 +1,114 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+
+class PluginDb(object):
+    '''Stands in for a LibraryDb'''
+
+    def __init__(self, dbname):
+        self.driver = 'sqlite'
+        self.dbname = dbname
+        self.sessions_closed = 0
+        self.closed = False
+
+    def close_session(self):
+        self.sessions_closed += 1
+
+    def close(self):
+        self.closed = True
+
+class PluginLibrary(object):
+    '''Stands in for a Library'''
+
+    def __init__(self, dbname):
+        self.database = PluginDb(dbname)
+
+    def clear_dependencies(self):
+        pass
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.dbname = os.path.join(self.dir, 'library.db')
+
+        with open(self.dbname, 'w') as f:
+            f.write('db')
+
+        self.created = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def creator(self):
+        l = PluginLibrary(self.dbname)
+        self.created.append(l)
+        return l
+
+    def wrap(self, plugin):
+
+        def handler(fail=False, library=None):
+            if fail:
+                raise ValueError("Handler failed")
+            return library
+
+        return plugin.apply(handler, {'config': {}, 'callback': handler})
+
+    def test_pool(self):
+        from databundles.server.main import LibraryPlugin
+
+        plugin = LibraryPlugin(self.creator)
+        handler = self.wrap(plugin)
+
+        l1 = handler()
+        self.assertIs(l1, handler())
+        self.assertEquals(2, l1.database.sessions_closed)
+
+        # Each thread gets its own library
+        other = []
+        t = threading.Thread(target = lambda: other.append(handler()))
+        t.start()
+        t.join()
+
+        self.assertIsNot(l1, other[0])
+
+        # A failed request discards the library
+        with self.assertRaises(ValueError):
+            handler(fail = True)
+
+        self.assertTrue(l1.database.closed)
+        l2 = handler()
+        self.assertIsNot(l1, l2)
+
+        # Writing to the database keeps the library, replacing the file recycles it
+        with open(self.dbname, 'a') as f:
+            f.write('more')
+
+        self.assertIs(l2, handler())
+
+        os.rename(self.dbname, self.dbname+'.old')
+        with open(self.dbname, 'w') as f:
+            f.write('new db')
+
+        l3 = handler()
+        self.assertIsNot(l2, l3)
+        self.assertTrue(l2.database.closed)
+
+        self.assertEquals(4, len(self.created))
+
+        plugin.close()
+        self.assertTrue(all(l.database.closed for l in self.created))
+
+        # Without the pool, each request gets a new library
+        handler = self.wrap(LibraryPlugin(self.creator, pool = False))
+        self.assertIsNot(handler(), handler())
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Test))
+    return suite
+
+if __name__ == "__main__":
+    unittest.TextTestRunner().run(suite())
@@ -0,0 +1,71 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def put(self, cache, rel_path, size):
+        from StringIO import StringIO
+
+        return cache.put(StringIO('x' * size), rel_path)
+
+    def test_lru(self):
+        from databundles.cache.filesystem import FsLimitedCache
+
+        # Size is in MB
+        cache = FsLimitedCache(os.path.join(self.dir, 'cache'), size = 1, access_batch = 3)
+
+        k = 1048578 / 10
+
+        for i in range(8):
+            self.put(cache, 'file{}'.format(i), k)
+
+        self.assertEquals(8 * k, cache.size)
+
+        # Replacing a file changes the total by the difference in size
+        self.put(cache, 'file7', 2 * k)
+        self.assertEquals(9 * k, cache.size)
+
+        # Accesses are batched. put() also accesses file7
+        cache.get('file0')
+        self.assertEquals(2, len(cache._accesses))
+        cache.get('file1')
+        self.assertEquals(0, len(cache._accesses))
+        cache.get('file2')
+        cache.get('file3')
+
+        # Adding 4 files pushes out the 3 least recently used, 4, 5 and 6
+        for i in range(8, 12):
+            self.put(cache, 'file{}'.format(i), k)
+
+        self.assertEquals(sorted(['file{}'.format(i) for i in (0, 1, 2, 3, 7, 8, 9, 10, 11)]),
+                          sorted(r[0] for r in cache.database.execute("SELECT path FROM files")))
+        self.assertFalse(os.path.exists(os.path.join(cache.cache_dir, 'file4')))
+        self.assertEquals(10 * k, cache.size)
+
+        cache.remove('file7')
+        self.assertEquals(8 * k, cache.size)
+
+        cache.verify()
+
+        # The total is rebuilt for databases that don't have it.
+        cache.database.execute("DROP TABLE file_total")
+        cache.database.commit()
+
+        cache = FsLimitedCache(os.path.join(self.dir, 'cache'), size = 1)
+        self.assertEquals(8 * k, cache.size)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Test))
+    return suite
+
+if __name__ == "__main__":
+    unittest.TextTestRunner().run(suite())
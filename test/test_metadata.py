@@ -0,0 +1,89 @@
+import unittest
+import os.path
+import shutil
+import tempfile
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def database(self):
+        from databundles.database.relational import RelationalDatabase
+
+        return RelationalDatabase(driver='sqlite', dbname=os.path.join(self.dir, 'meta.db'))
+
+    def count_reflections(self, db):
+        '''Count the PRAGMA table_info statements, which Sqlalchemy issues for
+        each table it reflects'''
+        from sqlalchemy import event
+
+        counts = {'table_info': 0}
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if 'table_info' in statement:
+                counts['table_info'] += 1
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+        return counts
+
+    def test_cache(self):
+        from sqlalchemy import MetaData, Table, Column, Integer, Text
+
+        db = self.database()
+
+        meta = MetaData()
+        for i in range(20):
+            Table('t{}'.format(i), meta, Column('id', Integer, primary_key=True), Column('name', Text))
+
+        meta.create_all(bind=db.engine)
+
+        counts = self.count_reflections(db)
+
+        # table() only reflects the requested table
+        t5 = db.table('t5')
+        self.assertEquals(['id', 'name'], [ c.name for c in t5.columns ])
+        self.assertEquals(1, counts['table_info'])
+
+        self.assertIs(t5, db.table('t5'))
+        self.assertEquals(1, counts['table_info'])
+
+        # metadata reflects the rest, once
+        self.assertEquals(20, len(db.metadata.tables))
+        self.assertEquals(20, counts['table_info'])
+        self.assertIs(t5, db.metadata.tables['t5'])
+
+        for i in range(20):
+            db.table('t{}'.format(i))
+        db.metadata
+
+        self.assertEquals(20, counts['table_info'])
+
+        # DDL through the database invalidates the cache
+        db.connection.execute('ALTER TABLE t5 ADD COLUMN extra INTEGER')
+        self.assertEquals(['id', 'name', 'extra'], [ c.name for c in db.table('t5').columns ])
+
+        db.drop_table('t6')
+        self.assertNotIn('t6', db.metadata.tables)
+
+        # So does DDL from another connection, through the schema version
+        import sqlite3
+        conn = sqlite3.connect(db.dbname)
+        conn.execute('CREATE TABLE other (a INTEGER)')
+        conn.commit()
+        conn.close()
+
+        self.assertIn('other', db.metadata.tables)
+        self.assertEquals(['a'], [ c.name for c in db.table('other').columns ])
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Test))
+    return suite
+
+if __name__ == "__main__":
+    unittest.TextTestRunner().run(suite())
@@ -0,0 +1,120 @@
+import unittest
+
+class Test(unittest.TestCase):
+
+    def geo_rows(self, n):
+        '''Rows like the values of a geo dim table: short codes and names,
+        with many values shared between rows'''
+
+        for i in range(n):
+            yield [None, '{:02d}'.format(i % 52), '{:03d}'.format(i % 997), '{:06d}'.format(i),
+                   u'Place {}'.format(i / 7), None]
+
+    def test_engines(self):
+        '''Each engine hashes a row the same way one at a time and in batches'''
+        import struct
+        from databundles.rowhash import new_hasher, fnv64, FNV64_OFFSET, FNV64_PRIME, MASK64
+
+        self.assertEquals((((FNV64_OFFSET ^ 0) * FNV64_PRIME) & MASK64) >> 8, fnv64(''))
+
+        rows = list(self.geo_rows(2000))
+        rows.append([None, 12, 3.5, 'caf\xc3\xa9', u'caf\xe9', None])
+
+        for engine in ('md5', 'fnv64'):
+            h = new_hasher(engine, [1, 2, 3, 4])
+            a = h.hash_rows(rows)
+            self.assertEquals([ h(row) for row in rows ], list(a))
+            self.assertTrue(all(x < 2**56 for x in a))
+
+        self.assertRaises(ValueError, new_hasher, 'crc', [1])
+
+        # Delimiters keep values from running together
+        h = new_hasher('fnv64', [0, 1])
+        self.assertNotEquals(h(['1', '23']), h(['12', '3']))
+        self.assertEquals(h(['1', 23]), h([u'1', '23']))
+
+        # With widths, the values are packed into fixed-width fields, and the
+        # hashes of unpacked records are the same as for the raw buffer
+        widths = [2, 3, 6, 13]
+        h = new_hasher('fnv64', [1, 2, 3, 4], widths)
+        self.assertTrue(h.fixed)
+        self.assertEquals(list(h.hash_rows(rows)), [ h(row) for row in rows ])
+
+        fmt = ''.join('{}s'.format(w) for w in widths) + '1s'
+        records = ''.join(struct.pack(fmt, *([ str(v) for v in row[1:5] ] + ['\n'])) for row in rows[:-1])
+        length = struct.calcsize(fmt)
+
+        unpacked = [ [None] + list(struct.unpack(fmt, records[i:i+length]))
+                     for i in range(0, len(records), length) ]
+
+        self.assertEquals([ h(row) for row in unpacked ], list(h.hash_records(records, length)))
+        self.assertEquals(list(h.hash_rows(rows[:-1])), list(h.hash_records(records, length)))
+
+        # Fields in a different order in the record
+        h2 = new_hasher('fnv64', [2, 1], [3, 2])
+        self.assertEquals(list(h2.hash_rows(unpacked)), list(h2.hash_records(records, length, offsets=[2, 0])))
+
+    def test_collisions(self):
+        '''No collisions in the 56 bit hashes of distinct rows, and the low
+        bits, used for dict and set buckets, are evenly distributed'''
+        import numpy as np
+        from databundles.rowhash import new_hasher
+
+        n = 500000
+        rows = list(self.geo_rows(n))
+
+        for engine, widths in (('fnv64', None), ('fnv64', [2, 3, 6, 13]), ('md5', None)):
+            h = new_hasher(engine, [1, 2, 3, 4], widths)
+
+            a = h.hash_rows(rows) if engine != 'md5' else h.hash_rows(rows[:50000])
+
+            self.assertEquals(len(a), len(np.unique(a)), engine)
+
+            buckets = np.bincount((a & np.uint64(0xfff)).astype(np.int64), minlength=4096)
+            mean = len(a) / 4096.0
+            self.assertLess(buckets.max(), mean + 6 * mean ** 0.5, engine)
+            self.assertGreater(buckets.min(), mean - 6 * mean ** 0.5, engine)
+
+    def test_table_engine(self):
+        '''The table's hash engine is set in the table data, and defaults to md5'''
+        from databundles.orm import Dataset, Table, Column
+        from databundles.rowhash import Md5Hasher, Fnv64Hasher
+
+        ds = Dataset(id='a1DxuZ', revision=1, name='source-dataset', vname='source-dataset-r1',
+                     source='source', dataset='dataset', creator='creator')
+
+        table = Table(ds, name='geo', sequence_id=1)
+
+        for i, (name, size) in enumerate([('id', None), ('state', 2), ('county', 3), ('hash', None)]):
+            table.columns.append(Column(table, name=name, datatype='text', size=size,
+                                        sequence_id=i + 1, is_primary_key=(name == 'id')))
+
+        row = [None, '06', '001', None]
+
+        self.assertEquals('md5', table.hash_engine)
+        self.assertIsInstance(table.hasher, Md5Hasher)
+        md5 = table.row_hash(row)
+
+        # row_hash() sees the change without reading table.hasher first
+        table.data = {'row_hash': 'fnv64'}
+        self.assertNotEquals(md5, table.row_hash(row))
+        self.assertEquals(table.hasher(row), table.row_hash(row))
+        self.assertIsInstance(table.hasher, Fnv64Hasher)
+
+        # The hash column has no size, so the values are delimited
+        self.assertFalse(table.hasher.fixed)
+
+        table.columns[3].data = {'hash': False}
+        for c in table.columns[1:3]:
+            c.data = {'hash': True}
+
+        self.assertTrue(table.hasher.fixed)
+        self.assertEquals(table.hasher(row), table.row_hash(row))
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Test))
+    return suite
+
+if __name__ == "__main__":
+    unittest.TextTestRunner().run(suite())
@@ -0,0 +1,181 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import BaseHTTPServer
+import SocketServer
+
+class FakeS3Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''Serves HEAD and GET requests, including byte ranges, for objects stored
+    as files under the server's root, with path-style URLs: /bucket/key '''
+
+    def log_message(self, format, *args):
+        pass
+
+    def _path(self):
+        return os.path.join(self.server.root, self.path.split('?')[0].lstrip('/'))
+
+    def _head(self):
+        path = self._path()
+
+        if os.path.isdir(path):
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+
+        if not os.path.exists(path):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+
+        range_ = self.headers.getheader('Range')
+        if range_ and self.command == 'GET':
+            start, end = [ int(x) for x in range_.replace('bytes=','').split('-') ]
+            end = min(end, size - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, size))
+        else:
+            self.send_response(200)
+
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('ETag', '"{}"'.format(size))
+        self.send_header('x-amz-meta-md5', 'fake')
+        self.end_headers()
+
+        self.server.requests.append((self.command, self.path, range_))
+
+        return path, start, end
+
+    def do_HEAD(self):
+        self._head()
+
+    def do_GET(self):
+        r = self._head()
+
+        if r:
+            path, start, end = r
+            with open(path, 'rb') as f:
+                f.seek(start)
+                self.wfile.write(f.read(end - start + 1))
+
+class FakeS3Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.dir, 'root')
+        os.makedirs(os.path.join(self.root, 'bucket', 'prefix'))
+
+        self.server = FakeS3Server(('127.0.0.1', 0), FakeS3Handler)
+        self.server.root = self.root
+        self.server.requests = []
+
+        t = threading.Thread(target = self.server.serve_forever)
+        t.setDaemon(True)
+        t.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def cache(self):
+        from databundles.cache.s3 import S3Cache
+
+        return S3Cache(bucket='bucket', prefix='prefix',
+                       account=dict(access='access', secret='secret',
+                                    host='127.0.0.1', port=self.server.server_address[1]))
+
+    def put(self, rel_path, data):
+        with open(os.path.join(self.root, 'bucket', 'prefix', rel_path), 'wb') as f:
+            f.write(data)
+
+    def test_stream(self):
+        import gzip
+
+        data = ''.join( '{:08d}\n'.format(i) for i in range(100000))
+        self.put('data.txt', data)
+
+        cache = self.cache()
+
+        self.assertIsNone(cache.get_stream('missing.txt'))
+
+        s = cache.get_stream('data.txt', return_meta = True)
+        self.assertEquals(len(data), s.meta['size'])
+
+        self.assertEquals(data[:10], s.read(10))
+        self.assertEquals(data[10:100010], s.read(100000))
+        s.seek(-5, 1)
+        self.assertEquals(data[100005:100020], s.read(15))
+        s.seek(500000)
+        self.assertEquals(data[500000:500010], s.read(10))
+        s.seek(0)
+        self.assertEquals('00000000\n', s.readline())
+        self.assertEquals('00000001\n', s.readline())
+        s.seek(-9, 2)
+        self.assertEquals('00099999\n', s.read())
+        self.assertEquals('', s.read())
+        s.close()
+
+        # Reading the whole object in small pieces uses one request
+        del self.server.requests[:]
+        s = cache.get_stream('data.txt')
+        self.assertEquals(data, ''.join(iter(lambda: s.read(4096), '')))
+        self.assertEquals(1, len([ r for r in self.server.requests if r[0] == 'GET']))
+
+        self.assertEquals(data[900:990], cache.get_range('data.txt', 900, 990))
+        self.assertEquals(data[-10:], cache.get_range('data.txt', len(data)-10))
+
+        s = cache.get_stream('data.txt', start = 1000, end = 2000)
+        self.assertEquals(data[1000:2000], s.read())
+        s.seek(10)
+        self.assertEquals(data[1010:1020], s.read(10))
+        self.assertEquals(20, s.tell())
+
+        # GzipFile seeks to the end of the stream and back.
+        gz_path = os.path.join(self.root, 'bucket', 'prefix', 'data.gz')
+        with open(gz_path, 'wb') as f:
+            gzf = gzip.GzipFile(fileobj = f, mode = 'wb')
+            gzf.write(data)
+            gzf.close()
+
+        gzf = gzip.GzipFile(fileobj = cache.get_stream('data.gz.gz'))
+        self.assertEquals(data, gzf.read())
+
+    def test_get_to_file(self):
+
+        data = os.urandom(1024*1024 + 17)
+        self.put('data.bin', data)
+
+        cache = self.cache()
+
+        progress = []
+        path = os.path.join(self.dir, 'local', 'data.bin')
+
+        self.assertEquals(path, cache.get_to_file('data.bin', path, n_threads = 4,
+                                                  chunk_size = 100000, cb = lambda n, size: progress.append(n)))
+
+        with open(path, 'rb') as f:
+            self.assertEquals(data, f.read())
+
+        self.assertEquals(len(data), max(progress))
+        self.assertFalse(os.path.exists(path+'.part'))
+        self.assertEquals(11, len([ r for r in self.server.requests if r[0] == 'GET']))
+
+        self.assertIsNone(cache.get_to_file('missing.bin', path))
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Test))
+    return suite
+
+if __name__ == "__main__":
+    unittest.TextTestRunner().run(suite())
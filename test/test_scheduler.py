@@ -0,0 +1,126 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+class SchedulerBundle(object):
+    '''Stands in for a BuildBundle; the scheduler only needs the bundle_dir and
+    the logging methods '''
+
+    def __init__(self, bundle_dir=None):
+        self.bundle_dir = bundle_dir
+        self.messages = []
+
+    def log(self, message, **kwargs):
+        self.messages.append(message)
+
+    def error(self, message, **kwargs):
+        self.messages.append(message)
+
+    def square(self, v):
+        return v * v
+
+    def pid(self):
+        return os.getpid()
+
+    def flaky(self, name, failures):
+        '''Fail the first `failures` times it is called, tracked in a file'''
+        path = os.path.join(self.bundle_dir, name)
+
+        with open(path, 'a') as f:
+            f.write('x')
+
+        if os.path.getsize(path) <= failures:
+            raise Exception("Flaky failure")
+
+        return os.path.getsize(path)
+
+    def fail(self):
+        raise ValueError("Always fails")
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def run_scheduler(self, n_workers):
+        from databundles.scheduler import TaskScheduler, Task
+
+        bundle = SchedulerBundle(self.dir)
+
+        s = TaskScheduler(bundle, n_workers = n_workers, poll_interval = .01)
+
+        for i in range(10):
+            s.add('square-{}'.format(i), 'square', i)
+
+        s.add('flaky', 'flaky', 'flaky-{}'.format(n_workers), 2, retries = 2)
+        s.add('after-flaky', 'square', 3, deps = ['flaky'])
+        s.add('fail', 'fail')
+        s.add('after-fail-2', 'square', 2, deps = ['after-fail'])
+        s.add('after-fail', 'square', 2, deps = ['fail', 'square-1'])
+        s.add('pid', 'pid', deps = [ 'square-{}'.format(i) for i in range(10) ])
+
+        self.assertFalse(s.run())
+
+        for i in range(10):
+            self.assertEquals(Task.DONE, s.tasks['square-{}'.format(i)].state)
+            self.assertEquals(i*i, s.tasks['square-{}'.format(i)].result)
+
+        self.assertEquals(3, s.tasks['flaky'].attempts)
+        self.assertEquals(3, s.tasks['flaky'].result)
+        self.assertEquals(9, s.tasks['after-flaky'].result)
+
+        self.assertEquals(Task.FAILED, s.tasks['fail'].state)
+        self.assertEquals(1, s.tasks['fail'].attempts)
+        self.assertIn('Always fails', s.tasks['fail'].error)
+        self.assertEquals(Task.SKIPPED, s.tasks['after-fail'].state)
+        self.assertEquals(Task.SKIPPED, s.tasks['after-fail-2'].state)
+
+        self.assertEquals(['fail', 'after-fail-2', 'after-fail'], [ t.name for t in s.failed ])
+
+        self.assertTrue(any( m.startswith('pid') for m in bundle.messages))
+
+        return s
+
+    def test_serial(self):
+
+        s = self.run_scheduler(None)
+
+        self.assertEquals(os.getpid(), s.tasks['pid'].result)
+
+    def test_pool(self):
+
+        s = self.run_scheduler(3)
+
+        self.assertNotEquals(os.getpid(), s.tasks['pid'].result)
+
+    def test_check(self):
+        from databundles.scheduler import TaskScheduler
+
+        s = TaskScheduler(SchedulerBundle(self.dir))
+
+        with self.assertRaises(ValueError):
+            s.add('bad', 'no_such_method')
+
+        s.add('a', 'square', 1, deps = ['b'])
+        s.add('b', 'square', 1, deps = ['a'])
+
+        with self.assertRaises(ValueError):
+            s.run()
+
+        s = TaskScheduler(SchedulerBundle(self.dir))
+        s.add('a', 'square', 1, deps = ['c'])
+
+        with self.assertRaises(ValueError):
+            s.run()
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Test))
+    return suite
+
+if __name__ == "__main__":
+    unittest.TextTestRunner().run(suite())
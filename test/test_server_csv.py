@@ -0,0 +1,86 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+class CsvPartition(object):
+    '''Stands in for a partition; the CSV functions only use query()'''
+
+    def __init__(self, path):
+        from sqlalchemy import create_engine
+
+        self.engine = create_engine('sqlite:///{}'.format(path))
+
+    def query(self, *args, **kwargs):
+        return self.engine.execute(*args, **kwargs)
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+        self.p = CsvPartition(os.path.join(self.dir, 'csv.db'))
+        self.p.query("CREATE TABLE foo (id INTEGER PRIMARY KEY, name TEXT, value INTEGER)")
+
+        # Leave gaps in the keys
+        self.rows = [ (i, u'name {}'.format(i), i % 7) for i in range(1, 2000) if i % 5 ]
+
+        self.p.engine.execute("INSERT INTO foo VALUES (?, ?, ?)", self.rows)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_pages(self):
+        from databundles.server.main import _keyset_pages, _key_range, _key_segment
+
+        pages = list(_keyset_pages(self.p, 'foo', 'id', page_size = 100))
+
+        self.assertEquals(16, len(pages))
+        self.assertEquals(self.rows, [ row for page in pages for row in page ])
+
+        pages = list(_keyset_pages(self.p, 'foo', 'rowid', where = 'value = :value',
+                                   params = {'value': 3}, page_size = 100))
+
+        self.assertEquals([ r for r in self.rows if r[2] == 3 ], [ row for page in pages for row in page ])
+
+        lo, hi = _key_range(self.p, 'foo', 'id')
+        self.assertEquals((1, 1999), (lo, hi))
+
+        # The segments cover all of the rows, without overlap
+        rows = []
+        for i in range(1, 8):
+            start, end = _key_segment(lo, hi, i, 7)
+            for page in _keyset_pages(self.p, 'foo', 'id', start, end, page_size = 33):
+                rows.extend(page)
+
+        self.assertEquals(self.rows, rows)
+
+    def test_chunks(self):
+        import zlib
+        import unicodecsv as csv
+        from StringIO import StringIO
+        from databundles.server.main import _keyset_pages, _csv_chunks
+
+        out = StringIO()
+        w = csv.writer(out, delimiter = '|')
+        w.writerow(('id','name','value'))
+        w.writerows(self.rows)
+
+        chunks = list(_csv_chunks(_keyset_pages(self.p, 'foo', 'id', page_size = 500),
+                                  header = ('id','name','value')))
+
+        self.assertEquals(4, len(chunks))
+        self.assertEquals(out.getvalue(), ''.join(chunks))
+
+        chunks = _csv_chunks(_keyset_pages(self.p, 'foo', 'id', page_size = 500),
+                             header = ('id','name','value'), compress = True)
+
+        self.assertEquals(out.getvalue(), zlib.decompress(''.join(chunks), 16 + zlib.MAX_WBITS))
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Test))
+    return suite
+
+if __name__ == "__main__":
+    unittest.TextTestRunner().run(suite())
@@ -0,0 +1,142 @@
+import unittest
+import datetime
+from  testbundle.bundle import Bundle
+from test_base import  TestBase  # @UnresolvedImport
+
+class Test(TestBase):
+
+    def setUp(self):
+        self.copy_or_build_bundle()
+
+    def bundle(self):
+        '''The test bundle, with a table that has a column for each datatype'''
+
+        b = Bundle()
+
+        with b.session:
+            t = b.schema.add_table('stats')
+            for col_name, datatype in [('id','integer'), ('text','text'), ('real','real'), ('date','date')]:
+                b.schema.add_column(t, col_name, datatype = datatype, is_primary_key = (col_name == 'id'))
+
+        b.schema.create_tables()
+
+        return b
+
+    def rows(self, n):
+
+        for i in range(n):
+            yield {
+                'id': i+1,
+                'text': u'text {}'.format(i % 500) if i % 4 else None,
+                'real': (i % 100) / 4.0,
+                'date': datetime.date(2000 + i % 10, 1 + i % 12 , 1 + i % 28 )
+                }
+
+    def test_hyperloglog(self):
+        from databundles.stats import HyperLogLog
+
+        for n in (10, 1000, 200000):
+            hll = HyperLogLog()
+            hll.add(range(n))
+            hll.add(range(n)) # Duplicates don't count
+
+            self.assertAlmostEqual(1.0, hll.estimate() / float(n), delta = 0.05)
+
+        a, b = HyperLogLog(), HyperLogLog()
+        a.add([ u'a{}'.format(i) for i in range(50000) ])
+        b.add([ u'a{}'.format(i) for i in range(25000, 75000) ])
+        a.merge(b)
+
+        self.assertAlmostEqual(1.0, a.estimate() / 75000.0, delta = 0.05)
+
+    def test_column_stats(self):
+        from databundles.stats import ColumnStats
+
+        cs = ColumnStats('x', numeric = True, sample_size = 1000)
+
+        for i in range(10):
+            cs.add([ j if j % 10 else None for j in range(i*1000, (i+1)*1000) ])
+
+        self.assertEquals(10000, cs.count)
+        self.assertEquals(1000, cs.nulls)
+        self.assertEquals(1, cs.min)
+        self.assertEquals(9999, cs.max)
+        self.assertAlmostEqual(1.0, cs.nuniques / 9000.0, delta = 0.05)
+
+        h = cs.histogram
+
+        self.assertEquals(cs.HIST_BINS, len(h['counts']))
+        self.assertEquals(1, h['bins'][0])
+        self.assertEquals(9999, h['bins'][-1])
+        self.assertAlmostEqual(9000, sum(h['counts']), delta = 20)
+
+        # The values are uniform, so the bins should be nearly equal.
+        for c in h['counts']:
+            self.assertAlmostEqual(450, c, delta = 200)
+
+    def test_write_stats(self):
+        '''Statistics collected by the inserter match statistics from a scan of the table'''
+
+        b = self.bundle()
+
+        p = b.partitions.find_or_new_db(table='stats')
+
+        with p.inserter() as ins:
+            for row in self.rows(5000):
+                ins.insert(row)
+
+        # Positional rows go to the same statistics
+        with p.inserter() as ins:
+            for row in self.rows(7000):
+                if row['id'] > 5000:
+                    ins.insert((row['id'], row['text'], row['real'], row['date']))
+
+        collected = p.collected_stats
+
+        self.assertTrue(collected.valid)
+        self.assertEquals(7000, collected.count)
+
+        p.write_stats()
+
+        self.assertEquals(7000, p.record.count)
+        self.assertEquals(1, p.record.min_key)
+        self.assertEquals(7000, p.record.max_key)
+
+        scanned = p.compute_stats()
+
+        for name in ('id', 'text', 'real', 'date'):
+            c, s = collected[name], scanned[name]
+            self.assertEquals((c.count, c.nulls, c.min, c.max, c.nuniques),
+                              (s.count, s.nulls, s.min, s.max, s.nuniques), name)
+
+        stats = p.stats
+
+        self.assertEquals(set(['id', 'text', 'real', 'date']), set(stats.keys()))
+        self.assertEquals(7000, stats['id'].count)
+        self.assertEquals(1750, stats['text'].nulls)
+        self.assertEquals(u'text 1', stats['text'].min)
+        self.assertEquals(u'2000-01-01', stats['date'].min)
+        self.assertAlmostEqual(375, stats['text'].nuniques, delta = 20)
+        self.assertAlmostEqual(100, stats['real'].nuniques, delta = 5)
+        self.assertEquals(7000, sum(stats['real'].hist['counts']))
+        self.assertFalse(stats['text'].hist)
+
+        self.assertEquals(p.identity.vid, stats['id'].p_vid)
+        self.assertEquals(b.schema.table('stats').column('id').vid, stats['id'].c_vid)
+
+        # Rows written outside of an inserter are found with the count check
+        p.database.connection.execute("DELETE FROM stats WHERE id > 6000")
+
+        p.write_stats()
+
+        self.assertEquals(6000, p.record.count)
+        self.assertEquals(6000, p.stats['id'].count)
+        self.assertEquals(u'6000', p.stats['id'].max)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(Test))
+    return suite
+
+if __name__ == "__main__":
+    unittest.TextTestRunner().run(suite())
@@ -120,6 +120,43 @@ class Test(TestBase):
         self.assertEquals(row['time'],datetime.time(10, 52))
         self.assertEquals(row['datetime'],datetime.datetime(1990, 1, 1, 12, 30))
         
+    def test_list_caster(self):
+        from databundles.transform import CasterTransformBuilder
+        import datetime
+        
+        ctb = CasterTransformBuilder()
+        
+        ctb.append('int',int)
+        ctb.append('float',float)
+        ctb.append('str',str)
+        ctb.append('date',datetime.date)
+        ctb.append('time',datetime.time)
+        ctb.append('datetime',datetime.datetime)   
+        
+        row = ctb(('1', '2.5', 3, '1990-01-01', '10:52', '1990-01-01T12:30'))
+        
+        self.assertTrue(isinstance(row, tuple))
+        self.assertEquals((1, 2.5, u'3', datetime.date(1990, 1, 1), datetime.time(10, 52), 
+                           datetime.datetime(1990, 1, 1, 12, 30)), row)
+        self.assertTrue(isinstance(row[2],unicode))
+        
+        # Should be idempotent
+        self.assertEquals(row, ctb(row))
+        self.assertEquals(row, ctb(list(row)))
+        
+        # Same values as the dict caster
+        names = [ name for name, type_ in ctb.types ]
+        d = ctb(dict(zip(names, ('1.6', '', ' - ', None, '', '1990-01-01T12:30'))))
+        self.assertEquals(tuple(d[name] for name in names), 
+                          ctb(('1.6', '', ' - ', None, '', '1990-01-01T12:30')))
+        
+        # Short rows are padded with None
+        self.assertEquals((1, None, None, None, None, None), ctb((1,)))
+        
+        with self.assertRaises(TypeError) as cm:
+            ctb(('1', 'two', 3, None, None, None))
+        
+        self.assertIn('float', str(cm.exception))
         
     def test_intuit(self):
         import pprint